@@ -38,6 +38,7 @@ def parse_parameters():
     parser.add_option("-l", "--logtype", dest="logtype", help="Specify the type of logging you want (\"file\" or \"screen\"). If not specified \"file\" will be the default.", metavar="LOG_TIPE_VALUE")
     parser.add_option("-v", "--verbose", action="store_true", dest="verbose", help='Use this parameter if a verbose execution is needed ')
     parser.add_option("-u", "--uploadmode", dest="uploadmode", help="Specify the method of upload (\"concurrent\" or \"bibupload\") ", metavar="UPLOADMODE_VALUE")
+    parser.add_option("-c", "--converter", dest="converter", help="Specify the converter from ADS XML to bibrecord (\"xslt\" or \"native\"). If not specified the one in the settings will be used.", metavar="CONVERTER_VALUE")
 
     # catch the parameters from the command line
     options, _ = parser.parse_args()
@@ -73,6 +74,15 @@ def parse_parameters():
     else:
         parameters['uploadmode'] = 'concurrent'
     
+    if options.converter:
+        if options.converter in ('xslt', 'native',):
+            parameters['converter'] = options.converter
+        else:
+            parser.print_help()
+            return None
+    else:
+        parameters['converter'] = pipeline_settings.ADS_XML_CONVERTER
+    
     if options.verbose:
         parameters['verbose'] = True
     else:
@@ -100,7 +110,7 @@ def main():
     if not parameters['verbose']:
         logger.setLevel(logging.WARNING)
     #I call the global manager
-    pipeline_manager.manage(parameters['mode'], parameters['uploadmode'])
+    pipeline_manager.manage(parameters['mode'], parameters['uploadmode'], parameters['converter'])
 
 if __name__ == "__main__":
     main()
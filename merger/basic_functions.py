@@ -21,7 +21,7 @@ File containing all the basic functions
 import re
 
 from merger_settings import DEFAULT_PRIORITY_LIST, FIELDS_PRIORITY_LIST, \
-        MARC_TO_FIELD, PRIORITIES, ORIGIN_SUBFIELD
+        MARC_TO_FIELD, PRIORITIES, ORIGIN_SUBFIELD, ORIGIN_IMPORTANCE_CACHE_SIZE
 from merger_errors import OriginNotFound, OriginValueNotFound
 import invenio.bibrecord as bibrecord
 
@@ -68,34 +68,77 @@ def get_origin(fields):
 
     return origin
 
+#table of the importance of each single origin for each priority list
+ORIGIN_IMPORTANCE_TABLE = dict(((priority_list_name, origin), value)
+    for priority_list_name, priority_list in PRIORITIES.items()
+    for origin, value in priority_list.items())
+
+#name of the priority list to use for each marc tag
+TAG_PRIORITY_LIST = dict((tag, FIELDS_PRIORITY_LIST.get(field_name, DEFAULT_PRIORITY_LIST))
+    for tag, field_name in MARC_TO_FIELD.items())
+
+#cache of the importance of the origin strings (also the ones with multiple origins)
+#and statistics about its usage
+_origin_importance_cache = {}
+ORIGIN_IMPORTANCE_CACHE_STATS = {'hits': 0, 'misses': 0}
+
 def get_origin_importance(tag, origins):
     """function that returns the value of the importance of an origin
     if multiple origin are present, the one with the highest value is returned"""
-    # Split the string in a list of origins
-    origin_list = origins.split(';')
+    try:
+        value = _origin_importance_cache[(tag, origins)]
+    except KeyError:
+        ORIGIN_IMPORTANCE_CACHE_STATS['misses'] += 1
+    else:
+        ORIGIN_IMPORTANCE_CACHE_STATS['hits'] += 1
+        return value
+
+    #first of all I try to see if there is a specific list
+    #otherwise I use the default one
+    priority_list_name = TAG_PRIORITY_LIST.get(tag, DEFAULT_PRIORITY_LIST)
     #default value
     value = 0
-
-    for origin in origin_list:
+    # Split the string in a list of origins
+    for origin in origins.split(';'):
         origin = origin.strip().upper()
-        #first of all I try to see if there is a specific list
-        #otherwise I use the default one
         try:
-            priority_list_name = FIELDS_PRIORITY_LIST[MARC_TO_FIELD[tag]]
+            cur_value = ORIGIN_IMPORTANCE_TABLE[(priority_list_name, origin)]
         except KeyError:
-            priority_list_name = DEFAULT_PRIORITY_LIST
-        
-        priority_list = PRIORITIES[priority_list_name]
-
-        if origin in priority_list:
-            cur_value = priority_list[origin]
-        else:
             raise OriginValueNotFound('Priority value not found for origin "%s"' % origin)
-
         if cur_value > value:
             value = cur_value
+
+    #the cache is bounded: if it is full I empty it
+    if len(_origin_importance_cache) >= ORIGIN_IMPORTANCE_CACHE_SIZE:
+        _origin_importance_cache.clear()
+    _origin_importance_cache[(tag, origins)] = value
     return value
 
+def get_origin_importance_cache_info():
+    """function that returns the statistics of the cache of the origin importance"""
+    hits = ORIGIN_IMPORTANCE_CACHE_STATS['hits']
+    misses = ORIGIN_IMPORTANCE_CACHE_STATS['misses']
+    return {'hits': hits,
+            'misses': misses,
+            'hit_rate': float(hits) / (hits + misses) if hits + misses else 0.0,
+            'size': len(_origin_importance_cache),
+            'max_size': ORIGIN_IMPORTANCE_CACHE_SIZE}
+
+def clear_origin_importance_cache():
+    """function that empties the cache of the origin importance and resets its statistics"""
+    _origin_importance_cache.clear()
+    ORIGIN_IMPORTANCE_CACHE_STATS['hits'] = 0
+    ORIGIN_IMPORTANCE_CACHE_STATS['misses'] = 0
+
+def field_get_first_subfield_value(field, code):
+    """Returns the value of the first subfield with the given code.
+    Works like bibrecord.field_get_subfield_values(field, code)[0]
+    without building the list of all the values"""
+    for subfield in field[0]:
+        if subfield[0] == code:
+            return subfield[1]
+    raise IndexError('Subfield "%s" not found' % code)
+
 def compare_fields_exclude_subfiels(field1, field2, strict=True, exclude_subfields=[]):
     """
     Works exactly like bibrecord._compare_fields with the only difference that 
@@ -112,9 +155,3 @@ def compare_fields_exclude_subfiels(field1, field2, strict=True, exclude_subfiel
             # Compare subfields in a loose way.
             return set([subfield for subfield in field1[0] if subfield[0] not in exclude_subfields ]) \
                 == set([subfield for subfield in field2[0] if subfield[0] not in exclude_subfields ])
-                
-def record_delete_subfield(rec, tag, subfield_code):
-    """Deletes all subfields with subfield_code in the record.
-    without considering the indicators"""
-    for field in rec.get(tag, []):
-        field[0][:] = [subfield for subfield in field[0] if subfield_code != subfield[0]]
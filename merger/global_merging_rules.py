@@ -21,45 +21,52 @@ Some mergings cannot be done based only on one single type of fields,
 but they have to based on multiple field type.
 The solution is taking all the fields that cannot be merged during 
 a simple merging function and normalize the necessary fields.
+
+The global merging functions never modify the record they receive:
+they return a new record that shares with the old one all the fields
+that have not been changed, so that only the modified fields are copied.
 '''
 
-from copy import deepcopy
 import logging
 
 from invenio import bibrecord
 
 from merger_settings import ORIGIN_SUBFIELD, FIELD_TO_MARC, CREATION_DATE_SUBFIELD, \
                         MODIFICATION_DATE_SUBFIELD, GLOBAL_MERGING_CHECKS, TEMP_SUBFIELDS_LIST
-from basic_functions import get_origin_importance, record_delete_subfield
+from basic_functions import get_origin_importance
 from merger_errors import GenericError
+from merging_plan import compile_global_merging_checks
 import pipeline_settings
 import global_merging_checks
 
 logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
 
+#global checks resolved once from the settings: list of (type of check, function)
+GLOBAL_CHECKS_PLAN = compile_global_merging_checks(GLOBAL_MERGING_CHECKS)
+
 def run_global_checks(func):
     """Decorator that retrieves and runs the functions 
     to apply to any merging rule"""
     def checks_wrapper(merged_record):
         #I get the result of the wrapped function
         final_result =  func(merged_record)
-        if len(GLOBAL_MERGING_CHECKS) == 0:
-            return final_result
         #for each warning and error I pass the final_result and all the parameters to the function
-        for type_check, func_ck_list in GLOBAL_MERGING_CHECKS.items():
-            for func_ck_str in func_ck_list:
-                func_ck = eval(func_ck_str)
-                func_ck(final_result, type_check)
+        for type_check, func_ck in GLOBAL_CHECKS_PLAN:
+            func_ck(final_result, type_check)
         return final_result
     return checks_wrapper
 
 @run_global_checks       
 def merge_creation_modification_dates(merged_record):
+    """version of the merge_creation_modification_dates with decorator for checks"""
+    return merge_creation_modification_dates_no_checks(merged_record)
+
+def merge_creation_modification_dates_no_checks(merged_record):
     """Function that grabs all the origins in the merged record 
     and creates a merged version of the creation and modification date 
     based only on the found origins"""
-    #I create a local copy to avoid problems
-    record = deepcopy(merged_record)
+    #I create a new record where to replace the field (the other fields are shared)
+    record = dict(merged_record)
     #I extract all the creation and modification dates
     try:
         creat_mod = record[FIELD_TO_MARC['creation and modification date']]
@@ -121,25 +128,25 @@ def merge_creation_modification_dates(merged_record):
 
 def merge_remove_temp_subfields(merged_record):
     """Function that removes the temporary subfields from the final record"""
-    #I create a local copy to avoid problems
-    record = deepcopy(merged_record)
-    #I extract all the field codes
-    field_keys = record.keys()
-    #I remove the temporary subfields
-    for tmp_subfield in TEMP_SUBFIELDS_LIST:
-        for field_key in field_keys:
-            record_delete_subfield(record, field_key, tmp_subfield)
-    #then I check if there are still some subfields having a two character code (not allowed by marc and used only for temporary subfields)
-    for field_key in field_keys:
-        for field in record[field_key]:
-            for subfield in field[0]:
+    #I create a new record where to replace the fields with temporary subfields (the other fields are shared)
+    record = dict(merged_record)
+    for field_key, fields in merged_record.items():
+        new_fields = None
+        for index, field in enumerate(fields):
+            #I remove the temporary subfields
+            subfields = [subfield for subfield in field[0] if subfield[0] not in TEMP_SUBFIELDS_LIST]
+            #then I check if there are still some subfields having a two character code (not allowed by marc and used only for temporary subfields)
+            for subfield in subfields:
                 if len(subfield[0]) > 1:
                     error_string = 'Temporary subfields still in the record! Field "%s", subfield "%s"' % (field_key, subfield[0])
                     logger.critical(error_string)
                     raise GenericError(error_string)
+            #and I copy only the fields that changed
+            if len(subfields) != len(field[0]):
+                if new_fields is None:
+                    new_fields = list(fields)
+                new_fields[index] = (subfields,) + field[1:]
+        if new_fields is not None:
+            record[field_key] = new_fields
             
     return record
-        
-    
-    
-    
\ No newline at end of file
@@ -26,49 +26,95 @@ from invenio import bibrecord
 
 from merger_settings import MERGING_RULES, \
                 GLOBAL_MERGING_RULES, MARC_TO_FIELD, FIELD_TO_MARC, \
-                SYSTEM_NUMBER_SUBFIELD, ORIGIN_SUBFIELD
+                SYSTEM_NUMBER_SUBFIELD, ORIGIN_SUBFIELD, \
+                MULTIWAY_MERGING, MULTIWAY_MERGING_RULES, SINGLE_VERSION_MERGING_RULES, \
+                SINGLE_VERSION_GLOBAL_MERGING_RULES, SINGLE_VERSION_GLOBAL_MERGING_CHECKS
+from merging_plan import compile_merging_rules, compile_global_merging_rules, \
+                compile_multiway_merging_rules, compile_global_merging_checks
 import pipeline_settings
 #from merger_errors import ErrorsInBibrecord, OriginValueNotFound
+from merger_errors import MergingError
 
-from misclibs.xml_transformer import create_record_from_libxml_obj 
+from misclibs.xml_transformer import iter_records_from_libxml_obj, LibxmlDocument
+from basic_functions import get_origin_importance_cache_info
 
 
 logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
 
-# Not directly used but needed for evaluation the merging functions.
+# Not directly used but needed to resolve the merging functions in the settings.
 import merging_rules
 import global_merging_rules
 
-def merge_records_xml(marcxml_obj):
+#merging functions resolved once from the settings:
+#for each tag a tuple (name, function) and the list of global (name, function)
+MERGING_PLAN = compile_merging_rules(MERGING_RULES)
+MULTIWAY_MERGING_PLAN = compile_multiway_merging_rules(MERGING_RULES, MULTIWAY_MERGING_RULES)
+GLOBAL_MERGING_PLAN = compile_global_merging_rules(GLOBAL_MERGING_RULES)
+#and the same for the records with only one version
+SINGLE_VERSION_MERGING_PLAN = compile_merging_rules(SINGLE_VERSION_MERGING_RULES)
+SINGLE_VERSION_GLOBAL_MERGING_PLAN = compile_global_merging_rules(SINGLE_VERSION_GLOBAL_MERGING_RULES)
+SINGLE_VERSION_GLOBAL_CHECKS_PLAN = compile_global_merging_checks(SINGLE_VERSION_GLOBAL_MERGING_CHECKS)
+
+def merge_records_xml(marcxml_obj, free_subtrees=False, free_document=False):
     """Function that takes in input a marcxml string and returns containing 
     multiple records identified by the tag "collection" and for each one calls the 
     function to merge the different flavors of the same record 
-    (identified by the tag "record"). """
-    logger.info(' Merger started.')
-    #I get the bibrecord object from libxml2 one
-    all_records = create_record_from_libxml_obj(marcxml_obj, logger)
+    (identified by the tag "record"). 
+    If free_subtrees is True the subtree of each record is freed from the document once parsed.
+    If free_document is True the function owns the document and frees it after the merging."""
+    if free_document:
+        with LibxmlDocument(marcxml_obj, logger) as marcxml_doc:
+            return merge_records(iter_records_from_libxml_obj(marcxml_doc, logger, free_subtrees))
+    #I get the bibrecord objects from libxml2 one, one record at a time
+    return merge_records(iter_records_from_libxml_obj(marcxml_obj, logger, free_subtrees))
+
+def merge_records(all_records):
+    """Function that takes in input an iterable (also a generator) of records, 
+    each one a list of the different flavors of the same record, and merges them.
+    Returns the list of merged records and the list of records with merging problems"""
     merged_records = []
     records_with_merging_probl = []
+    for bibcode, merged_record in merge_records_iter(all_records):
+        if isinstance(merged_record, MergingError):
+            records_with_merging_probl.append((bibcode, str(merged_record)))
+        else:
+            merged_records.append(merged_record)
+    return merged_records, records_with_merging_probl
+
+def merge_records_iter(all_records):
+    """Generator that takes in input an iterable (also a generator) of records, 
+    each one a list of the different flavors of the same record, and merges them
+    yielding a tuple (bibcode, merged record) as soon as each record is merged.
+    If a record cannot be merged the merged record is replaced by a MergingError"""
+    logger.info(' Merger started.')
     for records in all_records:
-        #I try to get the bibcode of the record I'm merging
-        try:
-            system_number_fields = records[0][FIELD_TO_MARC['system number']]
-            bibcode = bibrecord.field_get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
-        except:
-            bibcode = 'Unknown'
-        logger.warn(' Merging bibcode "%s".' % bibcode)
-        # Get the merged record
-        try:
-            merged_records.append(merge_multiple_records(records))
-        except Exception, error:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            str_error_to_print = exc_type.__name__ + '\t' + str(error) + ' (Merger error)'
-            logger.error(' Impossible to merge the record "%s" \t %s' % (bibcode, str_error_to_print))
-            records_with_merging_probl.append((bibcode, str_error_to_print))
+        yield merge_record(records)
+    cache_info = get_origin_importance_cache_info()
+    logger.info(' Origin importance cache: %d hits, %d misses (hit rate %.4f), %d entries.' % (cache_info['hits'], cache_info['misses'], cache_info['hit_rate'], cache_info['size']))
     logger.info(' Merger ended... returning results!')
-    return merged_records, records_with_merging_probl
 
 
+def merge_record(records):
+    """Function that merges the different flavors of the same record and 
+    returns a tuple (bibcode, merged record). 
+    If the record cannot be merged the merged record is replaced by a MergingError"""
+    #I try to get the bibcode of the record I'm merging
+    try:
+        system_number_fields = records[0][FIELD_TO_MARC['system number']]
+        bibcode = bibrecord.field_get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
+    except:
+        bibcode = 'Unknown'
+    logger.warn(' Merging bibcode "%s".' % bibcode)
+    # Get the merged record
+    try:
+        merged_record = merge_multiple_records(records)
+    except Exception, error:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        str_error_to_print = exc_type.__name__ + '\t' + str(error) + ' (Merger error)'
+        logger.error(' Impossible to merge the record "%s" \t %s' % (bibcode, str_error_to_print))
+        return bibcode, MergingError(str_error_to_print)
+    return bibcode, merged_record
+
 def merge_multiple_records(records):
     """
     Merges multiple records and returns a merged record.
@@ -77,31 +123,73 @@ def merge_multiple_records(records):
     if not records:
         return {}
     elif len(records) == 1:
-        return merge_two_records(records[0], {}, None)
-    
-    record1 = records.pop(0)
-    record2 = records.pop(0)
-    logger.info('  Merge #1')
+        return merge_single_record(records[0])
     
-    merged_record = merge_two_records(record1, record2)
-    merge_number = 2
-    while records:
-        new_record= records.pop(0)
-        logger.info('  Merge #%d' % merge_number)
-        merge_number += 1
-        merged_record = merge_two_records(merged_record, new_record)
+    if MULTIWAY_MERGING:
+        merged_record = merge_all_records(records)
+    else:
+        record1 = records.pop(0)
+        record2 = records.pop(0)
+        logger.info('  Merge #1')
+        
+        merged_record = merge_two_records(record1, record2)
+        merge_number = 2
+        while records:
+            new_record= records.pop(0)
+            logger.info('  Merge #%d' % merge_number)
+            merge_number += 1
+            merged_record = merge_two_records(merged_record, new_record)
     
     #global merging functions
     logger.info('  Global merging functions')
-    for func in GLOBAL_MERGING_RULES:
-        func_to_run = eval(func)
+    for func, func_to_run in GLOBAL_MERGING_PLAN:
+        logger.info('    Merging with function %s' % func)
+        merged_record = func_to_run(merged_record)
+
+    record_reorder(merged_record)
+
+    return merged_record
+
+def merge_single_record(record):
+    """
+    Returns the merged version of a record with only one version:
+    there is nothing to choose so only the functions for single versions are applied.
+    """
+    logger.info('  Single version record')
+    merged_record = dict(record)
+    for tag, (func, func_to_run) in SINGLE_VERSION_MERGING_PLAN.items():
+        if tag in merged_record:
+            logger.info('    Tag %s: merging with function %s' % (tag, func))
+            merged_record[tag] = func_to_run(merged_record[tag], [], tag)
+
+    #global merging functions
+    logger.info('  Global merging functions')
+    for func, func_to_run in SINGLE_VERSION_GLOBAL_MERGING_PLAN:
         logger.info('    Merging with function %s' % func)
         merged_record = func_to_run(merged_record)
+    for type_check, func_ck in SINGLE_VERSION_GLOBAL_CHECKS_PLAN:
+        func_ck(merged_record, type_check)
 
     record_reorder(merged_record)
 
     return merged_record
 
+def merge_all_records(records):
+    """
+    Merges all the records at once tag by tag and returns a merged record.
+    """
+    logger.info('  Merge of %d records' % len(records))
+    all_tags = sorted(set(tag for record in records for tag in record))
+
+    merged_record = {}
+    for tag in all_tags:
+        fields_sets = [record[tag] for record in records if tag in record]
+        merged_fields = merge_multiple_fields(tag, fields_sets)
+        if merged_fields:
+            merged_record[tag] = merged_fields
+
+    return merged_record
+
 def merge_two_records(record1, record2):
     """
     Merges two records and returns a merged record.
@@ -126,10 +214,28 @@ def merge_two_fields(tag, fields1, fields2):
     ## If one of the two fields does not exist, the merging is trivial.
     #merged_fields = []
     logger.info('    Tag %s:' % tag)
-    merging_func = eval(MERGING_RULES[MARC_TO_FIELD[tag]])
-    logger.info('      Merging with function %s.' % (MERGING_RULES[MARC_TO_FIELD[tag]], ))
+    func_name, merging_func = MERGING_PLAN[tag]
+    logger.info('      Merging with function %s.' % (func_name, ))
     return merging_func(fields1, fields2, tag)
 
+def merge_multiple_fields(tag, fields_sets):
+    """
+    Merges all the sets of fields with the same tag and returns a merged set of
+    fields. If the merging rule has no version for all the sets at once,
+    the sets are merged two by two.
+    """
+    logger.info('    Tag %s:' % tag)
+    if tag in MULTIWAY_MERGING_PLAN:
+        func_name, merging_func = MULTIWAY_MERGING_PLAN[tag]
+        logger.info('      Merging with function %s.' % (func_name, ))
+        return merging_func(fields_sets, tag)
+    func_name, merging_func = MERGING_PLAN[tag]
+    logger.info('      Merging with function %s.' % (func_name, ))
+    merged_fields = merging_func(fields_sets[0], fields_sets[1] if len(fields_sets) > 1 else [], tag)
+    for fields in fields_sets[2:]:
+        merged_fields = merging_func(merged_fields, fields, tag)
+    return merged_fields
+
 def record_reorder(record):
     """
     Resets the field positions to default order of increasing tags. Note that
@@ -137,7 +243,9 @@ def record_reorder(record):
     """
     current_position = 1
     for tag in sorted(record.keys()):
-        for index, field in enumerate(record[tag]):
-            record[tag][index] = (field[0], field[1], field[2], field[3], current_position)
+        #the list of fields can be shared with the original records, so I create a new one
+        fields = []
+        for field in record[tag]:
+            fields.append((field[0], field[1], field[2], field[3], current_position))
             current_position += 1
-
+        record[tag] = fields
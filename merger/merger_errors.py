@@ -33,6 +33,10 @@ class GenericError(Error):
         message = "ERROR: %s \n" % self.field_desc
         return message
 
+class UnsortedTimestampsError(GenericError):
+    """Error raised when the timestamps to compare with a merge join are not sorted by bibcode"""
+    pass
+
 class ErrorsInBibrecord(Exception):
     """Class for the error raised in case of error in the bibrecord"""
     pass
@@ -58,6 +62,10 @@ class EqualFields(Exception):
 class DuplicateNormalizedAuthorError(Exception):
     pass
 
+class MergingError(Exception):
+    """Error returned (not raised) by the merger for a record that cannot be merged"""
+    pass
+
 ###### NOT USED
 class WrongParameter(Exception):
     """Error that is raised when there is a wrong parameter passed"""
@@ -128,6 +128,19 @@ MERGING_RULES = {
     'title translation': 'merging_rules.title_merger',
 }
 
+#merging of multiple records: if True the records are merged tag by tag with all the sets of fields at once
+#instead of merging the records two by two
+MULTIWAY_MERGING = True
+
+#merging rules that have a version taking all the sets of fields at once (used only if MULTIWAY_MERGING is True)
+#the merging rules not listed here are applied two by two on the sets of fields of the same tag
+MULTIWAY_MERGING_RULES = {
+    'merging_rules.abstract_merger': 'merging_rules.priority_based_multi_merger',
+    'merging_rules.priority_based_merger': 'merging_rules.priority_based_multi_merger',
+    'merging_rules.take_all': 'merging_rules.take_all_multi',
+    'merging_rules.title_merger': 'merging_rules.priority_based_multi_merger',
+}
+
 #checks and specific errors that should be applied during a merging
 #any function points to a list of subfield where it should be applied
 #if this list is empty then the function should be applied on the entire field 
@@ -198,6 +211,24 @@ GLOBAL_MERGING_CHECKS = {
     ]
 }
 
+#merging of records with only one version: the merging rules and the checks are skipped
+#and only the following functions are applied
+#merging rule functions associated with the single fields (the other fields are taken as they are)
+SINGLE_VERSION_MERGING_RULES = {
+    'publication date': 'merging_rules.pub_date_merger_no_checks',
+}
+#list of merging function to apply to the entire record
+SINGLE_VERSION_GLOBAL_MERGING_RULES = [
+    'global_merging_rules.merge_creation_modification_dates_no_checks',
+    'global_merging_rules.merge_remove_temp_subfields',
+]
+#list of merging checks to apply to the entire record
+SINGLE_VERSION_GLOBAL_MERGING_CHECKS = {
+    'errors': [
+        'global_merging_checks.check_collections_existence'
+    ]
+}
+
 
 #If there is a specific priority list per one field its name should be specified here (see example)
 #if not specified the standard one will be applied
@@ -461,6 +492,10 @@ PRIORITIES = {
         for source in sources),
 }
 
+#maximum number of (tag, origin string) pairs whose importance is kept in memory
+#(when the limit is reached the cache is emptied)
+ORIGIN_IMPORTANCE_CACHE_SIZE = 10000
+
 #list of origins for which we have to apply the take_all
 #for all the others will be applied the priority_merging
 #the two groups will be merged with a take all
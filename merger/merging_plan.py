@@ -0,0 +1,92 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+Compiler of the merging plan.
+The merger settings describe the merging rules and the checks as strings
+(like "merging_rules.take_all"): these functions resolve them once
+to the actual functions, so that the merger doesn't need to evaluate
+the same strings for every field of every record.
+'''
+
+from merger_settings import FIELD_TO_MARC
+from merger_errors import GenericError
+
+def resolve_function(func_path):
+    """function that resolves a string like "module.function"
+    (module relative to the merger package) to the actual function"""
+    try:
+        module_name, func_name = func_path.rsplit('.', 1)
+        module = __import__(module_name, globals(), locals(), [func_name], -1)
+        func = getattr(module, func_name)
+    except (ValueError, ImportError, AttributeError):
+        raise GenericError('Function "%s" defined in the merger settings cannot be resolved' % func_path)
+    if not callable(func):
+        raise GenericError('Object "%s" defined in the merger settings is not a function' % func_path)
+    return func
+
+def compile_merging_rules(merging_rules):
+    """function that returns a dictionary where for each marc tag
+    there is a tuple with the name and the function of the merging rule"""
+    plan = {}
+    for field_name, func_path in merging_rules.items():
+        try:
+            tag = FIELD_TO_MARC[field_name]
+        except KeyError:
+            raise GenericError('Merging rule defined for the unknown field "%s"' % field_name)
+        plan[tag] = (func_path, resolve_function(func_path))
+    return plan
+
+def compile_multiway_merging_rules(merging_rules, multiway_merging_rules):
+    """function that returns a dictionary where for each marc tag
+    having a merging rule with a version for all the sets of fields at once
+    there is a tuple with the name and the function of this version"""
+    plan = {}
+    for field_name, func_path in merging_rules.items():
+        multi_func_path = multiway_merging_rules.get(func_path)
+        if multi_func_path is not None:
+            try:
+                tag = FIELD_TO_MARC[field_name]
+            except KeyError:
+                raise GenericError('Merging rule defined for the unknown field "%s"' % field_name)
+            plan[tag] = (multi_func_path, resolve_function(multi_func_path))
+    return plan
+
+def compile_merging_checks(merging_checks):
+    """function that returns a dictionary where for each marc tag
+    there is a list of tuples (type of check, function, list of subfields)"""
+    plan = {}
+    for field_name, list_checks in merging_checks.items():
+        try:
+            tag = FIELD_TO_MARC[field_name]
+        except KeyError:
+            raise GenericError('Merging checks defined for the unknown field "%s"' % field_name)
+        plan[tag] = [(type_check, resolve_function(func_ck_str), subfield_list)
+                     for type_check, functions_check in list_checks.items()
+                     for func_ck_str, subfield_list in functions_check.items()]
+    return plan
+
+def compile_global_merging_rules(global_merging_rules):
+    """function that returns the list of tuples (name, function)
+    of the global merging rules, keeping the order of the settings"""
+    return [(func_path, resolve_function(func_path)) for func_path in global_merging_rules]
+
+def compile_global_merging_checks(global_merging_checks):
+    """function that returns the list of tuples (type of check, function)
+    of the global merging checks"""
+    return [(type_check, resolve_function(func_ck_str))
+            for type_check, func_ck_list in global_merging_checks.items()
+            for func_ck_str in func_ck_list]
@@ -18,12 +18,13 @@
 File containing all the functions to merge
 '''
 
-from copy import deepcopy
+from time import time
 import logging
 
 import invenio.bibrecord as bibrecord
 
-from basic_functions import get_origin, get_origin_importance, compare_fields_exclude_subfiels
+from basic_functions import get_origin, get_origin_importance, compare_fields_exclude_subfiels, \
+    field_get_first_subfield_value
 from merger_settings import ORIGIN_SUBFIELD, AUTHOR_NORM_NAME_SUBFIELD,  \
     MARC_TO_FIELD, MERGING_RULES_CHECKS_ERRORS, REFERENCES_MERGING_TAKE_ALL_ORIGINS, \
     REFERENCE_RESOLVED_KEY, REFERENCE_STRING, REFERENCE_EXTENSION,\
@@ -31,30 +32,38 @@ from merger_settings import ORIGIN_SUBFIELD, AUTHOR_NORM_NAME_SUBFIELD,  \
     CREATION_DATE_TMP_SUBFIELD, MODIFICATION_DATE_TMP_SUBFIELD, PRIMARY_METADATA_SUBFIELD,\
     TEMP_SUBFIELDS_LIST
 from merger_errors import GenericError, OriginValueNotFound, EqualOrigins, EqualFields
+from merging_plan import compile_merging_checks
 import pipeline_settings
 
 logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
 
-#this import is not explicitly called, but is needed for the import through the settings
+#subfields not considered when the take_all looks for the same field with another origin
+TAKE_ALL_EXCLUDED_SUBFIELDS = frozenset([ORIGIN_SUBFIELD] + TEMP_SUBFIELDS_LIST)
+
+#this import is not explicitly called, but is needed to resolve the checks in the settings
 import merging_checks
 
+#checks resolved once from the settings: for each tag a list of (type of check, function, subfields)
+MERGING_CHECKS_PLAN = compile_merging_checks(MERGING_RULES_CHECKS_ERRORS)
+
+def _run_merging_checks(fields1, fields2, final_result, tag):
+    """function that runs all the checks defined for a tag
+    on the result of a merging"""
+    for type_check, func_ck, subfield_list in MERGING_CHECKS_PLAN.get(tag, []):
+        func_ck(fields1, fields2, final_result, type_check, subfield_list, tag)
+
 def run_checks(func):
     """Decorator that retrieves and runs the functions 
     to apply to any merging rule"""
     def checks_wrapper(fields1, fields2, tag):
         #I retrieve the groups of functions to run for this field
-        try:
-            list_checks = MERGING_RULES_CHECKS_ERRORS[MARC_TO_FIELD[tag]]
-        except KeyError:
+        if tag not in MERGING_CHECKS_PLAN:
             #If there are no checks I return directly the result of the wrapped function
             return func(fields1, fields2, tag)
         #then I get the result of the wrapped function
         final_result =  func(fields1, fields2, tag)
         #for each warning and error I pass the final_result and all the parameters to the function
-        for type_check, functions_check in list_checks.items():
-            for func_ck_str, subfield_list in functions_check.items():
-                func_ck = eval(func_ck_str)
-                func_ck(fields1, fields2, final_result, type_check, subfield_list, tag)
+        _run_merging_checks(fields1, fields2, final_result, tag)
         return final_result
     return checks_wrapper
 
@@ -76,33 +85,52 @@ def take_all_no_checks(fields1, fields2, tag):
     """function that takes all the different fields
     and returns an unique list"""
     all_fields = []
-    for field1 in fields1 + fields2:
-        for field2 in all_fields:
-            #I check if the fields are the same without considering the origin
-            if compare_fields_exclude_subfiels(field1, field2, strict=False, exclude_subfields=[ORIGIN_SUBFIELD]+TEMP_SUBFIELDS_LIST):
-                #then I check if with the origin the subfield are the same
-                #if so I already have the value in the list
-                if bibrecord._compare_fields(field1, field2, strict=False):
-                    break
-                #otherwise I have to compare the two fields and take the one with the most trusted origin
-                else:
-                    try:
-                        trusted, untrusted = get_trusted_and_untrusted_fields([field1], [field2], tag)
-                    except EqualOrigins:
-                        try:
-                            trusted, untrusted = _get_best_fields([field1], [field2], tag)
-                        except EqualFields:
-                            break
-                    #if the trusted one is already in the list I don't do anything
-                    if trusted[0] == field2:
-                        break
-                    #otherwise I remove the value in the list and I insert the trusted one
-                    else:
-                        del(all_fields[all_fields.index(field2)])
-                        all_fields.append(field1)
-                        break
-        else:
+    _take_all_into(all_fields, {}, fields1 + fields2, tag)
+    return _compact_fields(all_fields)
+
+def _field_signature(field):
+    """function that returns the canonical signature of a field used by the take_all:
+    the indicators and the subfields without origin and temporary subfields"""
+    return (field[1], field[2], field[3], 
+            frozenset(subfield for subfield in field[0] if subfield[0] not in TAKE_ALL_EXCLUDED_SUBFIELDS))
+
+def _compact_fields(all_fields):
+    """function that removes the fields replaced during a take_all"""
+    return [field for field in all_fields if field is not None]
+
+def _take_all_into(all_fields, signatures, fields, tag):
+    """function that adds to the unique list all_fields the fields
+    that are not already there (or that are more trusted than the ones already there).
+    signatures is the index of the position of each field in all_fields by signature:
+    the fields replaced by more trusted ones are set to None in all_fields to keep the positions valid"""
+    for field1 in fields:
+        signature = _field_signature(field1)
+        index = signatures.get(signature)
+        #if there is no field equal without considering the origin I simply add it
+        if index is None:
+            signatures[signature] = len(all_fields)
             all_fields.append(field1)
+            continue
+        field2 = all_fields[index]
+        #then I check if with the origin the subfield are the same
+        #if so I already have the value in the list
+        if bibrecord._compare_fields(field1, field2, strict=False):
+            continue
+        #otherwise I have to compare the two fields and take the one with the most trusted origin
+        try:
+            trusted, untrusted = get_trusted_and_untrusted_fields([field1], [field2], tag)
+        except EqualOrigins:
+            try:
+                trusted, untrusted = _get_best_fields([field1], [field2], tag)
+            except EqualFields:
+                continue
+        #if the trusted one is already in the list I don't do anything
+        if trusted[0] == field2:
+            continue
+        #otherwise I remove the value in the list and I insert the trusted one
+        all_fields[index] = None
+        signatures[signature] = len(all_fields)
+        all_fields.append(field1)
     return all_fields
 
 @run_checks
@@ -110,8 +138,27 @@ def take_all(fields1, fields2, tag):
     """version of the take_all with decorator for checks"""
     return take_all_no_checks(fields1, fields2, tag)
 
+def take_all_multi(fields_sets, tag):
+    """version of the take_all that takes all the sets of fields at once:
+    the unique list is built only once adding one set after the other"""
+    all_fields = []
+    signatures = {}
+    for fields in fields_sets:
+        if not fields:
+            continue
+        #the checks need the list before the merging, so I copy it only if there are checks to run
+        previous_fields = _compact_fields(all_fields) if all_fields and tag in MERGING_CHECKS_PLAN else None
+        _take_all_into(all_fields, signatures, fields, tag)
+        if previous_fields is not None:
+            _run_merging_checks(previous_fields, fields, _compact_fields(all_fields), tag)
+    return _compact_fields(all_fields)
+
 @run_checks
 def pub_date_merger(fields1, fields2, tag):
+    """version of the pub_date_merger with decorator for checks"""
+    return pub_date_merger_no_checks(fields1, fields2, tag)
+
+def pub_date_merger_no_checks(fields1, fields2, tag):
     """function to merge dates. the peculiarity of this merge is that 
     we need to create a new field based on which date is available"""
     all_dates = take_all_no_checks(fields1, fields2, tag)
@@ -169,9 +216,6 @@ def author_merger(fields1, fields2, tag):
     if len(fields1) == 0 or len(fields2) == 0:
         logger.info('        Only one field for "%s".' % tag)
         return fields1+fields2
-    #I need to copy locally the lists of records because I'm going to modify them
-    fields1 = deepcopy(fields1)
-    fields2 = deepcopy(fields2)
     try:
         trusted, untrusted = get_trusted_and_untrusted_fields(fields1, fields2, tag)
     except EqualOrigins:
@@ -179,51 +223,52 @@ def author_merger(fields1, fields2, tag):
         trusted, untrusted = _get_best_fields(fields1, fields2, tag)
         #and since I am in this case the two sets of fields are already too similar to enrich the trusted one
         #so I simply return it
-        return trusted
+        return list(trusted)
 
     # Sanity check: we have a problem if we have identical normalized author
     # names in the trusted list or if we have identical author names in the
     # untrusted list that is present in the trusted list of authors.
-    trusted_authors = set()
-    for field in trusted:
-        author = bibrecord.field_get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
+    #I index the position of each author in the trusted list by normalized name
+    trusted_authors = {}
+    for index, field in enumerate(trusted):
+        author = field_get_first_subfield_value(field, AUTHOR_NORM_NAME_SUBFIELD)
         if author in trusted_authors:
             #I don't raise an error if I have duplicated normalized author names,
             #I simply return the trusted list
             logger.info('      Duplicated normalized author name. Skipping author subfield merging.')
-            return trusted
+            return list(trusted)
             #raise DuplicateNormalizedAuthorError(author)
         else:
-            trusted_authors.add(author)
+            trusted_authors[author] = index
 
     #I extract all the authors in the untrusted list in case I need to merge some subfields
     untrusted_authors = {}
     for field in untrusted:
-        author = bibrecord.field_get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
+        author = field_get_first_subfield_value(field, AUTHOR_NORM_NAME_SUBFIELD)
         if author in trusted_authors:
             untrusted_authors[author] = field
 
     # Now add information from the least trusted list of authors to the most
-    # trusted list of authors.
-    for index, field in enumerate(trusted):
-        author = bibrecord.field_get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
-        if author in untrusted_authors:
-            trusted_subfield_codes = bibrecord.field_get_subfield_codes(field)
-            untrusted_field = untrusted_authors[author]
-            untrusted_subfield_codes = bibrecord.field_get_subfield_codes(untrusted_field)
-
-            trusted_subfields = bibrecord.field_get_subfield_instances(field)
-            additional_subfield_codes = set(untrusted_subfield_codes) - set(trusted_subfield_codes)
-            for code in additional_subfield_codes:
-                logger.info('      Subfield "%s" to add to author "%s".' % (code, author))
-                additional_subfields = bibrecord.field_get_subfield_values(untrusted_field, code)
-                for additional_subfield in additional_subfields:
-                    trusted_subfields.append((code, additional_subfield))
-            else:
-                # Replace the subfields with the new subfields.
-                field = (trusted_subfields, field[1], field[2], field[3], field[4])
+    # trusted list of authors: the list is a copy, so I can replace the authors with new subfields
+    merged = list(trusted)
+    for author, untrusted_field in untrusted_authors.items():
+        index = trusted_authors[author]
+        field = merged[index]
+        trusted_subfield_codes = [subfield[0] for subfield in field[0]]
+        untrusted_subfield_codes = [subfield[0] for subfield in untrusted_field[0]]
+        additional_subfield_codes = set(untrusted_subfield_codes) - set(trusted_subfield_codes)
+        if not additional_subfield_codes:
+            continue
+        trusted_subfields = list(field[0])
+        for code in additional_subfield_codes:
+            logger.info('      Subfield "%s" to add to author "%s".' % (code, author))
+            for subfield in untrusted_field[0]:
+                if subfield[0] == code:
+                    trusted_subfields.append(subfield)
+        # Replace the subfields with the new subfields.
+        merged[index] = (trusted_subfields, field[1], field[2], field[3], field[4])
 
-    return trusted
+    return merged
 
 @run_checks
 def title_merger(fields1, fields2, tag):
@@ -261,130 +306,162 @@ def references_merger(fields1, fields2, tag):
     if len(fields1) == 0 or len(fields2) == 0:
         logger.info('        Only one field for "%s".' % tag)
         return fields1+fields2
+    start_time = time()
+    
     #first I split the references in two groups: the ones that should be merged and the one that have to taken over the others
-    ref_by_merging_type_fields1 = {'take_all':[], 'priority':[]}
-    ref_by_merging_type_fields2 = {'take_all':[], 'priority':[]}
-        
-    #I split the fields1
-    for field in fields1:
-        if bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD)[0] in REFERENCES_MERGING_TAKE_ALL_ORIGINS:
-            ref_by_merging_type_fields1['take_all'].append(field)
-        else:
-            ref_by_merging_type_fields1['priority'].append(field)
-    #and the fields2 (this in theory should be always of the same origin type)
-    for field in fields2:
-        if bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD)[0] in REFERENCES_MERGING_TAKE_ALL_ORIGINS:
-            ref_by_merging_type_fields2['take_all'].append(field)
-        else:
-            ref_by_merging_type_fields2['priority'].append(field)
+    #(the fields2 in theory should be always of the same origin type)
+    take_all_fields1, priority_fields1 = _split_references_by_merging_type(fields1)
+    take_all_fields2, priority_fields2 = _split_references_by_merging_type(fields2)
     
-    global_list = take_all(take_all(ref_by_merging_type_fields1['take_all'], ref_by_merging_type_fields2['take_all'], tag), 
-                           priority_based_merger(ref_by_merging_type_fields1['priority'], ref_by_merging_type_fields2['priority'], tag),
-                           tag)
+    global_list = take_all_multi([take_all_fields1, take_all_fields2, 
+                                  priority_based_merger(priority_fields1, priority_fields2, tag)], tag)
     
     #finally I unique the resolved references
     #taking the reference string (and the related extension handler) from the most trusted origin or 
     #from the other if the most trusted origin has an empty reference string
     #or one with only the bibcode
+    #the fields are never modified: for the references found multiple times a new field is created at the end
     unique_references_dict = {}
+    merged_subfields_dict = {}
     unresolved_references = []
     for field in global_list:
-        fieldcp = deepcopy(field)
-        try:
-            bibcode_res = bibrecord.field_get_subfield_values(fieldcp, REFERENCE_RESOLVED_KEY)[0]
-        except IndexError:
-            bibcode_res = None
-        if bibcode_res:
-            #first record found
-            if bibcode_res not in unique_references_dict:
-                unique_references_dict[bibcode_res] = fieldcp
-            #merging of subfields
-            else:
-                #I put in local variable the two list of subfields
-                inlist = unique_references_dict[bibcode_res][0]
-                outlist = fieldcp[0]
-                #I create a new dictionary where to merge the results with the subfields of the first list
-                new_subfields = {}
-                for subfield in inlist:
-                    new_subfields[subfield[0]] = subfield[1]
-                origin_imp_inlist = get_origin_importance(tag, new_subfields[ORIGIN_SUBFIELD])
-                #then I compare these entries with the values from the second list
-                #first I retrieve the origin of the second list and its importance
-                for subfield in outlist:
-                    if subfield[0] == ORIGIN_SUBFIELD:
-                        origin_outlist = subfield[1]
-                        origin_imp_outlist = get_origin_importance(tag, subfield[1])
-                        break
-                #and I retrieve the reference extension if it exists
-                extension_outlist = None
-                for subfield in outlist:
-                    if subfield[0] == REFERENCE_EXTENSION:
-                        extension_outlist = subfield[1]
-                        break
-                #then I merge
-                for subfield in outlist:
-                    #if I don't have a subfield at all I insert it unless it is a Extension field
-                    if subfield[0] not in new_subfields and subfield[0] != REFERENCE_EXTENSION:
-                        logger.info('      Subfield "%s" added to reference "%s".' % (subfield[0], bibcode_res))
-                        new_subfields[subfield[0]] = subfield[1]
-                    #otherwise if it is a reference string
-                    elif subfield[0] in new_subfields and subfield[0] == REFERENCE_STRING:
-                        #I extract both reference strings
-                        refstring_out = subfield[1]
-                        refstring_in = new_subfields[REFERENCE_STRING]
-                        #if the one already in the list is the bibcode and the other one not I take the other one and I set the origin to the most trusted one
-                        if (refstring_in == bibcode_res or len(refstring_in) == 0) and len(refstring_out) != 0:
-                            new_subfields[REFERENCE_STRING] = refstring_out
-                            logger.info('      Reference string (bibcode only or empty) replaced by the one with origin "%s" for reference %s".' % (origin_outlist, bibcode_res))
-                            #if there was an extension for this string I copy also that one
-                            if extension_outlist != None:
-                                new_subfields[REFERENCE_EXTENSION] = extension_outlist
-                                logger.info('      Reference extension replaced by the one with value "%s" for reference %s".' % (extension_outlist, bibcode_res))
-                            #I update the origin if the new one is better
-                            if origin_imp_outlist > origin_imp_inlist:
-                                #first I print the message because I need the old origin
-                                logger.info('      Reference origin "%s" replaced by the more trusted "%s".' % (new_subfields[ORIGIN_SUBFIELD], origin_outlist))
-                                #then I replace it
-                                new_subfields[ORIGIN_SUBFIELD] = origin_outlist
-                                
-                        #otherwise if the string already in is not a bibcode or empty I have to check the importance
-                        else:
-                            if origin_imp_outlist > origin_imp_inlist:
-                                new_subfields[REFERENCE_STRING] = refstring_out
-                                logger.info('      Reference string replaced by the one with origin "%s" for reference %s".' % (origin_outlist, bibcode_res))
-                                if extension_outlist != None:
-                                    new_subfields[REFERENCE_EXTENSION] = extension_outlist
-                                    logger.info('      Reference extension replaced by the one with value "%s" for reference %s".' % (extension_outlist, bibcode_res))
-                                #first I print the message because I need the old origin
-                                logger.info('      Reference origin "%s" replaced by the more trusted "%s".' % (new_subfields[ORIGIN_SUBFIELD], origin_outlist))
-                                new_subfields[ORIGIN_SUBFIELD] = origin_outlist
-                    
-                #finally I replace the global field
-                newrecord = (new_subfields.items(), ) + unique_references_dict[bibcode_res][1:]
-                unique_references_dict[bibcode_res] = newrecord
+        bibcode_res = None
+        for subfield in field[0]:
+            if subfield[0] == REFERENCE_RESOLVED_KEY:
+                bibcode_res = subfield[1]
+                break
+        if not bibcode_res:
+            unresolved_references.append(field)
+        #first record found
+        elif bibcode_res not in unique_references_dict:
+            unique_references_dict[bibcode_res] = field
+        #merging of subfields
         else:
-            unresolved_references.append(fieldcp)
+            #I get the subfields of this reference merged so far (the ones of the first field found if it's the first merging)
+            #the dictionary is rebuilt from the list of subfields to keep the order of the subfields stable
+            new_subfields = dict(merged_subfields_dict.get(bibcode_res, unique_references_dict[bibcode_res][0]))
+            _merge_reference_subfields(new_subfields, field[0], bibcode_res, tag)
+            merged_subfields_dict[bibcode_res] = new_subfields.items()
+    
+    #finally I replace the fields of the merged references
+    for bibcode_res, new_subfields in merged_subfields_dict.items():
+        unique_references_dict[bibcode_res] = (new_subfields, ) + unique_references_dict[bibcode_res][1:]
+    
+    logger.info('      %d references merged in %d references in %.3f seconds.' % (len(fields1) + len(fields2), len(unique_references_dict) + len(unresolved_references), time() - start_time))
     #and I return the union of the two lists of resolved and unresolved references
     return unique_references_dict.values() + unresolved_references
-    
 
-def get_trusted_and_untrusted_fields(fields1, fields2, tag):
-    """
-    Selects the most trusted fields.
-    """
-    try:
-        origin1 = get_origin(fields1)
-        origin_val1 = get_origin_importance(tag, origin1)
-    except OriginValueNotFound, error:
-        logger.critical(error)
-        raise
+def _split_references_by_merging_type(fields):
+    """function that splits the references in the ones to merge with a take all 
+    and the ones to merge based on the priority"""
+    take_all_fields = []
+    priority_fields = []
+    for field in fields:
+        if bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD)[0] in REFERENCES_MERGING_TAKE_ALL_ORIGINS:
+            take_all_fields.append(field)
+        else:
+            priority_fields.append(field)
+    return take_all_fields, priority_fields
+
+def _merge_reference_subfields(new_subfields, outlist, bibcode_res, tag):
+    """function that merges in the dictionary of subfields of a reference 
+    the subfields of another field with the same resolved reference"""
+    origin_imp_inlist = get_origin_importance(tag, new_subfields[ORIGIN_SUBFIELD])
+    #then I compare these entries with the values from the second list
+    #first I retrieve the origin of the second list and its importance
+    #and the reference extension if it exists
+    origin_outlist = extension_outlist = None
+    for subfield in outlist:
+        if subfield[0] == ORIGIN_SUBFIELD and origin_outlist is None:
+            origin_outlist = subfield[1]
+        elif subfield[0] == REFERENCE_EXTENSION and extension_outlist is None:
+            extension_outlist = subfield[1]
+    origin_imp_outlist = get_origin_importance(tag, origin_outlist or '')
+    #then I merge
+    for subfield in outlist:
+        #if I don't have a subfield at all I insert it unless it is a Extension field
+        if subfield[0] not in new_subfields and subfield[0] != REFERENCE_EXTENSION:
+            logger.info('      Subfield "%s" added to reference "%s".' % (subfield[0], bibcode_res))
+            new_subfields[subfield[0]] = subfield[1]
+        #otherwise if it is a reference string
+        elif subfield[0] in new_subfields and subfield[0] == REFERENCE_STRING:
+            #I extract both reference strings
+            refstring_out = subfield[1]
+            refstring_in = new_subfields[REFERENCE_STRING]
+            #if the one already in the list is the bibcode and the other one not I take the other one and I set the origin to the most trusted one
+            if (refstring_in == bibcode_res or len(refstring_in) == 0) and len(refstring_out) != 0:
+                new_subfields[REFERENCE_STRING] = refstring_out
+                logger.info('      Reference string (bibcode only or empty) replaced by the one with origin "%s" for reference %s".' % (origin_outlist, bibcode_res))
+                #if there was an extension for this string I copy also that one
+                if extension_outlist != None:
+                    new_subfields[REFERENCE_EXTENSION] = extension_outlist
+                    logger.info('      Reference extension replaced by the one with value "%s" for reference %s".' % (extension_outlist, bibcode_res))
+                #I update the origin if the new one is better
+                if origin_imp_outlist > origin_imp_inlist:
+                    #first I print the message because I need the old origin
+                    logger.info('      Reference origin "%s" replaced by the more trusted "%s".' % (new_subfields[ORIGIN_SUBFIELD], origin_outlist))
+                    #then I replace it
+                    new_subfields[ORIGIN_SUBFIELD] = origin_outlist
+                    
+            #otherwise if the string already in is not a bibcode or empty I have to check the importance
+            else:
+                if origin_imp_outlist > origin_imp_inlist:
+                    new_subfields[REFERENCE_STRING] = refstring_out
+                    logger.info('      Reference string replaced by the one with origin "%s" for reference %s".' % (origin_outlist, bibcode_res))
+                    if extension_outlist != None:
+                        new_subfields[REFERENCE_EXTENSION] = extension_outlist
+                        logger.info('      Reference extension replaced by the one with value "%s" for reference %s".' % (extension_outlist, bibcode_res))
+                    #first I print the message because I need the old origin
+                    logger.info('      Reference origin "%s" replaced by the more trusted "%s".' % (new_subfields[ORIGIN_SUBFIELD], origin_outlist))
+                    new_subfields[ORIGIN_SUBFIELD] = origin_outlist
+    return new_subfields
+
+def priority_based_multi_merger(fields_sets, tag):
+    """version of the priority_based_merger that takes all the sets of fields at once:
+    the winning set is picked in one pass computing the importance of each origin only once"""
+    trusted = []
+    trusted_origin = trusted_value = None
+    for fields in fields_sets:
+        if not fields:
+            continue
+        if not trusted:
+            trusted = list(fields)
+            continue
+        if trusted_value is None:
+            trusted_origin, trusted_value = _get_origin_and_importance(trusted, tag)
+        origin, value = _get_origin_and_importance(fields, tag)
+        if trusted_value > value:
+            logger.info('      Selected fields from record 1 (%s over %s).' % (trusted_origin, origin))
+            merged = trusted
+        elif trusted_value < value:
+            logger.info('      Selected fields from record 2 (%s over %s).' % (origin, trusted_origin))
+            merged = fields
+            trusted_origin, trusted_value = origin, value
+        else:
+            #if they have the same origin I try with another approach
+            merged, untrusted = _get_best_fields(trusted, fields, tag)
+            if merged is fields:
+                trusted_origin = origin
+        _run_merging_checks(trusted, fields, merged, tag)
+        trusted = merged
+    return trusted
+
+def _get_origin_and_importance(fields, tag):
+    """function that returns the origin of a set of fields and its importance"""
     try:
-        origin2 = get_origin(fields2)
-        origin_val2 = get_origin_importance(tag, origin2)
+        origin = get_origin(fields)
+        return origin, get_origin_importance(tag, origin)
     except OriginValueNotFound, error:
         logger.critical(error)
         raise
 
+def get_trusted_and_untrusted_fields(fields1, fields2, tag):
+    """
+    Selects the most trusted fields.
+    """
+    origin1, origin_val1 = _get_origin_and_importance(fields1, tag)
+    origin2, origin_val2 = _get_origin_and_importance(fields2, tag)
+
     if origin_val1 > origin_val2:
         logger.info('      Selected fields from record 1 (%s over %s).' % (origin1, origin2))
         return fields1, fields2
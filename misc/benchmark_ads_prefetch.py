@@ -0,0 +1,108 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+Benchmark of the prefetch of the ADS records:
+it writes the records of the ADS XML files of the tests in a temporary directory
+(one file per bibcode) and retrieves them with LocalADSRecords, that simulates
+the latency of the network storage, without prefetch and with prefetch threads.
+It checks that the exported documents are the same and prints the time of each run.
+Run it from the misc directory.
+'''
+
+import sys
+sys.path.append('../')
+import glob
+import os
+import shutil
+import tempfile
+import logging
+from time import time
+
+import libxml2
+
+import pipeline_settings
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+from pipeline_ads_prefetcher import ADSRecordsPrefetcher, LocalADSRecords, clear_local_files_cache
+
+NUMBER_OF_BIBCODES = 500
+LATENCY = 0.005
+THREADS = [0, 2, 4, 8, 16]
+READ_AHEAD = 64
+
+def write_local_records(directory, number_of_bibcodes=NUMBER_OF_BIBCODES):
+    """function that writes the records of the tests in the directory and returns the list of their bibcodes"""
+    records = []
+    for xml_file in glob.glob('../tests/xmlfiles/*.xml'):
+        doc = libxml2.parseFile(xml_file)
+        node = doc.getRootElement().children
+        while node is not None:
+            if node.type == 'element' and node.name == 'record':
+                records.append(node.serialize('UTF-8'))
+            node = node.next
+        doc.freeDoc()
+    bibcodes = []
+    for i in range(number_of_bibcodes):
+        bibcode = 'bibcode%012d' % i
+        with open(os.path.join(directory, bibcode + '.xml'), 'w') as record_file:
+            record_file.write(records[i % len(records)])
+        bibcodes.append(bibcode)
+    return bibcodes
+
+def retrieve_records(bibcodes, number_of_threads):
+    """function that retrieves all the bibcodes (with the prefetch if number_of_threads > 0) 
+    and returns the serialized export and the time spent to retrieve them"""
+    clear_local_files_cache()
+    start = time()
+    recs = LocalADSRecords('full', 'XML')
+    prefetcher = None
+    if number_of_threads > 0:
+        prefetcher = ADSRecordsPrefetcher(bibcodes, LocalADSRecords, number_of_threads, READ_AHEAD, logger)
+        prefetcher.start()
+    for bibcode in bibcodes:
+        if prefetcher is not None:
+            prefetcher.wait(bibcode)
+        recs.addCompleteRecord(bibcode)
+    if prefetcher is not None:
+        prefetcher.stop()
+    elapsed = time() - start
+    doc = recs.export()
+    exported = doc.serialize('UTF-8')
+    doc.freeDoc()
+    return exported, elapsed
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        LocalADSRecords.directory = directory
+        LocalADSRecords.latency = LATENCY
+        bibcodes = write_local_records(directory)
+        print '%d bibcodes, simulated latency %.1f ms per file' % (len(bibcodes), LATENCY * 1000)
+        print '%10s %12s %10s' % ('threads', 'time (s)', 'speedup')
+        reference = None
+        for number_of_threads in THREADS:
+            exported, elapsed = retrieve_records(bibcodes, number_of_threads)
+            if reference is None:
+                reference = (exported, elapsed)
+            elif exported != reference[0]:
+                print 'ERROR: the export with %d threads is different' % number_of_threads
+                sys.exit(1)
+            print '%10d %12.3f %10.1f' % (number_of_threads, elapsed, reference[1] / elapsed)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,72 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+Benchmark of the conversion from ADS XML to bibrecord:
+it checks that the native converter returns the same records of the stylesheet 
+for the ADS XML files given as arguments (by default the ones of the tests) 
+and prints the throughput of both in records per second.
+Run it from the misc directory.
+'''
+
+import sys
+sys.path.append('../')
+import glob
+import logging
+from time import time
+
+import libxml2
+
+import pipeline_settings
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+from misclibs.xml_transformer import get_stylesheet, create_record_from_libxml_obj
+from misclibs.ads_xml_converter import create_record_from_ads_xml
+
+STYLESHEET = 'AdsXML2MarcXML_v2.xsl'
+
+def convert_xslt(doc):
+    """conversion with the stylesheet"""
+    marcxml = get_stylesheet(STYLESHEET, logger).applyStylesheet(doc, None)
+    records = create_record_from_libxml_obj(marcxml, logger)
+    marcxml.freeDoc()
+    return records
+
+def convert_native(doc):
+    """conversion with the native converter"""
+    return create_record_from_ads_xml(doc, logger)
+
+def benchmark_converter(converter, docs, repeat=20):
+    """function that returns the number of records converted per second by a converter"""
+    number_of_records = 0
+    start = time()
+    for _ in range(repeat):
+        for doc in docs:
+            number_of_records += len(converter(doc) or [])
+    return number_of_records / (time() - start)
+
+if __name__ == '__main__':
+    xml_files = sys.argv[1:] or glob.glob('../tests/xmlfiles/*.xml')
+    docs = [libxml2.parseFile(xml_file) for xml_file in xml_files]
+    for xml_file, doc in zip(xml_files, docs):
+        if convert_xslt(doc) != convert_native(doc):
+            print 'ERROR: the two converters return different records for %s' % xml_file
+            sys.exit(1)
+    print '%10s %14s' % ('converter', 'records/s')
+    for name, converter in (('xslt', convert_xslt), ('native', convert_native)):
+        print '%10s %14.1f' % (name, benchmark_converter(converter, docs))
@@ -0,0 +1,125 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+Benchmark of the bibrecord files:
+it merges the records of the ADS XML files given as arguments (by default the ones of the tests),
+copies them with different bibcodes to build a group of NUMBER_OF_RECORDS records
+and writes and reads the group with pickle.dump (protocol 0, the format of the previous versions)
+and with the indexed format (with and without compression).
+It prints the size of the files, the time to write and read all the records
+and the time to read a single record.
+Run it from the misc directory.
+'''
+
+import sys
+sys.path.append('../')
+import glob
+import logging
+import os
+import pickle
+import cPickle
+import random
+import tempfile
+from time import time
+
+import libxml2
+
+import pipeline_settings
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+from misclibs.ads_xml_converter import create_record_from_ads_xml
+from merger.merger import merge_record
+from merger.merger_settings import FIELD_TO_MARC, SYSTEM_NUMBER_SUBFIELD
+from pipeline_bibrecord_file import BibrecordFileReader, write_bibrecord_file
+
+NUMBER_OF_RECORDS = 5000
+RANDOM_READS = 5
+
+def get_group_of_records(xml_files, number_of_records=NUMBER_OF_RECORDS):
+    """function that returns a group of merged records, each one with a different bibcode"""
+    merged_records = []
+    for xml_file in xml_files:
+        doc = libxml2.parseFile(xml_file)
+        for records in create_record_from_ads_xml(doc, logger) or []:
+            merged_records.append(merge_record(records)[1])
+        doc.freeDoc()
+    system_number_tag = FIELD_TO_MARC['system number']
+    group = []
+    for i in range(number_of_records):
+        #the records of a real group don't share any object (not even the strings, that are not copied by copy.deepcopy)
+        record = cPickle.loads(cPickle.dumps(merged_records[i % len(merged_records)], cPickle.HIGHEST_PROTOCOL))
+        record[system_number_tag] = [([(SYSTEM_NUMBER_SUBFIELD, 'bibcode%012d' % i)],) + field[1:] for field in record[system_number_tag]]
+        group.append(record)
+    return group
+
+def write_pickle(filepath, group):
+    """writes the group as the previous versions of the pipeline"""
+    with open(filepath, 'wb') as file_obj:
+        pickle.dump(group, file_obj)
+
+def read_pickle(filepath):
+    """reads all the records of a pickled group"""
+    with open(filepath, 'rb') as file_obj:
+        return pickle.load(file_obj)
+
+def read_pickle_record(filepath, position):
+    """reads a single record of a pickled group (all the group has to be loaded)"""
+    return read_pickle(filepath)[position]
+
+def read_indexed(filepath):
+    """reads all the records of an indexed file one at a time"""
+    with BibrecordFileReader(filepath) as reader:
+        return list(reader)
+
+def read_indexed_record(filepath, position):
+    """reads a single record of an indexed file with the index"""
+    with BibrecordFileReader(filepath) as reader:
+        return reader.get('bibcode%012d' % position)
+
+if __name__ == '__main__':
+    xml_files = sys.argv[1:] or glob.glob('../tests/xmlfiles/*.xml')
+    group = get_group_of_records(xml_files)
+    formats = (('pickle', write_pickle, read_pickle, read_pickle_record),
+               ('indexed', lambda filepath, group: write_bibrecord_file(filepath, group, False), read_indexed, read_indexed_record),
+               ('indexed+zlib', lambda filepath, group: write_bibrecord_file(filepath, group, True), read_indexed, read_indexed_record))
+    positions = [random.randrange(len(group)) for i in range(RANDOM_READS)]
+    print '%d records' % len(group)
+    print '%14s %12s %10s %10s %14s' % ('format', 'bytes', 'write s', 'read s', 'one record ms')
+    for name, write_group, read_group, read_record in formats:
+        file_descriptor, filepath = tempfile.mkstemp()
+        os.close(file_descriptor)
+        try:
+            start = time()
+            write_group(filepath, group)
+            write_time = time() - start
+            start = time()
+            records = read_group(filepath)
+            read_time = time() - start
+            if records != group:
+                print 'ERROR: the records read from the %s file are different' % name
+                sys.exit(1)
+            start = time()
+            for position in positions:
+                if read_record(filepath, position) != group[position]:
+                    print 'ERROR: wrong record read from the %s file' % name
+                    sys.exit(1)
+            record_time = (time() - start) / len(positions)
+            print '%14s %12d %10.3f %10.3f %14.3f' % (name, os.path.getsize(filepath), write_time, read_time, record_time * 1000)
+        finally:
+            os.remove(filepath)
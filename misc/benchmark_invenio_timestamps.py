@@ -0,0 +1,143 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+Benchmark of the queries of the Invenio timestamps:
+it creates a SQLite database with the Invenio tables and NUMBER_OF_RECORDS synthetic records
+(or the number given as argument) and reads the timestamps
+  - with the three queries of the previous versions, all the rows loaded in memory and joined in a dictionary
+  - with the joined query of pipeline_timestamp_diff sorted by bibcode, all the rows loaded in memory
+  - with the same query, the rows fetched in chunks of INVENIO_QUERY_CHUNK_SIZE
+Each method runs in its own process: it prints the time and the peak of the memory used by the process.
+Run it from the misc directory.
+'''
+
+import sys
+sys.path.append('../')
+import logging
+import multiprocessing
+import os
+import resource
+import sqlite3
+import tempfile
+from time import time
+
+import pipeline_settings
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.CRITICAL)
+
+from pipeline_timestamp_diff import fetch_in_chunks, read_invenio_timestamps
+
+NUMBER_OF_RECORDS = 3000000
+#one record of DELETED_EVERY is deleted
+DELETED_EVERY = 50
+#SQLite sorts the strings byte by byte without the MySQL BINARY operator
+SQLITE_ORDER_BY = 'bibcode'
+
+def create_database(filepath, number_of_records):
+    """creates the Invenio tables with the bibcode, the timestamp and some other fields of the records"""
+    connection = sqlite3.connect(filepath)
+    for table in ('97x', '98x', '99x'):
+        connection.execute('CREATE TABLE bib%s (id INTEGER PRIMARY KEY, tag TEXT, value TEXT)' % table)
+        connection.execute('CREATE TABLE bibrec_bib%s (id_bibrec INTEGER, id_bibxxx INTEGER)' % table)
+    fields = {'97x': [('970__a', lambda recid: '%04dApJ...%03d..%03dA' % (1900 + recid % 111, recid / 1000 % 1000, recid % 1000)),
+                      ('971__a', lambda recid: 'other field %d' % recid)],
+              '98x': [('980__a', lambda recid: 'ASTRONOMY'), ('980__c', lambda recid: recid % DELETED_EVERY == 0 and 'DELETED' or None)],
+              '99x': [('995__a', lambda recid: '2011-%02d-%02d %d' % (recid % 12 + 1, recid % 28 + 1, recid % 7))]}
+    for table, table_fields in fields.iteritems():
+        field_id = 0
+        values = []
+        links = []
+        for recid in xrange(1, number_of_records + 1):
+            for tag, value in table_fields:
+                value = value(recid)
+                if value is not None:
+                    field_id += 1
+                    values.append((field_id, tag, value))
+                    links.append((recid, field_id))
+            if len(values) >= 100000 or recid == number_of_records:
+                connection.executemany('INSERT INTO bib%s (id, tag, value) VALUES (?, ?, ?)' % table, values)
+                connection.executemany('INSERT INTO bibrec_bib%s (id_bibrec, id_bibxxx) VALUES (?, ?)' % table, links)
+                values = []
+                links = []
+        #the indexes of Invenio
+        connection.execute('CREATE INDEX bib%s_tag ON bib%s (tag)' % (table, table))
+        connection.execute('CREATE INDEX bib%s_value ON bib%s (value)' % (table, table))
+        connection.execute('CREATE INDEX bibrec_bib%s_bibrec ON bibrec_bib%s (id_bibrec)' % (table, table))
+        connection.execute('CREATE INDEX bibrec_bib%s_bibxxx ON bibrec_bib%s (id_bibxxx)' % (table, table))
+    connection.commit()
+    connection.close()
+
+def three_queries(connection):
+    """the timestamps read as the previous versions of the pipeline"""
+    run_sql = lambda query: connection.execute(query).fetchall()
+    query = "SELECT bb.id_bibrec FROM bib98x AS b, bibrec_bib98x AS bb " \
+            "WHERE b.tag='980__c' AND b.value='DELETED' AND b.id=bb.id_bibxxx"
+    deleted_recids = set(line[0] for line in run_sql(query))
+    query = "SELECT bb.id_bibrec, b.value FROM bibrec_bib97x AS bb JOIN bib97x AS b ON (bb.id_bibxxx=b.id AND b.tag='970__a')"
+    recid_bibcode = dict(run_sql(query))
+    query = "SELECT bb.id_bibrec, b.value FROM bibrec_bib99x AS bb JOIN bib99x AS b ON (bb.id_bibxxx=b.id AND b.tag='995__a')"
+    timestamps = {}
+    for recid, timestamp in run_sql(query):
+        if recid not in deleted_recids:
+            bibcode = recid_bibcode.get(recid)
+            if bibcode is not None:
+                timestamps[bibcode] = timestamp
+    return len(timestamps)
+
+def joined_query_all_rows(connection):
+    """the timestamps read with the joined query, all the rows loaded in memory"""
+    run_sql = lambda query: connection.execute(query).fetchall()
+    return sum(1 for bibcode, timestamp in read_invenio_timestamps(run_sql, SQLITE_ORDER_BY))
+
+def joined_query_in_chunks(connection):
+    """the timestamps read with the joined query, the rows fetched in chunks"""
+    run_sql_streamed = lambda query: fetch_in_chunks(connection.cursor(), query, pipeline_settings.INVENIO_QUERY_CHUNK_SIZE)
+    return sum(1 for bibcode, timestamp in read_invenio_timestamps(run_sql_streamed, SQLITE_ORDER_BY))
+
+def run_method(method, filepath, results):
+    """runs a method in the process and puts its results in the queue"""
+    connection = sqlite3.connect(filepath)
+    connection.text_factory = str
+    start_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time()
+    number_of_timestamps = method(connection)
+    elapsed = time() - start
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_memory
+    connection.close()
+    results.put((number_of_timestamps, elapsed, peak_memory / 1024.0))
+
+if __name__ == '__main__':
+    number_of_records = len(sys.argv) > 1 and int(sys.argv[1]) or NUMBER_OF_RECORDS
+    file_descriptor, filepath = tempfile.mkstemp(suffix='.sqlite')
+    os.close(file_descriptor)
+    try:
+        start = time()
+        create_database(filepath, number_of_records)
+        print '%d records (database created in %.1f seconds)' % (number_of_records, time() - start)
+        print '%24s %12s %10s %10s' % ('method', 'timestamps', 'seconds', 'peak MB')
+        for name, method in (('three queries + dict', three_queries),
+                             ('joined, all rows', joined_query_all_rows),
+                             ('joined, in chunks', joined_query_in_chunks)):
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_method, args=(method, filepath, results))
+            process.start()
+            number_of_timestamps, elapsed, peak_memory = results.get()
+            process.join()
+            print '%24s %12d %10.1f %10.1f' % (name, number_of_timestamps, elapsed, peak_memory)
+    finally:
+        os.remove(filepath)
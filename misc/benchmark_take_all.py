@@ -0,0 +1,62 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+Benchmark of the take_all merging rule:
+it merges two sets of fields of growing size (half of the fields of the second set
+are the same of the first one with another origin) and prints the time per field,
+that should stay constant if the take_all scales linearly.
+Run it from the misc directory.
+'''
+
+import sys
+sys.path.append('../')
+import logging
+from time import time
+
+import pipeline_settings
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME).setLevel(logging.ERROR)
+
+from merger.merging_rules import take_all
+
+SIZES = [100, 1000, 2500, 5000, 10000]
+
+def get_fields(number_of_fields, origin, offset=0):
+    """function that returns a list of keyword fields"""
+    return [([('a', 'keyword %d' % (i + offset)), ('2', 'AAS'), ('7', origin), ('97', '2012-01-01'), ('98', '2012-01-01'), ('99', 'False')], ' ', ' ', '', i)
+            for i in range(number_of_fields)]
+
+def benchmark_take_all(sizes=SIZES, repeat=3):
+    """function that runs the benchmark and returns a list of tuples (number of fields, time, time per field)"""
+    results = []
+    for size in sizes:
+        fields1 = get_fields(size / 2, 'ARXIV')
+        fields2 = get_fields(size / 2, 'AAS', offset=size / 4)
+        best = None
+        for _ in range(repeat):
+            start = time()
+            take_all(fields1, fields2, '695')
+            elapsed = time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results.append((size, best, best / size))
+    return results
+
+if __name__ == '__main__':
+    print '%10s %12s %18s' % ('fields', 'time (s)', 'time/field (us)')
+    for size, elapsed, per_field in benchmark_take_all():
+        print '%10d %12.4f %18.2f' % (size, elapsed, per_field * 1e6)
@@ -0,0 +1,68 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+Benchmark of the conversion from MarcXML to bibrecord:
+it transforms the ADS XML files of the tests, reads the MarcXML files of the misc directory,
+checks that the tree-walk parser and the XPath one return the same records
+and prints the throughput of both in records per second.
+Run it from the misc directory.
+'''
+
+import sys
+sys.path.append('../')
+import glob
+import logging
+from time import time
+
+import libxml2
+
+import pipeline_settings
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+from misclibs.xml_transformer import get_stylesheet, create_record_from_libxml_obj, \
+    create_record_from_libxml_obj_xpath
+
+ADS_XML_FILES = glob.glob('../tests/xmlfiles/*.xml')
+MARCXML_FILES = glob.glob('*.xml')
+STYLESHEET = 'AdsXML2MarcXML_v2.xsl'
+
+def get_marcxml_docs(ads_xml_files=ADS_XML_FILES, marcxml_files=MARCXML_FILES):
+    """function that returns the list of the MarcXML documents"""
+    stylesheet = get_stylesheet(STYLESHEET, logger)
+    return [stylesheet.applyStylesheet(libxml2.parseFile(xml_file), None) for xml_file in ads_xml_files] + \
+        [libxml2.parseFile(xml_file) for xml_file in marcxml_files]
+
+def benchmark_parser(parser, docs, repeat=20):
+    """function that returns the number of records parsed per second by a parser"""
+    number_of_records = 0
+    start = time()
+    for _ in range(repeat):
+        for doc in docs:
+            number_of_records += sum(len(versions) for versions in parser(doc, logger))
+    return number_of_records / (time() - start)
+
+if __name__ == '__main__':
+    docs = get_marcxml_docs()
+    for doc in docs:
+        if create_record_from_libxml_obj(doc, logger) != create_record_from_libxml_obj_xpath(doc, logger):
+            print 'ERROR: the two parsers return different records'
+            sys.exit(1)
+    print '%10s %14s' % ('parser', 'records/s')
+    for name, parser in (('xpath', create_record_from_libxml_obj_xpath), ('tree walk', create_record_from_libxml_obj)):
+        print '%10s %14.1f' % (name, benchmark_parser(parser, docs))
@@ -0,0 +1,384 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Native converter from the ADS XML to the bibrecord structure
+
+It produces in one pass over the ADS XML document the same records
+that are obtained transforming the document with the stylesheet misc/AdsXML2MarcXML_v2.xsl
+(that remains the reference implementation) and parsing the resulting MarcXML
+with xml_transformer.create_record_from_libxml_obj.
+Each block of the function _convert_metadata corresponds to a block of the stylesheet.
+"""
+
+import re
+import string
+
+from xml_transformer import get_element_children
+
+#names of the tags wrapping the records in the ADS XML
+ADS_GLOBAL_WRAPPER = 'records'
+ADS_RECORD_WRAPPER = 'record'
+ADS_RECORD_VERSION_WRAPPER = 'metadata'
+
+ADS_METADATA_ORIGIN = 'ADS metadata'
+#translation used by the stylesheet to uppercase the pubtype
+UPPERCASE_TRANSLATION = string.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+#mapping of the databases to the main collections
+DATABASES_COLLECTIONS = {'AST': 'ASTRONOMY', 'PHY': 'PHYSICS', 'GEN': 'GENERAL'}
+#flags of the metadata that define a special collection (tag, value of the tag, collection)
+FLAGS_COLLECTIONS = [
+    ('collection', '1', 'COLLECTION'),
+    ('nonarticle', '1', 'NONARTICLE'),
+    ('ocrabstract', '1', 'OCRABSTRACT'),
+    ('openaccess', '1', 'OPENACCESS'),
+    ('private', '1', 'PRIVATE'),
+    ('refereed', '1', 'REFEREED'),
+    ('refereed', '0', 'NOT REFEREED'),
+    ('ads_scan', '1', 'ADS_SCAN'),
+    ('toc', '1', 'TOC'),
+    ('pub_openaccess', '1', 'PUB_OPENACCESS'),
+]
+#format of a number for XPath
+XPATH_NUMBER = re.compile(r'^[ \t\r\n]*-?([0-9]+(\.[0-9]*)?|\.[0-9]+)[ \t\r\n]*$')
+
+def _index_children(node):
+    """function that returns a dictionary with the lists of the element children of a node by name"""
+    children = {}
+    child = node.children
+    while child is not None:
+        if child.type == 'element' and child.ns() is None:
+            children.setdefault(child.name, []).append(child)
+        child = child.next
+    return children
+
+def _get_children(nodes, name):
+    """function that returns all the element children with a given name of a list of nodes
+    (like the XPath "nodes/name")"""
+    return [child for node in nodes for child in get_element_children(node, name)]
+
+def _value_of(nodes):
+    """function that returns the string value of the first node of a list (like xsl:value-of)"""
+    if nodes:
+        return nodes[0].content
+    return ''
+
+def _get_attribute(nodes, name):
+    """function that returns the value of the first attribute with a given name
+    found in a list of nodes (like the XPath "nodes/@name") or None"""
+    for node in nodes:
+        value = node.noNsProp(name)
+        if value is not None:
+            return value
+    return None
+
+def _is_xpath_number_equal(value, number):
+    """function that checks if a string converted to number by XPath is equal to a number"""
+    if value is None or not XPATH_NUMBER.match(value):
+        return False
+    return float(value) == number
+
+def _substring(value, start, length):
+    """function that works like the XPath substring on an utf-8 string"""
+    return value.decode('utf-8')[start - 1:start - 1 + length].encode('utf-8')
+
+def _convert_metadata(metadata, canonical_bibcode):
+    """function that converts a metadata node of the ADS XML
+    in a list of fields (tag, ind1, ind2, list of subfields)"""
+    #I index the children of the metadata by name
+    children = _index_children(metadata)
+    get = lambda name: children.get(name, [])
+
+    origin_metadata = metadata.noNsProp('origin') or ''
+    metadata_primary = metadata.noNsProp('primary') or ''
+    alternate_journal = metadata.noNsProp('alternate_journal')
+    creation_time = _value_of(get('creation_time'))
+    modification_time = _value_of(get('modification_time'))
+    canonical_bibcode_value = canonical_bibcode or ''
+    #subfields with the timestamps and the primary flag that close each field
+    timestamps = [('97', creation_time), ('98', modification_time), ('99', metadata_primary)]
+    tail = [('7', origin_metadata)] + timestamps
+
+    fields = []
+    #ISBN
+    for isbn in _get_children(get('isbns'), 'isbn'):
+        fields.append(('020', '', '', [('a', isbn.content)] + tail))
+    #ISSN
+    for issn in _get_children(get('issns'), 'issn'):
+        fields.append(('022', '', '', [('a', issn.content)] + tail))
+    #DOI
+    if get('DOI'):
+        fields.append(('024', '7', '', [('a', _value_of(get('DOI'))), ('2', 'DOI')] + tail))
+    #Bibcode
+    fields.append(('970', '', '', [('a', canonical_bibcode_value), ('7', ADS_METADATA_ORIGIN)] + timestamps))
+    fields.append(('035', '', '', [('a', canonical_bibcode_value), ('2', 'ADS bibcode'), ('7', ADS_METADATA_ORIGIN)] + timestamps))
+    #Alternate bibcodes
+    for alternate in _get_children(get('alternates'), 'alternate'):
+        alternate_value = alternate.content
+        if canonical_bibcode is None or alternate_value == canonical_bibcode:
+            continue
+        alternate_type = alternate.noNsProp('type')
+        if alternate_type == 'deleted':
+            fields.append(('035', '', '', [('z', alternate_value), ('2', alternate_type)] + tail))
+        elif alternate_type == 'eprint':
+            fields.append(('035', '', '', [('y', alternate_value), ('2', 'eprint bibcode')] + tail))
+        elif alternate_type is not None:
+            fields.append(('035', '', '', [('y', alternate_value), ('2', alternate_type)] + tail))
+    #other codes: arXiv
+    if get('preprintid'):
+        fields.append(('035', '', '', [('a', _value_of(get('preprintid'))), ('2', 'arXiv')] + tail))
+    #Language code: the value of the tag language if exists, otherwise the language of the main title
+    titles = get('title')
+    titles_lang = [title.noNsProp('lang') for title in titles]
+    not_english_titles = [(title, lang) for title, lang in zip(titles, titles_lang) if lang is not None and lang != '' and lang != 'en']
+    if titles:
+        if get('language'):
+            fields.append(('041', '', '', [('a', _value_of(get('language')))] + tail))
+        elif len(titles) == 1:
+            if titles_lang[0] is not None:
+                fields.append(('041', '', '', [('a', titles_lang[0])] + tail))
+        elif not_english_titles:
+            fields.append(('041', '', '', [('a', not_english_titles[0][1])] + tail))
+        elif titles_lang[0] is not None:
+            fields.append(('041', '', '', [('a', titles_lang[0])] + tail))
+    #Authors
+    for author in get('author'):
+        if _is_xpath_number_equal(author.noNsProp('nr'), 1):
+            tag = '100'
+        else:
+            tag = '700'
+        author_children = _index_children(author)
+        names = author_children.get('name', [])
+        subfields = [('a', _value_of(_get_children(names, 'western')))]
+        normalized_names = _get_children(names, 'normalized')
+        if normalized_names:
+            subfields.append(('b', _value_of(normalized_names)))
+        native_names = _get_children(names, 'native')
+        if native_names:
+            subfields.append(('q', _value_of(native_names)))
+        if 'type' in author_children:
+            subfields.append(('e', _value_of(author_children['type'])))
+        for affiliation in _get_children(author_children.get('affiliations', []), 'affiliation'):
+            subfields.append(('u', affiliation.content))
+        for email in _get_children(author_children.get('emails', []), 'email'):
+            subfields.append(('m', email.content))
+        for author_id in _get_children(author_children.get('author_ids', []), 'author_id'):
+            subfields.append(('j', author_id.content))
+        fields.append((tag, '', '', subfields + tail))
+    #Conference metadata
+    if get('conf_metadata'):
+        fields.append(('111', '', '', [('a', _value_of(get('conf_metadata')))] + tail))
+    #title
+    if len(titles) == 1:
+        subfields = [('a', titles[0].content)]
+        #(the stylesheet checks the language of the metadata tag here)
+        metadata_lang = metadata.noNsProp('lang')
+        if metadata_lang is not None:
+            subfields.append(('y', metadata_lang))
+        fields.append(('245', '', '', subfields + tail))
+    elif len(titles) > 1:
+        #If there is one or more title with a specific language not English only the first is 245
+        #and all the other titles are 242
+        if not_english_titles:
+            for position, (title, lang) in enumerate(not_english_titles):
+                fields.append(('245' if position == 0 else '242', '', '', [('a', title.content), ('y', lang)] + tail))
+            for title, lang in zip(titles, titles_lang):
+                if lang is None or lang == '' or lang == 'en':
+                    subfields = [('a', title.content)]
+                    if lang:
+                        subfields.append(('y', lang))
+                    fields.append(('242', '', '', subfields + tail))
+        #Otherwise the first one is 245 and all the others 242
+        else:
+            for position, (title, lang) in enumerate(zip(titles, titles_lang)):
+                subfields = [('a', title.content)]
+                if lang is not None:
+                    subfields.append(('y', lang))
+                fields.append(('245' if position == 0 else '242', '', '', subfields + tail))
+    #Publication date
+    for date in _get_children(get('dates'), 'date'):
+        fields.append(('260', '', '', [('c', date.content), ('t', date.noNsProp('type') or '')] + tail))
+    #Number of pages
+    if get('pagenumber'):
+        fields.append(('300', '', '', [('a', _value_of(get('pagenumber')))] + tail))
+    #Comments
+    if get('comment'):
+        fields.append(('500', '', '', [('a', _value_of(get('comment'))), ('7', origin_metadata), ('9', _get_attribute(get('comment'), 'origin') or '')] + timestamps))
+    #Abstract
+    for abstract in get('abstract'):
+        abstract_value = abstract.content
+        if abstract_value != 'Not Available':
+            subfields = [('a', abstract_value)]
+            lang = abstract.noNsProp('lang')
+            if lang:
+                subfields.append(('y', lang))
+            fields.append(('520', '', '', subfields + tail))
+    #Copyright
+    if get('copyright'):
+        fields.append(('542', '', '', [('a', _value_of(get('copyright')))] + tail))
+    #Associate papers
+    for associate in _get_children(get('associates'), 'associate'):
+        fields.append(('591', '', '', [('a', associate.content), ('c', associate.noNsProp('comment') or '')] + tail))
+    #Special collection for eprints
+    for arxivcategory in _get_children(get('arxivcategories'), 'arxivcategory'):
+        arxivcategory_type = arxivcategory.noNsProp('type')
+        if arxivcategory_type == 'main':
+            fields.append(('650', '1', '7', [('a', arxivcategory.content)] + tail))
+        elif arxivcategory_type == '':
+            fields.append(('650', '2', '7', [('a', arxivcategory.content)] + tail))
+    #Keywords: if there is no classification scheme they are free keywords, otherwise controlled keywords
+    for keywords in get('keywords'):
+        classificationscheme = keywords.noNsProp('type')
+        for keyword in get_element_children(keywords, 'keyword'):
+            keyword_children = _index_children(keyword)
+            original = _value_of(keyword_children.get('original', []))
+            if not original:
+                continue
+            normalized = _value_of(keyword_children.get('normalized', []))
+            if not classificationscheme:
+                fields.append(('653', '1', '', [('a', original), ('b', normalized)] + tail))
+            else:
+                fields.append(('695', '', '', [('a', original), ('b', normalized), ('2', classificationscheme)] + tail))
+    #Facility/telescope/Instruments
+    for instruments in get('instruments'):
+        fields.append(('693', '', '', [('i', instruments.content)] + tail))
+    #Objects
+    for obj in _get_children(get('objects'), 'object'):
+        subfields = [('a', obj.content), ('7', origin_metadata)]
+        object_origin = obj.noNsProp('origin')
+        if object_origin is not None:
+            subfields.append(('9', object_origin))
+        fields.append(('694', '', '', subfields + timestamps))
+    #Journal: if the journal is an alternate one it is an additional publication
+    if get('journal'):
+        subfields = [('p', _value_of(get('canonical_journal')))]
+        if get('volume'):
+            subfields.append(('v', _value_of(get('volume'))))
+        if get('issue'):
+            subfields.append(('n', _value_of(get('issue'))))
+        if get('page'):
+            page = _value_of(get('page'))
+            if get('lastpage'):
+                page = page + '-' + _value_of(get('lastpage'))
+            subfields.append(('c', page))
+        if get('electronic_id'):
+            subfields.append(('i', _value_of(get('electronic_id'))))
+        subfields.append(('y', _substring(canonical_bibcode_value, 1, 4)))
+        subfields.append(('z', _value_of(get('journal'))))
+        fields.append(('773' if alternate_journal == 'False' else '775', '', '', subfields + tail))
+    #Links
+    for link in _get_children(get('links'), 'link'):
+        subfields = [('u', link.noNsProp('url') or ''), ('y', link.noNsProp('title') or ''), ('3', link.noNsProp('type') or '')]
+        link_count = link.noNsProp('count')
+        if link_count is not None:
+            subfields.append(('5', link_count))
+        fields.append(('856', '4', '', subfields + tail))
+    #Origin
+    for origin in get('origin'):
+        fields.append(('907', '', '', [('a', origin.content)] + tail))
+    #Creation and modification dates
+    if get('creation_time') and get('modification_time'):
+        fields.append(('961', '', '', [('c', modification_time), ('x', creation_time)] + tail))
+    #main collections: databases
+    for database in _get_children(get('databases'), 'database'):
+        database_value = database.content
+        if database_value != 'PRE':
+            fields.append(('980', '', '', [('a', DATABASES_COLLECTIONS.get(database_value, database_value))] + tail))
+    #other collections
+    for flag, flag_value, collection in FLAGS_COLLECTIONS:
+        for node in get(flag):
+            if node.content == flag_value:
+                fields.append(('980', '', '', [('p', collection)] + tail))
+                break
+    #Special collection "pubtype"
+    if get('pubtype'):
+        fields.append(('980', '', '', [('p', _value_of(get('pubtype')).translate(UPPERCASE_TRANSLATION))] + tail))
+    #Bibliographic groups
+    for bibgroup in _get_children(get('bibgroups'), 'bibgroup'):
+        fields.append(('980', '', '', [('b', bibgroup.content)] + tail))
+    #Data Sources
+    for data_source in _get_children(get('data_sources'), 'data_source'):
+        fields.append(('980', '', '', [('s', data_source.content)] + tail))
+    #Vizier Tables
+    for vizier_table in _get_children(get('vizier_tables'), 'vizier_table'):
+        fields.append(('980', '', '', [('v', vizier_table.content)] + tail))
+    #Timestamp signature
+    if get('JSON_timestamp'):
+        fields.append(('995', '', '', [('a', _value_of(get('JSON_timestamp')))] + tail))
+    #References
+    for reference in get('reference'):
+        subfields = []
+        for code, attribute, prefix in (('i', 'bibcode', ''), ('r', 'arxid', 'arxiv: '), ('a', 'doi', 'doi: '),
+                                        ('e', 'score', ''), ('f', 'source', '')):
+            value = reference.noNsProp(attribute)
+            if value:
+                subfields.append((code, prefix + value))
+        reference_string = reference.content
+        if reference_string:
+            subfields.append(('b', reference_string))
+        extension = reference.noNsProp('extension')
+        if extension:
+            subfields.append(('w', extension))
+        fields.append(('999', 'C', '5', subfields + tail))
+    return fields
+
+def _convert_record(record):
+    """function that converts a record of the ADS XML in the list of its versions
+    (each one in the bibrecord format). Returns None if the record has no versions"""
+    canonical_bibcode = record.noNsProp('bibcode')
+    bibrecord_versions = []
+    found_versions = False
+    for metadata in get_element_children(record, ADS_RECORD_VERSION_WRAPPER):
+        found_versions = True
+        bibrecord_version = {}
+        for field_position_global, (tag, ind1, ind2, subfields) in enumerate(_convert_metadata(metadata, canonical_bibcode)):
+            bibrecord_version.setdefault(tag, []).append((subfields, ind1 or ' ', ind2 or ' ', '', field_position_global + 1,))
+        bibrecord_versions.append(bibrecord_version)
+    if not found_versions:
+        return None
+    return bibrecord_versions
+
+def _get_ads_records_nodes(domdoc):
+    """function that returns the list of the nodes of the records in the ADS XML"""
+    root = domdoc.getRootElement()
+    if root is None or root.name != ADS_GLOBAL_WRAPPER or root.ns() is not None:
+        return []
+    return list(get_element_children(root, ADS_RECORD_WRAPPER))
+
+def create_record_from_ads_xml(domdoc, logger):
+    """Creates the records from the ADS XML document (of type libxml2)
+    without the XSLT transformation: the result is the same of
+    xml_transformer.create_record_from_libxml_obj on the transformed document"""
+    retrieved_records = _get_ads_records_nodes(domdoc)
+    if len(retrieved_records) == 0:
+        return {}
+    all_bibrecords = []
+    for retrieved_record in retrieved_records:
+        bibrecord_versions = _convert_record(retrieved_record)
+        if bibrecord_versions is not None:
+            all_bibrecords.append(bibrecord_versions)
+    return all_bibrecords
+
+def iter_records_from_ads_xml(domdoc, logger, free_subtrees=False):
+    """Generator of the records of the ADS XML document (of type libxml2)
+    converted without the XSLT transformation: for each record it yields the list of its versions.
+    If free_subtrees is True, the subtree of each record is removed from the document
+    and freed once it has been converted"""
+    for retrieved_record in _get_ads_records_nodes(domdoc):
+        bibrecord_versions = _convert_record(retrieved_record)
+        if free_subtrees:
+            retrieved_record.unlinkNode()
+            retrieved_record.freeNode()
+        if bibrecord_versions is not None:
+            yield bibrecord_versions
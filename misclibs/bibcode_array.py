@@ -0,0 +1,222 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module with a compact set of bibcodes for the lists of millions of bibcodes:
+the bibcodes are sorted and stored in a single string, BIBCODE_LENGTH bytes each
+(instead of a Python string, its pointer and the hash table of a set for each bibcode).
+The lookups are binary searches, the differences and unions are merges of the sorted bibcodes
+and the slices are arrays with a copy of their part of the string.
+'''
+
+import heapq
+
+from merger.merger_errors import GenericError
+
+#length of a bibcode: the shorter ones are padded with PADDING (lower than any character of a bibcode)
+BIBCODE_LENGTH = 19
+PADDING = '\0'
+#number of bibcodes sorted at once while an array is built from an iterable
+BUILD_CHUNK_SIZE = 100000
+
+UNION = 'union'
+DIFFERENCE = 'difference'
+INTERSECTION = 'intersection'
+
+def _pad(bibcode):
+    """function that returns a bibcode with the length of the items of the arrays"""
+    if len(bibcode) > BIBCODE_LENGTH:
+        raise GenericError('Bibcode "%s" longer than %d characters' % (bibcode, BIBCODE_LENGTH))
+    return bibcode.ljust(BIBCODE_LENGTH, PADDING)
+
+def _pack(bibcodes):
+    """function that returns the data of an array with a set of bibcodes"""
+    return ''.join(sorted(_pad(bibcode) for bibcode in bibcodes))
+
+def _iter_data(data):
+    """generator of the padded bibcodes of the data of an array"""
+    for position in xrange(0, len(data), BIBCODE_LENGTH):
+        yield data[position:position + BIBCODE_LENGTH]
+
+def _merge_chunks(chunks):
+    """function that merges the data of many arrays at once and returns the data of their union"""
+    if len(chunks) == 1:
+        return chunks[0]
+    merged = bytearray()
+    last_bibcode = None
+    for bibcode in heapq.merge(*[_iter_data(chunk) for chunk in chunks]):
+        if bibcode != last_bibcode:
+            merged += bibcode
+            last_bibcode = bibcode
+    return str(merged)
+
+def _merge(data1, data2, operation):
+    """function that merges the data of two arrays and returns the data of their union, difference or intersection"""
+    #if one of the arrays is empty there is nothing to merge
+    if not data1 or not data2:
+        if operation == INTERSECTION:
+            return ''
+        if operation == DIFFERENCE:
+            return data1
+        return data1 or data2
+    length = BIBCODE_LENGTH
+    end1 = len(data1)
+    end2 = len(data2)
+    pos1 = 0
+    pos2 = 0
+    merged = bytearray()
+    while pos1 < end1 and pos2 < end2:
+        bibcode1 = data1[pos1:pos1 + length]
+        bibcode2 = data2[pos2:pos2 + length]
+        if bibcode1 < bibcode2:
+            if operation != INTERSECTION:
+                merged += bibcode1
+            pos1 += length
+        elif bibcode1 > bibcode2:
+            if operation == UNION:
+                merged += bibcode2
+            pos2 += length
+        else:
+            if operation != DIFFERENCE:
+                merged += bibcode1
+            pos1 += length
+            pos2 += length
+    if operation != INTERSECTION:
+        merged += data1[pos1:]
+    if operation == UNION:
+        merged += data2[pos2:]
+    return str(merged)
+
+class BibcodeArray(object):
+    """Class of a sorted set of bibcodes that behaves like a sorted list of bibcodes
+    (length, iteration, indexes and slices) with the operations of a set"""
+    __slots__ = ('data',)
+
+    def __init__(self, bibcodes=()):
+        """Constructor: the bibcodes can be any iterable, they are sorted and the duplicates removed"""
+        if isinstance(bibcodes, BibcodeArray):
+            self.data = bibcodes.data
+            return
+        #the bibcodes are sorted in chunks, so that only a chunk of them is a list of strings at the same time
+        chunks = []
+        chunk = set()
+        for bibcode in bibcodes:
+            chunk.add(bibcode)
+            if len(chunk) == BUILD_CHUNK_SIZE:
+                chunks.append(_pack(chunk))
+                chunk = set()
+        chunks.append(_pack(chunk))
+        self.data = _merge_chunks(chunks)
+
+    @classmethod
+    def from_data(cls, data):
+        """Method that returns an array with the data of another array"""
+        array = cls()
+        array.data = data
+        return array
+
+    def __getstate__(self):
+        return (self.data,)
+
+    def __setstate__(self, state):
+        self.data = state[0]
+
+    def __len__(self):
+        return len(self.data) / BIBCODE_LENGTH
+
+    def __iter__(self):
+        for bibcode in _iter_data(self.data):
+            yield bibcode.rstrip(PADDING)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return BibcodeArray(list(self)[index])
+            return BibcodeArray.from_data(self.data[start * BIBCODE_LENGTH:max(stop, start) * BIBCODE_LENGTH])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('BibcodeArray index out of range')
+        return self.data[index * BIBCODE_LENGTH:(index + 1) * BIBCODE_LENGTH].rstrip(PADDING)
+
+    def bisect(self, bibcode):
+        """Method that returns the position where a bibcode is or would be inserted"""
+        key = _pad(bibcode)
+        data = self.data
+        low = 0
+        high = len(self)
+        while low < high:
+            middle = (low + high) / 2
+            if data[middle * BIBCODE_LENGTH:(middle + 1) * BIBCODE_LENGTH] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __contains__(self, bibcode):
+        if len(bibcode) > BIBCODE_LENGTH:
+            return False
+        position = self.bisect(bibcode)
+        return position < len(self) and self.data[position * BIBCODE_LENGTH:(position + 1) * BIBCODE_LENGTH] == _pad(bibcode)
+
+    def union(self, other):
+        """Method that returns the array with the bibcodes of both arrays"""
+        return BibcodeArray.from_data(_merge(self.data, BibcodeArray(other).data, UNION))
+
+    def difference(self, other):
+        """Method that returns the array with the bibcodes not in the other array"""
+        return BibcodeArray.from_data(_merge(self.data, BibcodeArray(other).data, DIFFERENCE))
+
+    def intersection(self, other):
+        """Method that returns the array with the bibcodes also in the other array"""
+        return BibcodeArray.from_data(_merge(self.data, BibcodeArray(other).data, INTERSECTION))
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
+    def __eq__(self, other):
+        return isinstance(other, BibcodeArray) and self.data == other.data
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<BibcodeArray of %d bibcodes>' % len(self)
+
+class BibcodeArrayBuilder(object):
+    """Class that builds an array with bibcodes given one at a time in increasing order,
+    without keeping them in a list"""
+
+    def __init__(self):
+        """Constructor"""
+        self.data = bytearray()
+        self.last_bibcode = None
+
+    def append(self, bibcode):
+        """Method that adds a bibcode greater than the ones already added"""
+        padded_bibcode = _pad(bibcode)
+        if self.last_bibcode is not None and padded_bibcode <= self.last_bibcode:
+            raise GenericError('Bibcode "%s" not in increasing order' % bibcode)
+        self.data += padded_bibcode
+        self.last_bibcode = padded_bibcode
+
+    def __len__(self):
+        return len(self.data) / BIBCODE_LENGTH
+
+    def build(self):
+        """Method that returns the array of the bibcodes added"""
+        return BibcodeArray.from_data(str(self.data))
@@ -21,10 +21,154 @@
 import libxml2
 import libxslt
 import inspect 
+import os
+import threading
+from time import time
 
 import pipeline_settings as settings
 from merger.merger_errors import GenericError
 
+#process-wide cache of the compiled stylesheets: path -> (modification time, stylesheet object)
+#if it is filled before the fork of the workers, all of them share the same compiled stylesheet
+_STYLESHEET_CACHE = {}
+#the cache is shared by the threads of the stages
+_STYLESHEET_CACHE_LOCK = threading.Lock()
+#the stylesheets replaced in the cache: they are never freed, because a thread can still be using them
+_REPLACED_STYLESHEETS = []
+#statistics about the loads of the stylesheets and the transformations
+TRANSFORM_STATS = {'stylesheet_loads': 0, 'stylesheet_load_time': 0.0, 'transforms': 0, 'transform_time': 0.0}
+
+def get_stylesheet(stylesheet_path=settings.STYLESHEET_PATH, logger=None):
+    """function that returns the compiled stylesheet from the cache,
+    loading it only the first time or if the file has been modified"""
+    with _STYLESHEET_CACHE_LOCK:
+        return _get_stylesheet(stylesheet_path, logger)
+
+def _get_stylesheet(stylesheet_path, logger):
+    """function that does the job of get_stylesheet, called with the lock of the cache"""
+    try:
+        mtime = os.path.getmtime(stylesheet_path)
+    except OSError:
+        err_msg = "ERROR: stylesheet %s not found" % stylesheet_path
+        if logger:
+            logger.critical(err_msg)
+        raise GenericError(err_msg)
+    try:
+        cached_mtime, style_obj = _STYLESHEET_CACHE[stylesheet_path]
+    except KeyError:
+        pass
+    else:
+        if cached_mtime == mtime:
+            return style_obj
+        #the file has been modified: I load it again, keeping the old stylesheet alive until the process exits
+        del _STYLESHEET_CACHE[stylesheet_path]
+        _REPLACED_STYLESHEETS.append(style_obj)
+    start_time = time()
+    try:
+        style_obj = libxslt.parseStylesheetDoc(libxml2.parseFile(stylesheet_path))
+    except:
+        style_obj = None
+    if style_obj is None:
+        err_msg = "ERROR: problem loading stylesheet"
+        if logger:
+            logger.critical(err_msg)
+        raise GenericError(err_msg)
+    load_time = time() - start_time
+    TRANSFORM_STATS['stylesheet_loads'] += 1
+    TRANSFORM_STATS['stylesheet_load_time'] += load_time
+    if logger:
+        logger.info("Stylesheet %s loaded in %.3f seconds" % (stylesheet_path, load_time))
+    _STYLESHEET_CACHE[stylesheet_path] = (mtime, style_obj)
+    return style_obj
+
+#if required, I activate the memory debugging of libxml2 before any document is created
+if settings.LIBXML_MEMORY_DEBUG:
+    libxml2.debugMemory(1)
+
+#number of documents owned by a LibxmlDocument and not freed yet in this process
+OPEN_DOCUMENTS = {'count': 0}
+#the documents can be created and freed by the threads of the stages at the same time
+OPEN_DOCUMENTS_LOCK = threading.Lock()
+
+class LibxmlDocument(object):
+    """ Class that owns a libxml2 document and frees it when it is not needed anymore:
+    it can be used as context manager ("with LibxmlDocument(doc) as doc:")
+    or as guard calling explicitly the method free """
+    
+    def __init__(self, doc, logger=None):
+        """ Constructor: doc can be None (or False, the result of a failed transformation)"""
+        self.logger = logger
+        self.doc = doc or None
+        if self.doc is not None:
+            with OPEN_DOCUMENTS_LOCK:
+                OPEN_DOCUMENTS['count'] += 1
+    
+    def __enter__(self):
+        return self.doc
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.free()
+        return False
+    
+    def free(self):
+        """ Method that frees the document (only the first time it is called)"""
+        if self.doc is None:
+            return
+        doc = self.doc
+        self.doc = None
+        with OPEN_DOCUMENTS_LOCK:
+            OPEN_DOCUMENTS['count'] -= 1
+        try:
+            doc.freeDoc()
+        except:
+            if self.logger:
+                self.logger.error("ERROR: impossible to free the libxml2 document")
+
+class LibxmlMemoryGuard(object):
+    """ Class that, if the memory debugging of libxml2 is active, logs the memory 
+    allocated by libxml2 between the calls to start and check and not freed.
+    It can be used also as context manager around a block """
+    
+    def __init__(self, block_name, logger):
+        """ Constructor"""
+        self.block_name = block_name
+        self.logger = logger
+        self.memory_at_start = None
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.check()
+        return False
+    
+    def start(self):
+        """ Method that records the memory allocated by libxml2 at the beginning of the block"""
+        if settings.LIBXML_MEMORY_DEBUG:
+            self.memory_at_start = libxml2.debugMemory(1)
+    
+    def check(self):
+        """ Method that logs the memory not freed since the call to start and returns it in bytes"""
+        if self.memory_at_start is None:
+            return 0
+        leaked = libxml2.debugMemory(1) - self.memory_at_start
+        if leaked > 0:
+            self.logger.warning("libxml2 memory leak: %d bytes not freed in %s (%d documents still open in this process)" % (leaked, self.block_name, OPEN_DOCUMENTS['count']))
+        else:
+            self.logger.info("libxml2 memory: nothing leaked in %s" % self.block_name)
+        return leaked
+
+def check_open_documents(logger):
+    """function that logs the libxml2 documents owned by a LibxmlDocument and never freed in this process
+    and, if the memory debugging is active, the memory still allocated by libxml2.
+    Returns the number of documents not freed"""
+    if OPEN_DOCUMENTS['count'] > 0:
+        logger.warning("%d libxml2 documents have not been freed" % OPEN_DOCUMENTS['count'])
+    if settings.LIBXML_MEMORY_DEBUG:
+        logger.info("libxml2 memory still allocated: %d bytes" % libxml2.debugMemory(1))
+    return OPEN_DOCUMENTS['count']
+
 class XmlTransformer(object):
     """ Class that transform an ADS xml in MarcXML"""
         
@@ -39,13 +183,8 @@ class XmlTransformer(object):
     def init_stylesheet(self):
         """ Method that initialize the transformation engine """
         self.logger.info("In function %s.%s" % (self.__class__.__name__, inspect.stack()[0][3]))
-        #create the stylesheet obj
-        try:
-            self.style_obj = libxslt.parseStylesheetDoc(libxml2.parseFile(self.stylesheet))
-        except:
-            err_msg = "ERROR: problem loading stylesheet"
-            self.logger.critical(err_msg)
-            raise GenericError(err_msg)
+        #I get the stylesheet obj from the cache (it is compiled only if it's not there yet or if it has been modified)
+        self.style_obj = get_stylesheet(self.stylesheet, self.logger)
         return True
     
     def transform(self, doc):
@@ -54,21 +193,160 @@ class XmlTransformer(object):
         #I load the stylesheet
         self.init_stylesheet()   
         #transformation
+        start_time = time()
         try:
             doc = self.style_obj.applyStylesheet(doc, None)
         except:
             self.logger.error("ERROR: Transformation failed") 
             return False
+        transform_time = time() - start_time
+        TRANSFORM_STATS['transforms'] += 1
+        TRANSFORM_STATS['transform_time'] += transform_time
+        self.logger.info("Transformation done in %.3f seconds (%d transformations in %.3f seconds, %d stylesheet loads in %.3f seconds in this process)" % 
+                         (transform_time, TRANSFORM_STATS['transforms'], TRANSFORM_STATS['transform_time'], 
+                          TRANSFORM_STATS['stylesheet_loads'], TRANSFORM_STATS['stylesheet_load_time']))
         #to string
         #result = self.style_obj.saveResultToString(doc)
         #self.styleObj.freeStylesheet()
         #doc.freeDoc()
         #return result
+        #the caller owns the new document and has to free it (for example with LibxmlDocument)
         return doc
     
 
+#names of the tags wrapping the records in the marcxml
+GLOBAL_WRAPPER = 'collections'
+RECORD_WRAPPER = 'collection'
+RECORD_VERSION_WRAPPER = 'record'
+
+def get_element_children(node, name):
+    """generator of the element children of a libxml2 node with the given name
+    (without namespace, like the ones selected by an XPath without prefix)"""
+    child = node.children
+    while child is not None:
+        if child.type == 'element' and child.name == name and child.ns() is None:
+            yield child
+        child = child.next
+
+def _parse_record_versions(retrieved_record):
+    """function that parses all the versions of a record (a "collection" node)
+    returns None if the record has no versions"""
+    #list for the versions of the record I find
+    bibrecord_versions = []
+    found_versions = False
+    for record_version in get_element_children(retrieved_record, RECORD_VERSION_WRAPPER):
+        found_versions = True
+        #I define a global counter  and the wrapper for all the record
+        field_position_global = 1
+        bibrecord_version = {}
+        found_datafields = False
+        for datafield in get_element_children(record_version, 'datafield'):
+            found_datafields = True
+            #I extract infos at the datafield level
+            tag = datafield.noNsProp('tag')
+            ind1 = datafield.noNsProp('ind1')
+            ind2 = datafield.noNsProp('ind2')
+            #if something is missing from the XML I skip the field
+            if tag is None or ind1 is None or ind2 is None:
+                continue
+            #I sanitaze the indicators
+            if ind1 == '':
+                ind1 = ' '
+            if ind2 == '':
+                ind2 = ' '
+            #I extract the subfields
+            bibrecord_subfields = []
+            found_subfields = False
+            for subfield in get_element_children(datafield, 'subfield'):
+                found_subfields = True
+                code = subfield.noNsProp('code')
+                if code is None:
+                    continue
+                #then I put the result inside the list of subfields
+                bibrecord_subfields.append((code.encode('utf-8'), subfield.content,))
+            if not found_subfields:
+                continue
+            #then I append the field to the main record
+            bibrecord_version.setdefault(tag, []).append((bibrecord_subfields, ind1, ind2, '', field_position_global,))
+            field_position_global += 1
+        #if I don't have any datafield it means that the record is empty and I can skip it
+        if not found_datafields:
+            continue
+        #then I append the bibrecord version to the list of all the versions for this record
+        bibrecord_versions.append(bibrecord_version)
+    #if I have no record versions it's an empty instance
+    if not found_versions:
+        return None
+    return bibrecord_versions
+
+def _get_records_nodes(domdoc):
+    """function that returns the list of the nodes of the records (the "collection" tags)"""
+    root = domdoc.getRootElement()
+    if root is None or root.name != GLOBAL_WRAPPER or root.ns() is not None:
+        return []
+    return list(get_element_children(root, RECORD_WRAPPER))
+
 def create_record_from_libxml_obj(domdoc, logger):
-    """Creates a record from the document (of type libxml2/libxslt)."""
+    """Creates a record from the document (of type libxml2/libxslt).
+    The tree is walked directly reading the attributes of the nodes, 
+    without XPath evaluations: the result is the same of create_record_from_libxml_obj_xpath"""
+    #I select all the records (that are defined by the "collection" tag)
+    retrieved_records = _get_records_nodes(domdoc)
+    #If I haven't found any record I return an empty bibrecord
+    if len(retrieved_records) == 0:
+        return {}
+    #global list for the records I retrieve
+    all_bibrecords = []
+    #If I have records, I process each record and then each version of the record
+    for retrieved_record in retrieved_records:
+        bibrecord_versions = _parse_record_versions(retrieved_record)
+        #if I have no record versions it's an empty instance so I can skip it
+        if bibrecord_versions is not None:
+            all_bibrecords.append(bibrecord_versions)
+    return all_bibrecords
+
+def iter_records_from_libxml_obj(domdoc, logger, free_subtrees=False):
+    """Generator of the records of the document (of type libxml2/libxslt):
+    for each record it yields the list of its versions.
+    If free_subtrees is True, the subtree of each record is removed from the document
+    and freed once it has been parsed, so the document shrinks while the records are consumed"""
+    for retrieved_record in _get_records_nodes(domdoc):
+        bibrecord_versions = _parse_record_versions(retrieved_record)
+        if free_subtrees:
+            retrieved_record.unlinkNode()
+            retrieved_record.freeNode()
+        if bibrecord_versions is not None:
+            yield bibrecord_versions
+
+def iter_records_from_marcxml_file(filepath, logger):
+    """Generator of the records of a MarcXML file read in streaming:
+    only the subtree of one record at a time is kept in memory"""
+    reader = libxml2.readerForFile(filepath, None, 0)
+    if reader is None:
+        err_msg = "ERROR: impossible to read the file %s" % filepath
+        logger.critical(err_msg)
+        raise GenericError(err_msg)
+    ret = reader.Read()
+    while ret == 1:
+        #the root must be the global wrapper
+        if reader.Depth() == 0 and reader.NodeType() == 1 and (reader.Name() != GLOBAL_WRAPPER or reader.NamespaceUri() is not None):
+            break
+        if reader.Depth() == 1 and reader.NodeType() == 1 and reader.Name() == RECORD_WRAPPER and reader.NamespaceUri() is None:
+            #I expand only the current record: the reader frees it when it moves to the next one
+            bibrecord_versions = _parse_record_versions(reader.Expand())
+            if bibrecord_versions is not None:
+                yield bibrecord_versions
+            ret = reader.Next()
+        else:
+            ret = reader.Read()
+    if ret == -1:
+        err_msg = "ERROR: problem parsing the file %s" % filepath
+        logger.critical(err_msg)
+        raise GenericError(err_msg)
+
+def create_record_from_libxml_obj_xpath(domdoc, logger):
+    """Creates a record from the document (of type libxml2/libxslt).
+    Version based on XPath evaluations, kept as reference for create_record_from_libxml_obj"""
     #I define some names for the tags before getting to the actual marcxml
     global_wrapper = 'collections'
     record_wrapper = 'collection'
@@ -0,0 +1,194 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module that keeps on disk the ADS XML export of each bibcode, compressed with zlib,
+together with the ADS timestamp of the bibcode when it was exported.
+If a bibcode has to be extracted again with the same timestamp (recovery and repeated full extractions)
+its record is read from the cache instead of being retrieved from ADS with addCompleteRecord.
+Each bibcode is a file: the modification time of the file is the last time the entry was used
+and the least recently used entries are removed when the cache is bigger than its maximum size.
+'''
+
+import os
+import zlib
+import hashlib
+import threading
+
+import libxml2
+
+from misclibs.xml_transformer import get_element_children
+
+#names of the tags wrapping the records in the ADS XML
+ADS_GLOBAL_WRAPPER = 'records'
+ADS_RECORD_WRAPPER = 'record'
+
+class ADSExportCache(object):
+    """Class that reads and writes the entries of the cache of the ADS XML exports"""
+
+    def __init__(self, directory, logger):
+        """Constructor"""
+        self.directory = directory
+        self.logger = logger
+        #the cache can be used by the threads of the staged pipeline
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'bytes_stored': 0}
+
+    def _get_entry_path(self, bibcode):
+        """Method that returns the path of the file of a bibcode (the bibcodes can contain any character)"""
+        key = hashlib.sha1(bibcode).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, bibcode, timestamp):
+        """Method that returns the ADS XML of the record of a bibcode
+        or None if it is not in the cache with the same timestamp"""
+        if timestamp is None:
+            self._count('misses')
+            return None
+        entry_path = self._get_entry_path(bibcode)
+        try:
+            with open(entry_path, 'rb') as entry:
+                header = entry.readline()
+                if header != '%s\t%s\n' % (bibcode, timestamp):
+                    self._count('misses')
+                    return None
+                record_xml = zlib.decompress(entry.read())
+            #I mark the entry as used now
+            os.utime(entry_path, None)
+        except (IOError, OSError, zlib.error):
+            self._count('misses')
+            return None
+        self._count('hits')
+        self._count('bytes_saved', len(record_xml))
+        return record_xml
+
+    def put(self, bibcode, timestamp, record_xml):
+        """Method that stores the ADS XML of the record of a bibcode (an old entry with another timestamp is replaced)"""
+        if timestamp is None:
+            return
+        entry_path = self._get_entry_path(bibcode)
+        #the entry is written in a temporary file and renamed, so that the other workers never read half an entry
+        temp_path = '%s.%d.%d.tmp' % (entry_path, os.getpid(), threading.current_thread().ident)
+        try:
+            if not os.path.isdir(os.path.dirname(entry_path)):
+                try:
+                    os.makedirs(os.path.dirname(entry_path))
+                except OSError:
+                    #another worker created it in the meanwhile
+                    pass
+            with open(temp_path, 'wb') as entry:
+                entry.write('%s\t%s\n' % (bibcode, timestamp))
+                entry.write(zlib.compress(record_xml))
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError), error:
+            self.logger.warning(' Impossible to store the bibcode "%s" in the cache of the ADS exports: %s' % (bibcode, error))
+            return
+        self._count('bytes_stored', len(record_xml))
+
+    def _count(self, counter, value=1):
+        """Method that increases one of the counters of the cache"""
+        with self.lock:
+            self.stats[counter] += value
+
+    def split_bibcodes(self, bibcodes, timestamps):
+        """Method that splits a list of bibcodes in the ones to retrieve from ADS
+        and the ones in the cache: returns the list of the first ones and the list of (bibcode, ADS XML) of the others"""
+        bibcodes_to_retrieve = []
+        cached_records = []
+        for bibcode in bibcodes:
+            record_xml = self.get(bibcode, timestamps.get(bibcode))
+            if record_xml is None:
+                bibcodes_to_retrieve.append(bibcode)
+            else:
+                cached_records.append((bibcode, record_xml))
+        return bibcodes_to_retrieve, cached_records
+
+    def store_records(self, ads_xml_doc, timestamps):
+        """Method that stores in the cache all the records of an ADS XML document"""
+        root = ads_xml_doc.getRootElement()
+        if root is None:
+            return
+        for record in get_element_children(root, ADS_RECORD_WRAPPER):
+            bibcode = record.noNsProp('bibcode')
+            if bibcode in timestamps:
+                self.put(bibcode, timestamps[bibcode], record.serialize('UTF-8'))
+
+    def get_stats(self):
+        """Method that returns a copy of the counters"""
+        with self.lock:
+            return dict(self.stats)
+
+
+def new_ads_xml_document():
+    """function that returns an empty ADS XML document, where the records from the cache are added
+    when no bibcode has been retrieved from ADS"""
+    ads_xml_doc = libxml2.newDoc('1.0')
+    ads_xml_doc.setRootElement(ads_xml_doc.newDocNode(None, ADS_GLOBAL_WRAPPER, None))
+    return ads_xml_doc
+
+def add_cached_records(ads_xml_doc, cached_records):
+    """function that copies the records from the cache (a list of (bibcode, ADS XML)) in an ADS XML document"""
+    if not cached_records:
+        return
+    root = ads_xml_doc.getRootElement()
+    cached_doc = libxml2.parseDoc('<%s>%s</%s>' % (ADS_GLOBAL_WRAPPER, ''.join(record_xml for bibcode, record_xml in cached_records), ADS_GLOBAL_WRAPPER))
+    try:
+        for record in list(get_element_children(cached_doc.getRootElement(), ADS_RECORD_WRAPPER)):
+            root.addChild(record.docCopyNode(ads_xml_doc, 1))
+    finally:
+        cached_doc.freeDoc()
+
+def evict_least_recently_used(directory, max_bytes, logger):
+    """function that removes the least recently used entries of the cache until its size is at most max_bytes.
+    Returns the number of entries and of bytes removed"""
+    entries = []
+    total_bytes = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            entry_path = os.path.join(dirpath, filename)
+            try:
+                entry_stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+            total_bytes += entry_stat.st_size
+    removed_entries = 0
+    removed_bytes = 0
+    if total_bytes > max_bytes:
+        entries.sort()
+        for mtime, size, entry_path in entries:
+            if total_bytes - removed_bytes <= max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            removed_entries += 1
+            removed_bytes += size
+    logger.info('Cache of the ADS exports: %d entries (%d bytes), removed %d least recently used entries (%d bytes)' % (len(entries) - removed_entries, total_bytes - removed_bytes, removed_entries, removed_bytes))
+    return removed_entries, removed_bytes
+
+def format_stats(stats):
+    """function that returns the counters of the cache as lines of text"""
+    lookups = stats['hits'] + stats['misses']
+    if lookups:
+        hit_rate = float(stats['hits']) / lookups
+    else:
+        hit_rate = 0.0
+    return ['hits\t%d' % stats['hits'],
+            'misses\t%d' % stats['misses'],
+            'hit_rate\t%.4f' % hit_rate,
+            'bytes_saved\t%d' % stats['bytes_saved'],
+            'bytes_stored\t%d' % stats['bytes_stored']]
@@ -0,0 +1,138 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module that reads ahead the records of ADS while the previous bibcodes are added to the export.
+A pool of threads retrieves each bibcode with a throwaway ADSRecords object:
+the result is discarded, but the source files of the bibcode are then in the cache
+of the file system and the real call to addCompleteRecord doesn't wait for the network storage.
+It contains also LocalADSRecords, a stand-in of ADSRecords that reads the records
+from a local directory, used to benchmark the prefetch offline.
+'''
+
+import os
+import threading
+from time import time, sleep
+
+import libxml2
+
+class ADSRecordsPrefetcher(object):
+    """Class that warms the records of a list of bibcodes, at most read_ahead bibcodes 
+    after the last one required with the method wait"""
+
+    def __init__(self, bibcodes, records_class, number_of_threads, read_ahead, logger):
+        """Constructor"""
+        self.bibcodes = list(bibcodes)
+        self.records_class = records_class
+        self.number_of_threads = number_of_threads
+        self.logger = logger
+        #the bibcodes are given to the threads in order
+        self.next_position = 0
+        self.lock = threading.Lock()
+        #each token allows to warm a bibcode not required yet
+        self.read_ahead = threading.Semaphore(read_ahead)
+        self.warmed = dict((bibcode, threading.Event()) for bibcode in self.bibcodes)
+        self.stopped = False
+        self.threads = []
+        self.stats = {'warmed': 0, 'errors': 0, 'warm_time': 0.0, 'wait_time': 0.0}
+
+    def start(self):
+        """Method that starts the threads"""
+        for i in range(self.number_of_threads):
+            thread = threading.Thread(target=self._warm_records, name='prefetch-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _warm_records(self):
+        """Method executed by the threads: it warms the next bibcode when a token is available"""
+        while True:
+            self.read_ahead.acquire()
+            with self.lock:
+                if self.stopped or self.next_position >= len(self.bibcodes):
+                    self.read_ahead.release()
+                    return
+                bibcode = self.bibcodes[self.next_position]
+                self.next_position += 1
+            start_time = time()
+            try:
+                self.records_class('full', 'XML').addCompleteRecord(bibcode)
+            except Exception:
+                #the error will be raised (and handled) by the real retrieval of the bibcode
+                with self.lock:
+                    self.stats['errors'] += 1
+            with self.lock:
+                self.stats['warmed'] += 1
+                self.stats['warm_time'] += time() - start_time
+            self.warmed[bibcode].set()
+
+    def wait(self, bibcode):
+        """Method that waits until the bibcode has been warmed (if it is one of the prefetched ones)
+        and allows the threads to warm one more bibcode"""
+        event = self.warmed.get(bibcode)
+        if event is None:
+            return
+        start_time = time()
+        event.wait()
+        self.stats['wait_time'] += time() - start_time
+        self.read_ahead.release()
+
+    def stop(self):
+        """Method that stops the threads and logs the statistics"""
+        with self.lock:
+            self.stopped = True
+        #I wake up the threads waiting for a token
+        for thread in self.threads:
+            self.read_ahead.release()
+        for thread in self.threads:
+            thread.join()
+        self.logger.info('Prefetch: %d bibcodes warmed (%d errors) in %.1f seconds by %d threads, %.1f seconds waiting for them' % 
+                         (self.stats['warmed'], self.stats['errors'], self.stats['warm_time'], self.number_of_threads, self.stats['wait_time']))
+
+#files already read by LocalADSRecords in this process (the cache of the file system)
+_LOCAL_FILES_READ = set()
+_LOCAL_FILES_LOCK = threading.Lock()
+
+class LocalADSRecords(object):
+    """Class with the same interface of ADSRecords that reads the records from the files
+    <directory>/<bibcode>.xml (each one with a "record" element of the ADS XML).
+    The first read of each file waits latency seconds, to simulate the network storage"""
+    directory = None
+    latency = 0.0
+
+    def __init__(self, format_type='full', export_format='XML'):
+        """Constructor"""
+        self.records = []
+
+    def addCompleteRecord(self, bibcode):
+        """Method that adds a record to the export"""
+        filepath = os.path.join(self.directory, bibcode.replace('/', '_') + '.xml')
+        with _LOCAL_FILES_LOCK:
+            cold = filepath not in _LOCAL_FILES_READ
+        if cold:
+            sleep(self.latency)
+        with open(filepath, 'r') as record_file:
+            self.records.append(record_file.read())
+        with _LOCAL_FILES_LOCK:
+            _LOCAL_FILES_READ.add(filepath)
+
+    def export(self):
+        """Method that returns the libxml2 document with all the records"""
+        return libxml2.parseDoc('<?xml version="1.0" encoding="UTF-8"?><records>%s</records>' % ''.join(self.records))
+
+def clear_local_files_cache():
+    """function that empties the simulated cache of the files read by LocalADSRecords"""
+    with _LOCAL_FILES_LOCK:
+        _LOCAL_FILES_READ.clear()
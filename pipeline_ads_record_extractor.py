@@ -30,9 +30,11 @@ sys.path.append('/proj/ads/soft/python/lib/site-packages')
 import inspect
 import multiprocessing
 import libxml2
-import itertools
 import os
 import pickle
+import resource
+import threading
+from time import time, strftime
 
 from ads.ADSExports import ADSRecords
 
@@ -41,8 +43,16 @@ from invenio.bibtask import task_low_level_submission
 
 import pipeline_settings as settings
 import pipeline_write_files as write_files
+import pipeline_group_partitioner
+import pipeline_stages
+import pipeline_ads_prefetcher
+import pipeline_ads_export_cache
+import pipeline_timestamp_manager
+import pipeline_bibrecord_file
+import pipeline_extraction_ledger
 import misclibs.xml_transformer as xml_transformer
-from merger.merger_errors import GenericError
+import misclibs.ads_xml_converter as ads_xml_converter
+from merger.merger_errors import GenericError, MergingError
 from merger import merger
 from pipeline_invenio_uploader import bibupload_merger
 import pipeline_settings
@@ -55,18 +65,20 @@ logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
 BIBCODES_TO_EXTRACT_LIST = []
 BIBCODES_TO_DELETE_LIST = []
 EXTRACTION_DIRECTORY = ''
+UPLOAD_MODE = ''
 
 
-def extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_remaining, extraction_directory, upload_mode):
+def extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_remaining, extraction_directory, upload_mode, converter=settings.ADS_XML_CONVERTER):
     """manager of the extraction"""
     logger.info("In function %s" % (inspect.stack()[0][3],))
     
-    global EXTRACTION_DIRECTORY, BIBCODES_TO_DELETE_LIST, BIBCODES_TO_EXTRACT_LIST
+    global EXTRACTION_DIRECTORY, BIBCODES_TO_DELETE_LIST, BIBCODES_TO_EXTRACT_LIST, UPLOAD_MODE
     #the bibcodes to extract MUST NOT be sorted
     BIBCODES_TO_EXTRACT_LIST = bibcodes_to_extract_list
     BIBCODES_TO_DELETE_LIST = bibcodes_to_delete_list
     BIBCODES_TO_DELETE_LIST.sort()
     EXTRACTION_DIRECTORY = extraction_directory
+    UPLOAD_MODE = upload_mode
     #I extract or generate the extraction name
     EXTRACTION_NAME = set_extraction_name()
     
@@ -86,16 +98,30 @@ def extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_re
     ########################################################################
     #part where the bibcode to extract (new or update) are processed
 
-    #I split the list of bibcodes to process in multiple groups
-    bibtoprocess_splitted = grouper(settings.NUMBER_OF_BIBCODES_PER_GROUP, BIBCODES_TO_EXTRACT_LIST)
+    #I split the list of bibcodes to process in multiple groups (each one with its estimated cost)
+    #or, if the size of the groups is adaptive, the manager will create them during the extraction
+    if settings.ADAPTIVE_GROUP_SIZE:
+        bibtoprocess_splitted = pipeline_group_partitioner.AdaptiveGrouper(BIBCODES_TO_EXTRACT_LIST)
+    else:
+        bibtoprocess_splitted = pipeline_group_partitioner.partition_bibcodes(BIBCODES_TO_EXTRACT_LIST, EXTRACTION_DIRECTORY)
+
+    #if the ADS exports are cached, the workers need the ADS timestamps of the bibcodes to know if the cached ones are still valid:
+    #they are streamed from the timestamp files to the ledger of the extraction, where each worker reads the ones of its group
+    if settings.ADS_EXPORT_CACHE:
+        load_ads_timestamps(BIBCODES_TO_EXTRACT_LIST, EXTRACTION_DIRECTORY)
+        pipeline_ads_export_cache.evict_least_recently_used(settings.ADS_EXPORT_CACHE_DIR, settings.ADS_EXPORT_CACHE_MAX_MB * 1024 * 1024, logger)
 
     #I define a manager for the workers
-    manager = multiprocessing.Process(target=extractor_manager_process, args=(bibtoprocess_splitted, file_to_upload_remaining, EXTRACTION_DIRECTORY, EXTRACTION_NAME, upload_mode))
+    manager = multiprocessing.Process(target=extractor_manager_process, args=(bibtoprocess_splitted, file_to_upload_remaining, EXTRACTION_DIRECTORY, EXTRACTION_NAME, upload_mode, converter))
     #I start the process
     manager.start()
     #I join the process
     manager.join()
 
+    #the cache grew during the extraction: I bring it back to its maximum size
+    if settings.ADS_EXPORT_CACHE:
+        pipeline_ads_export_cache.evict_least_recently_used(settings.ADS_EXPORT_CACHE_DIR, settings.ADS_EXPORT_CACHE_MAX_MB * 1024 * 1024, logger)
+
     #just before the end of the extraction, I write the message that the extraction finished and the files are ready to be uploaded in the extraction log file
     filepath = os.path.join(settings.BASE_OUTPUT_PATH, EXTRACTION_DIRECTORY, settings.EXTRACTION_FILENAME_LOG)
     file_obj = open(filepath,'a')
@@ -105,13 +131,6 @@ def extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_re
     logger.warning("Extraction ended!")
 
 
-def grouper(n, iterable):
-    """method to split a list in multiple groups"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
-    args = [iter(iterable)] * n
-    return list(([e for e in t if e != None] for t in itertools.izip_longest(*args)))
-
-
 def process_bibcodes_to_delete(extraction_directory, upload_mode):
     """method that creates the MarcXML for the bibcodes to delete"""
     logger.info("In function %s" % (inspect.stack()[0][3],))
@@ -119,34 +138,31 @@ def process_bibcodes_to_delete(extraction_directory, upload_mode):
     #I create an unique file for all the bibcodes to delete:
     #I don't think it's necessary to split the content in groups, since the XML is really simple
 
-    #I create the base object for the tree
-    doc = libxml2.newDoc("1.0")
-    root = doc.newChild(None, "collection", None)
-
-    #then for each bibcode to delete I create the proper record
-    for bibcode in BIBCODES_TO_DELETE_LIST:
-        record = root.newChild(None, 'record', None)
-        #I add to the record the 2 necessary datafields
-        d970 = record.newChild(None, 'datafield', None)
-        d970.setProp('tag', '970')
-        d970.setProp('ind1', '')
-        d970.setProp('ind2', '')
-        #I create the subfield tag
-        sub = d970.newChild(None, 'subfield', bibcode.replace('&', '&amp;'))
-        sub.setProp("code", "a")
-        d980 = record.newChild(None, 'datafield', None)
-        d980.setProp('tag', '980')
-        d980.setProp('ind1', '')
-        d980.setProp('ind2', '')
-        #I create the subfield tag
-        sub = d980.newChild(None, 'subfield', "DELETED")
-        sub.setProp("code", "c")
-
-    #I extract the node
-    marcxml_string = doc.serialize('UTF-8', 1)
-    #I remove the data
-    doc.freeDoc()
-    del doc
+    #I create the base object for the tree (freed when the MarcXML has been serialized)
+    with xml_transformer.LibxmlDocument(libxml2.newDoc("1.0"), logger) as doc:
+        root = doc.newChild(None, "collection", None)
+
+        #then for each bibcode to delete I create the proper record
+        for bibcode in BIBCODES_TO_DELETE_LIST:
+            record = root.newChild(None, 'record', None)
+            #I add to the record the 2 necessary datafields
+            d970 = record.newChild(None, 'datafield', None)
+            d970.setProp('tag', '970')
+            d970.setProp('ind1', '')
+            d970.setProp('ind2', '')
+            #I create the subfield tag
+            sub = d970.newChild(None, 'subfield', bibcode.replace('&', '&amp;'))
+            sub.setProp("code", "a")
+            d980 = record.newChild(None, 'datafield', None)
+            d980.setProp('tag', '980')
+            d980.setProp('ind1', '')
+            d980.setProp('ind2', '')
+            #I create the subfield tag
+            sub = d980.newChild(None, 'subfield', "DELETED")
+            sub.setProp("code", "c")
+
+        #I extract the node
+        marcxml_string = doc.serialize('UTF-8', 1)
     #I write the bibcodes in the done bibcodes file
     w2f = write_files.WriteFile(extraction_directory, logger)
     w2f.write_done_bibcodes_to_file(BIBCODES_TO_DELETE_LIST)
@@ -200,9 +216,10 @@ def set_extraction_name():
     return extraction_name
 
 
-def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, extraction_directory, extraction_name, upload_mode):
+def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, extraction_directory, extraction_name, upload_mode, converter):
     """Process that takes care of managing all the other worker processes
-        this process also creates new worker processes when the existing ones reach the maximum number of groups of bibcode to process
+        this process also creates new worker processes when the existing ones are recycled 
+        (they reach the maximum number of groups of bibcode to process, of resident memory or of lifetime)
     """
     logger.info("In function %s" % (inspect.stack()[0][3],))
     #a queue for the bibcodes to process
@@ -224,17 +241,41 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
 
     logger.info(multiprocessing.current_process().name + ' (Manager) Filling the queue with the tasks')
 
-    #I split all the bibcodes in groups of NUMBER_OF_BIBCODES_PER_GROUP and I put them in the todo queue
     counter = 0 #I need the counter to uniquely identify each group
-    for grp in bibtoprocess_splitted:
-        counter += 1
-        q_todo.put([str(counter).zfill(7), grp])
+    if isinstance(bibtoprocess_splitted, pipeline_group_partitioner.AdaptiveGrouper):
+        #the groups are created one at a time: I put in the queue only one group per worker and 
+        #the next ones are created with the size adapted to the groups already processed
+        adaptive_grouper = bibtoprocess_splitted
+        sizing_log_path = os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory, settings.BASE_LOGGING_PATH, settings.GROUP_SIZING_LOG)
+        for i in range(settings.NUMBER_WORKERS):
+            if not adaptive_grouper.has_bibcodes():
+                break
+            counter += 1
+            grp, predicted_duration = adaptive_grouper.next_group()
+            q_todo.put([str(counter).zfill(7), grp, predicted_duration, None])
+    else:
+        #I put the groups of bibcodes in the todo queue: if their costs are known the most expensive ones are processed first,
+        #so that at the end of the extraction there are only short groups and the workers are not idle
+        adaptive_grouper = None
+        tasks = []
+        for grp, predicted_cost in bibtoprocess_splitted:
+            counter += 1
+            tasks.append([str(counter).zfill(7), grp, predicted_cost, None])
+        tasks.sort(key=lambda task: task[2], reverse=True)
+        for task in tasks:
+            q_todo.put(task)
+        del tasks
     #I pre-fill the list of files to upload if there are some
     file_to_upload_remaining.sort()
     for file2up in file_to_upload_remaining:
         logger.info('Putting in upload queue the file "%s" from previous extraction' % file2up)
         q_uplfile.put(('Previous Extraction', file2up))
 
+    #I load the stylesheet before creating the workers, so that all of them share the compiled one
+    if converter == 'xslt':
+        xml_transformer.get_stylesheet(settings.STYLESHEET_PATH, logger)
+    logger.warning(multiprocessing.current_process().name + ' (Manager) Converter from ADS XML to bibrecord: %s' % converter)
+
     #I define the number of processes to run
     number_of_processes = settings.NUMBER_WORKERS 
     
@@ -249,10 +290,11 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
     
     logger.info(multiprocessing.current_process().name + ' (Manager) Creating the first pool of workers')
     #I define the worker processes
-    processes = [multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name)) for i in range(number_of_processes)]
-    #I append to the todo queue a list of commands to stop the worker processes
-    for i in range(number_of_processes):
-        q_todo.put(['STOP', ''])
+    processes = [multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name, converter)) for i in range(number_of_processes)]
+    #I append to the todo queue a list of commands to stop the worker processes (if all the groups are already there)
+    if adaptive_grouper is None or not adaptive_grouper.has_bibcodes():
+        for i in range(number_of_processes):
+            q_todo.put(['STOP', ''])
 
 
     logger.warning(multiprocessing.current_process().name + ' (Manager) Starting all the workers')
@@ -278,7 +320,8 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
         death_reason = q_life.get()
         #if the reason of the death is that the process reached the max number of groups to process, then I have to start another one
         if death_reason[0] == 'MAX LIFE REACHED':
-            newprocess = multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name))
+            logger.info(multiprocessing.current_process().name + ' (Manager) Worker recycled: %s' % death_reason[1])
+            newprocess = multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name, converter))
             newprocess.start()
             processes.append(newprocess)
             #!!!!!!!!!!!!!!!!!!!!!!!!
@@ -286,6 +329,20 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
             #additional_workers = additional_workers - 1
             #!!!!!!!!!!!!!!!!!!!!!!!!
             logger.warning(multiprocessing.current_process().name + ' (Manager) New worker created')
+        elif death_reason[0] == 'GROUP DONE':
+            #a worker finished a group: if the size of the groups is adaptive I create the next group
+            if adaptive_grouper is not None and adaptive_grouper.has_bibcodes():
+                decision = adaptive_grouper.update(death_reason[2], death_reason[3], death_reason[4])
+                logger.warning(multiprocessing.current_process().name + ' (Manager) Group %s done: %s' % (death_reason[1], decision))
+                with open(sizing_log_path, 'a') as sizing_log:
+                    sizing_log.write('%s\tgroup %s\t%s\n' % (strftime("%Y-%m-%d %H:%M:%S"), death_reason[1], decision))
+                counter += 1
+                grp, predicted_duration = adaptive_grouper.next_group()
+                q_todo.put([str(counter).zfill(7), grp, predicted_duration, None])
+                #if these were the last bibcodes, I can tell the workers to stop
+                if not adaptive_grouper.has_bibcodes():
+                    for i in range(number_of_processes):
+                        q_todo.put(['STOP', ''])
         elif death_reason[0] == 'QUEUE EMPTY':
             active_workers = active_workers - 1
             logger.info(multiprocessing.current_process().name + ' (Manager) %s workers waiting to finish their job' % str(active_workers))
@@ -306,8 +363,23 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
 
     logger.info(multiprocessing.current_process().name + ' (Manager) All the workers are done. Exiting...')
 
-
-def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name):
+def load_ads_timestamps(bibcodes, extraction_directory):
+    """function that writes the ADS timestamps of the bibcodes to extract in the ledger of the extraction"""
+    ledger = pipeline_extraction_ledger.ExtractionLedger(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory))
+    try:
+        ledger.load_ads_timestamps(pipeline_timestamp_manager.iter_ads_timestamps(bibcodes))
+    finally:
+        ledger.close()
+
+def get_group_timestamps(bibcodes, extraction_directory):
+    """function that reads the ADS timestamps of the bibcodes of a group from the ledger of the extraction"""
+    ledger = pipeline_extraction_ledger.ExtractionLedger(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory))
+    try:
+        return ledger.get_ads_timestamps(bibcodes)
+    finally:
+        ledger.close()
+
+def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name, converter):
     """Worker function for the extraction of bibcodes from ADS
         it has been defined outside any class because it's more simple to treat with multiprocessing """
     logger.warning(multiprocessing.current_process().name + ' (worker) Process started')
@@ -325,13 +397,21 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
     #I remove the automatic join from the queue of the files to upload
     q_uplfile.cancel_join_thread()
     
-    #I get the maximum number of groups I can process
-    max_num_groups = settings.MAX_NUMBER_OF_GROUP_TO_PROCESS
-    #variable used to know if I'm exiting because the queue is empty or because I reached the maximum number of groups to process
+    #if the groups are processed by stages, the records can be merged by a pool of processes that lives as long as the worker
+    if settings.EXTRACTION_PIPELINE == 'staged' and settings.MERGE_STAGE_PROCESSES > 0:
+        merge_pool = multiprocessing.Pool(settings.MERGE_STAGE_PROCESSES)
+    else:
+        merge_pool = None
+
+    #I count the groups processed and the lifetime of the worker to know when it has to be recycled
+    worker_start_time = time()
+    groups_processed = 0
+    #variable used to know if I'm exiting because the queue is empty or because I reached one of the limits of the worker
     queue_empty = False
+    recycle_reason = None
 
-    #while there is something to process or I reach the maximum number of groups I can process,  I try to process
-    for grpnum in range(max_num_groups):
+    #while there is something to process and I don't reach one of the limits of the worker,  I try to process
+    while recycle_reason is None:
 
         task_todo = q_todo.get()
         if task_todo[0] == 'STOP':
@@ -339,9 +419,17 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
             queue_empty = True
             #I exit the loop
             break
+        #the groups travel in the queue as slices of the BibcodeArray of the extraction: the worker needs a list
+        task_todo[1] = list(task_todo[1])
 
         #I print when I'm starting the extraction
         local_logger.warning(multiprocessing.current_process().name + (' starting to process group %s' % task_todo[0]))
+        group_start_time = time()
+        memory_guard = xml_transformer.LibxmlMemoryGuard('group %s' % task_todo[0], local_logger)
+        memory_guard.start()
+        #the peak of the resident memory during this group (not during the whole life of the worker)
+        rss_sampler = GroupRssSampler()
+        rss_sampler.start()
 
         ############
         #then I process the bibcodes
@@ -349,100 +437,66 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
         bibcodes_ok = []
         bibcodes_probl = []
 
-        #I define a ADSEXPORT object
-        recs = ADSRecords('full', 'XML')
-
-        # I define a maximum amount of bibcodes I can skip per each cicle: the number of bibcodes per group / 10 (minimum 500)
-        # if i skip more than this amount it means that there is something
-        # wrong with the access to the data and it's better to stop everything
-        max_number_of_bibs_to_skip = max(settings.NUMBER_OF_BIBCODES_PER_GROUP / 10, settings.MAX_SKIPPED_BIBCODES)
-
-        for bibcode in task_todo[1]:
-            try:
-                recs.addCompleteRecord(bibcode)
-                bibcodes_ok.append(bibcode)
-            except Exception, error:
-                local_logger.error(': problem retrieving the bibcode "%s" in group %s' % (bibcode, task_todo[0]))
-                #I catch the exception type name
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                try:
-                    str_error_to_print = exc_type.__name__ + '\t' + str(error)
-                except:
-                    try:
-                        str_error_to_print = u'%s\t%s' % (unicode(exc_type.__name__), unicode(error))
-                    except:
-                        local_logger.error(' Cannot log error for bibcode %s ' % bibcode)
-                        str_error_to_print = ''
-                bibcodes_probl.append((bibcode, str_error_to_print))
-                max_number_of_bibs_to_skip = max_number_of_bibs_to_skip - 1
-            #If i=I reach 0 It means that I skipped 1k bibcodes and probably there is a problem: so I simulate an exit for empty queue
-            if max_number_of_bibs_to_skip == 0:
-                break
-        #I exit from both loops
-        if max_number_of_bibs_to_skip == 0:
+        #time spent for each bibcode: it is the cost used to build the groups in the next extractions
+        bibcodes_cost = {}
+        #the bibcodes with the same ADS timestamp of their cached export are not retrieved from ADS:
+        #the ADS timestamps of the group (the last item of the task) are read from the ledger
+        if settings.ADS_EXPORT_CACHE:
+            task_todo[3] = get_group_timestamps(task_todo[1], extraction_directory)
+            export_cache = pipeline_ads_export_cache.ADSExportCache(settings.ADS_EXPORT_CACHE_DIR, local_logger)
+        else:
+            export_cache = None
+        if settings.EXTRACTION_PIPELINE == 'staged':
+            group_completed = process_group_staged(task_todo, converter, merge_pool, export_cache, bibcodes_ok, bibcodes_probl, bibcodes_cost, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger)
+        else:
+            group_completed = process_group_serial(task_todo, converter, export_cache, bibcodes_ok, bibcodes_probl, bibcodes_cost, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger)
+        group_peak_rss = rss_sampler.stop()
+        #if too many bibcodes have been skipped I exit as if the queue was empty
+        if not group_completed:
             local_logger.warning(' Detected possible error with ADS data access: skipped %s bibcodes in one group' % max(settings.NUMBER_OF_BIBCODES_PER_GROUP / 10, settings.MAX_SKIPPED_BIBCODES))
+            #the bibcodes already written in the bibrecord files (and passed to the upload) are done anyway,
+            #the other ones stay pending
+            if bibcodes_ok:
+                q_done.put([task_todo[0], bibcodes_ok, [(bibcode, bibcodes_cost[bibcode]) for bibcode in bibcodes_ok if bibcode in bibcodes_cost], None])
             queue_empty = True
             break
 
-        #I extract the object I created
-        xmlobj = recs.export()
-        del recs
-
-        try:
-            #I define a transformation object
-            transf = xml_transformer.XmlTransformer(local_logger)
-            #and I transform my object
-            marcxml = transf.transform(xmlobj)
-        except:
-            err_msg = ' Impossible to transform the XML!'
-            local_logger.critical(err_msg)
-            raise GenericError(err_msg)
-
-        if marcxml:
-            #I merge the records
-            merged_records, records_with_merging_probl = merger.merge_records_xml(marcxml)
-            #If I had problems to merge some records I remove the bibcodes from the list "bibcodes_ok" and I add them to "bibcodes_probl"
-            for elem in records_with_merging_probl:
-                try:
-                    bibcodes_ok.remove(elem[0])
-                except ValueError:
-                    local_logger.warning(' Problems to remove bibcode "%s" in group "%s" from the list of bibcodes extracted after merging' % (elem[0], task_todo[0]) )
-                    if elem[0] in bibcodes_probl:
-                        local_logger.error(': bibcode "%s" reached the merger but was in problematic bibcodes!' % elem[0])
-            bibcodes_probl = bibcodes_probl + records_with_merging_probl
-            #########
-            #I write the object in a file
-            ##########
-            filepath = os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory, pipeline_settings.BASE_BIBRECORD_FILES_DIR, pipeline_settings.BIBREC_FILE_BASE_NAME+'_'+extraction_name+'_'+task_todo[0])
-            output = open(filepath, 'wb')
-            pickle.dump(merged_records, output)
-            output.close()
-            #then I write the filepath to a file for eventual future recovery
-            lock_createdfiles.acquire()
-            bibrec_file_obj = open(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory,settings.LIST_BIBREC_CREATED), 'a')
-            bibrec_file_obj.write(filepath + '\n')
-            bibrec_file_obj.close()
-            lock_createdfiles.release()
-            #finally I append the file to the queue
-            local_logger.info('Insert in queue for upload the file "%s" of the group "%s" ' % (filepath, task_todo[0]))
-            q_uplfile.put((task_todo[0],filepath))
-            
-            #logger.info('record created, merged but not uploaded')
-            #bibupload_merger(merged_records, local_logger, 'replace_or_insert')
-            
-            
-        #otherwise I put all the bibcodes in the problematic
+        #and I check that nothing has been leaked by libxml2 during the group
+        memory_guard.check()
+
+        #the time not assigned to a single bibcode (like the XSLT transformation of the whole group) is split among all of them
+        if bibcodes_ok:
+            group_overhead = (time() - group_start_time - sum(bibcodes_cost.values())) / len(bibcodes_ok)
+            for bibcode in bibcodes_ok:
+                bibcodes_cost[bibcode] = bibcodes_cost.get(bibcode, 0.0) + max(group_overhead, 0.0)
+        #finally I pass to the done bibcodes to the proper file (with their costs and the counters of the cache)
+        if export_cache is not None:
+            cache_stats = export_cache.get_stats()
+            local_logger.warning(multiprocessing.current_process().name + (' cache of the ADS exports for group %s: %d hits, %d misses' % (task_todo[0], cache_stats['hits'], cache_stats['misses'])))
         else:
-            bibcodes_probl = bibcodes_probl + [(bib, 'Bibcode extraction ok, but xml generation failed') for bib in bibcodes_ok]
-            bibcodes_ok = []
-        
-        
-        #finally I pass to the done bibcodes to the proper file
-        q_done.put([task_todo[0], bibcodes_ok])
+            cache_stats = None
+        q_done.put([task_todo[0], bibcodes_ok, [(bibcode, bibcodes_cost[bibcode]) for bibcode in bibcodes_ok if bibcode in bibcodes_cost], cache_stats])
         #and the problematic bibcodes
         q_probl.put([task_todo[0], bibcodes_probl])
 
-        local_logger.warning(multiprocessing.current_process().name + (' finished to process group %s' % task_todo[0]))
+        if task_todo[2] is not None:
+            predicted = '%.1f seconds' % task_todo[2]
+        else:
+            predicted = 'unknown'
+        local_logger.warning(multiprocessing.current_process().name + (' finished to process group %s of %d bibcodes in %.1f seconds (predicted %s, converter %s)' % (task_todo[0], len(task_todo[1]), time() - group_start_time, predicted, converter)))
+
+        #I tell the manager the duration of the group and my peak of memory during the group (used to adapt the size of the groups)
+        q_life.put(['GROUP DONE', task_todo[0], len(task_todo[1]), time() - group_start_time, group_peak_rss])
+
+        #I check if the worker has to be recycled
+        groups_processed += 1
+        recycle_reason = get_worker_recycle_reason(groups_processed, worker_start_time)
+
+    #I check that all the libxml2 documents have been freed
+    xml_transformer.check_open_documents(local_logger)
+    if merge_pool is not None:
+        merge_pool.close()
+        merge_pool.join()
 
     if queue_empty:
         #I tell the output processes that I'm done
@@ -457,12 +511,386 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
         lock_stdout.release()
         local_logger.warning(multiprocessing.current_process().name + ' Queue empty: exiting')
     else:
-        #I tell the manager that I'm dying because I reached the maximum amount of group to process
-        q_life.put(['MAX LIFE REACHED'])
-        logger.warning(multiprocessing.current_process().name + ' (worker) Maximum amount of groups of bibcodes reached: exiting (pid #%s)' % os.getpid())
-        local_logger.warning(multiprocessing.current_process().name + ' Maximum amount of groups of bibcodes reached: exiting')
+        #I tell the manager that I'm dying because I reached one of the limits, so it can replace me
+        q_life.put(['MAX LIFE REACHED', recycle_reason])
+        logger.warning(multiprocessing.current_process().name + ' (worker) %s after %s groups: exiting (pid #%s)' % (recycle_reason, groups_processed, os.getpid()))
+        local_logger.warning(multiprocessing.current_process().name + ' %s after %s groups: exiting' % (recycle_reason, groups_processed))
     return
 
+def get_process_rss():
+    """function that returns the resident memory of the current process in MB"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, IndexError, ValueError):
+        #if /proc is not available I use the peak of the resident memory
+        return get_process_peak_rss()
+
+def get_process_peak_rss():
+    """function that returns the peak of the resident memory of the current process in MB"""
+    #on Linux ru_maxrss is in KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class GroupRssSampler(object):
+    """Class that samples the resident memory of the process with a thread while a group is processed:
+    stop returns the peak of the samples, that unlike ru_maxrss does not include the previous groups"""
+
+    def __init__(self, interval=settings.ADAPTIVE_GROUP_RSS_SAMPLING_INTERVAL):
+        """Constructor"""
+        self.interval = interval
+        self.peak_rss = 0.0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Method that takes the first sample and starts the thread"""
+        self.peak_rss = get_process_rss()
+        self.thread = threading.Thread(target=self._sample, name='rss-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _sample(self):
+        """Method executed by the thread: a sample every interval seconds until stop is called"""
+        while not self.stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, get_process_rss())
+
+    def stop(self):
+        """Method that stops the thread and returns the peak of the resident memory in MB"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.peak_rss = max(self.peak_rss, get_process_rss())
+        return self.peak_rss
+
+def get_worker_recycle_reason(groups_processed, worker_start_time):
+    """function that checks the limits of an extraction worker:
+    returns the reason why the worker has to be recycled or None if it can process another group"""
+    if settings.MAX_NUMBER_OF_GROUP_TO_PROCESS and groups_processed >= settings.MAX_NUMBER_OF_GROUP_TO_PROCESS:
+        return 'Maximum amount of groups of bibcodes reached'
+    rss = get_process_rss()
+    if settings.WORKER_MAX_RSS_MB and rss >= settings.WORKER_MAX_RSS_MB:
+        return 'Maximum resident memory reached (%.0f MB)' % rss
+    lifetime = time() - worker_start_time
+    if settings.WORKER_MAX_LIFETIME and lifetime >= settings.WORKER_MAX_LIFETIME:
+        return 'Maximum lifetime reached (%.0f seconds)' % lifetime
+    return None
+
+
+def process_group_serial(task_todo, converter, export_cache, bibcodes_ok, bibcodes_probl, bibcodes_cost, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger):
+    """function that extracts, converts, merges and writes the bibcodes of a group one step after the other.
+    The bibcodes are added to bibcodes_ok or bibcodes_probl and the time spent for each one to bibcodes_cost.
+    If export_cache is not None the bibcodes in the cache are not retrieved from ADS.
+    Returns False if too many bibcodes could not be retrieved from ADS:
+    in that case nothing has been written and bibcodes_ok is empty"""
+    #I define a ADSEXPORT object
+    recs = ADSRecords('full', 'XML')
+
+    # I define a maximum amount of bibcodes I can skip per each cicle: the number of bibcodes per group / 10 (minimum 500)
+    # if i skip more than this amount it means that there is something
+    # wrong with the access to the data and it's better to stop everything
+    max_number_of_bibs_to_skip = max(settings.NUMBER_OF_BIBCODES_PER_GROUP / 10, settings.MAX_SKIPPED_BIBCODES)
+
+    #I take from the cache the bibcodes exported with the same ADS timestamp
+    if export_cache is not None:
+        bibcodes_to_retrieve, cached_records = export_cache.split_bibcodes(task_todo[1], task_todo[3])
+    else:
+        bibcodes_to_retrieve, cached_records = task_todo[1], []
+
+    #if required, some threads read ahead the next bibcodes while the current ones are added to the export
+    if settings.PREFETCH_THREADS > 0:
+        prefetcher = pipeline_ads_prefetcher.ADSRecordsPrefetcher(bibcodes_to_retrieve, ADSRecords, settings.PREFETCH_THREADS, settings.PREFETCH_READ_AHEAD, local_logger)
+        prefetcher.start()
+    else:
+        prefetcher = None
+
+    try:
+        for bibcode in bibcodes_to_retrieve:
+            if prefetcher is not None:
+                prefetcher.wait(bibcode)
+            try:
+                bibcode_start_time = time()
+                recs.addCompleteRecord(bibcode)
+                bibcodes_cost[bibcode] = time() - bibcode_start_time
+                bibcodes_ok.append(bibcode)
+            except Exception, error:
+                local_logger.error(': problem retrieving the bibcode "%s" in group %s' % (bibcode, task_todo[0]))
+                bibcodes_probl.append((bibcode, get_retrieval_error_message(error, bibcode, local_logger)))
+                max_number_of_bibs_to_skip = max_number_of_bibs_to_skip - 1
+            #If i=I reach 0 It means that I skipped 1k bibcodes and probably there is a problem: so I simulate an exit for empty queue
+            if max_number_of_bibs_to_skip == 0:
+                break
+    finally:
+        if prefetcher is not None:
+            prefetcher.stop()
+    #I stop processing the group
+    if max_number_of_bibs_to_skip == 0:
+        del bibcodes_ok[:]
+        return False
+    bibcodes_ok.extend(bibcode for bibcode, record_xml in cached_records)
+
+    #I extract the object I created: the documents are owned by guards that free them at the end of the group
+    if bibcodes_to_retrieve:
+        ads_xml_doc = xml_transformer.LibxmlDocument(recs.export(), local_logger)
+    else:
+        ads_xml_doc = xml_transformer.LibxmlDocument(pipeline_ads_export_cache.new_ads_xml_document(), local_logger)
+    del recs
+    with ads_xml_doc as xmlobj:
+        #the records retrieved are stored in the cache and the ones from the cache are added to the document
+        if export_cache is not None and xmlobj:
+            export_cache.store_records(xmlobj, task_todo[3])
+            pipeline_ads_export_cache.add_cached_records(xmlobj, cached_records)
+        del cached_records
+        if converter == 'native':
+            #I convert directly the ADS XML to bibrecord without the stylesheet
+            all_records = ads_xml_converter.iter_records_from_ads_xml(xmlobj, local_logger, free_subtrees=True)
+            merge_and_write_records(all_records, task_todo[0], bibcodes_ok, bibcodes_probl, bibcodes_cost, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger)
+        else:
+            try:
+                #I define a transformation object
+                transf = xml_transformer.XmlTransformer(local_logger)
+                #and I transform my object
+                marcxml_doc = xml_transformer.LibxmlDocument(transf.transform(xmlobj), local_logger)
+            except:
+                err_msg = ' Impossible to transform the XML!'
+                local_logger.critical(err_msg)
+                raise GenericError(err_msg)
+            #the ADS XML is not needed anymore
+            ads_xml_doc.free()
+            with marcxml_doc as marcxml:
+                if marcxml:
+                    all_records = xml_transformer.iter_records_from_libxml_obj(marcxml, local_logger, free_subtrees=True)
+                    merge_and_write_records(all_records, task_todo[0], bibcodes_ok, bibcodes_probl, bibcodes_cost, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger)
+                #otherwise I put all the bibcodes in the problematic
+                else:
+                    bibcodes_probl.extend([(bib, 'Bibcode extraction ok, but xml generation failed') for bib in bibcodes_ok])
+                    del bibcodes_ok[:]
+    return True
+
+def process_group_staged(task_todo, converter, merge_pool, export_cache, bibcodes_ok, bibcodes_probl, bibcodes_cost, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger):
+    """function that processes the bibcodes of a group with a chain of stages connected by bounded queues:
+    the retrieval from ADS of batches of bibcodes (I/O threads), the conversion of each batch, 
+    the merging of each record (in the merge_pool processes if there is one) and the writing of the bibrecord files.
+    The bibcodes are added to bibcodes_ok or bibcodes_probl and the time spent for each one to bibcodes_cost.
+    If export_cache is not None the bibcodes in the cache are not retrieved from ADS.
+    Returns False if too many bibcodes could not be retrieved from ADS: the files already written
+    have been passed to the upload, so in that case bibcodes_ok has the bibcodes of these files only"""
+    group_name = task_todo[0]
+    #the lists of bibcodes and the costs are shared by the threads of the stages
+    lock_bibcodes = threading.Lock()
+    #maximum amount of bibcodes I can skip, as in process_group_serial
+    bibs_to_skip = {'left': max(settings.NUMBER_OF_BIBCODES_PER_GROUP / 10, settings.MAX_SKIPPED_BIBCODES)}
+    
+    def extract_batch(bibcodes):
+        """stage that retrieves a batch of bibcodes from ADS and returns the ADS XML document"""
+        recs = ADSRecords('full', 'XML')
+        if export_cache is not None:
+            bibcodes, cached_records = export_cache.split_bibcodes(bibcodes, task_todo[3])
+        else:
+            cached_records = []
+        batch_ok = []
+        for bibcode in bibcodes:
+            try:
+                bibcode_start_time = time()
+                recs.addCompleteRecord(bibcode)
+                bibcode_cost = time() - bibcode_start_time
+            except Exception, error:
+                local_logger.error(': problem retrieving the bibcode "%s" in group %s' % (bibcode, group_name))
+                str_error_to_print = get_retrieval_error_message(error, bibcode, local_logger)
+                with lock_bibcodes:
+                    bibcodes_probl.append((bibcode, str_error_to_print))
+                    bibs_to_skip['left'] -= 1
+                    if bibs_to_skip['left'] <= 0:
+                        raise GenericError(' Too many bibcodes skipped in group %s' % group_name)
+            else:
+                batch_ok.append(bibcode)
+                with lock_bibcodes:
+                    bibcodes_cost[bibcode] = bibcode_cost
+        #the document is owned by a LibxmlDocument as soon as it exists, so that it is freed also if the chain stops
+        if batch_ok:
+            ads_xml_doc = xml_transformer.LibxmlDocument(recs.export(), local_logger)
+        elif cached_records:
+            ads_xml_doc = xml_transformer.LibxmlDocument(pipeline_ads_export_cache.new_ads_xml_document(), local_logger)
+        else:
+            return []
+        try:
+            if batch_ok and export_cache is not None:
+                export_cache.store_records(ads_xml_doc.doc, task_todo[3])
+            #the records from the cache are added to the document of the batch
+            pipeline_ads_export_cache.add_cached_records(ads_xml_doc.doc, cached_records)
+        except:
+            ads_xml_doc.free()
+            raise
+        batch_ok.extend(bibcode for bibcode, record_xml in cached_records)
+        with lock_bibcodes:
+            bibcodes_ok.extend(batch_ok)
+        return [(batch_ok, ads_xml_doc)]
+    
+    def convert_batch(batch):
+        """stage that converts the ADS XML document of a batch and returns its records"""
+        batch_ok, ads_xml_doc = batch
+        with ads_xml_doc as xmlobj:
+            if converter == 'native':
+                return list(ads_xml_converter.iter_records_from_ads_xml(xmlobj, local_logger, free_subtrees=True))
+            marcxml_doc = xml_transformer.LibxmlDocument(xml_transformer.XmlTransformer(local_logger).transform(xmlobj), local_logger)
+            ads_xml_doc.free()
+            with marcxml_doc as marcxml:
+                if marcxml:
+                    return list(xml_transformer.iter_records_from_libxml_obj(marcxml, local_logger, free_subtrees=True))
+        #if the transformation failed I put all the bibcodes of the batch in the problematic
+        with lock_bibcodes:
+            for bibcode in batch_ok:
+                move_bibcode_to_problematic(bibcode, 'Bibcode extraction ok, but xml generation failed', group_name, bibcodes_ok, bibcodes_probl, local_logger)
+        return []
+    
+    def merge(records):
+        """stage that merges a record"""
+        merge_start_time = time()
+        if merge_pool is not None:
+            bibcode, merged_record = merge_pool.apply(merger.merge_record, (records,))
+        else:
+            bibcode, merged_record = merger.merge_record(records)
+        with lock_bibcodes:
+            bibcodes_cost[bibcode] = bibcodes_cost.get(bibcode, 0.0) + time() - merge_start_time
+            if isinstance(merged_record, MergingError):
+                move_bibcode_to_problematic(bibcode, str(merged_record), group_name, bibcodes_ok, bibcodes_probl, local_logger)
+                return []
+        return [merged_record]
+    
+    #the writing of the files is done by only one thread that numbers the files and keeps the bibcodes written
+    bibfile = {'records': [], 'number': 0, 'bibcodes': []}
+    
+    def write_records(merged_record):
+        """stage that writes the merged records in files of NUMBER_OF_RECORDS_PER_BIBFILE records"""
+        bibfile['records'].append(merged_record)
+        if len(bibfile['records']) == settings.NUMBER_OF_RECORDS_PER_BIBFILE:
+            write_remaining_records()
+        return []
+    
+    def write_remaining_records():
+        """function that writes the records not written yet"""
+        if bibfile['records']:
+            bibfile['number'] += 1
+            write_bibrecord_file(bibfile['records'], group_name, bibfile['number'], lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger)
+            bibfile['bibcodes'].extend(pipeline_bibrecord_file.get_record_bibcode(record) for record in bibfile['records'])
+            bibfile['records'] = []
+        return []
+    
+    stages = [pipeline_stages.Stage('extract', extract_batch, settings.EXTRACT_STAGE_THREADS),
+              pipeline_stages.Stage('convert', convert_batch, settings.CONVERT_STAGE_THREADS),
+              pipeline_stages.Stage('merge', merge, max(settings.MERGE_STAGE_PROCESSES, 1)),
+              pipeline_stages.Stage('write', write_records, 1, finish=write_remaining_records)]
+    pipeline = pipeline_stages.StagedPipeline(stages, settings.STAGE_QUEUE_SIZE, local_logger, discard=free_batch_document)
+    bibcodes = task_todo[1]
+    batches = [bibcodes[i:i + settings.EXTRACT_BATCH_SIZE] for i in range(0, len(bibcodes), settings.EXTRACT_BATCH_SIZE)]
+    try:
+        pipeline.run(batches)
+    except GenericError:
+        if bibs_to_skip['left'] <= 0:
+            #the stages are stopped: only the bibcodes in the files already written are done
+            bibcodes_ok[:] = bibfile['bibcodes']
+            return False
+        raise
+    finally:
+        pipeline.log_stats(local_logger, 'Group %s' % group_name)
+    return True
+
+def free_batch_document(item):
+    """function that frees the ADS XML document of a batch left in the stages when they are stopped"""
+    if isinstance(item, tuple) and len(item) == 2 and isinstance(item[1], xml_transformer.LibxmlDocument):
+        item[1].free()
+
+def move_bibcode_to_problematic(bibcode, reason, group_name, bibcodes_ok, bibcodes_probl, local_logger):
+    """function that removes a bibcode from the list "bibcodes_ok" and adds it to "bibcodes_probl" """
+    try:
+        bibcodes_ok.remove(bibcode)
+    except ValueError:
+        local_logger.warning(' Problems to remove bibcode "%s" in group "%s" from the list of bibcodes extracted after merging' % (bibcode, group_name) )
+        if bibcode in bibcodes_probl:
+            local_logger.error(': bibcode "%s" reached the merger but was in problematic bibcodes!' % bibcode)
+    bibcodes_probl.append((bibcode, reason))
+
+def get_retrieval_error_message(error, bibcode, local_logger):
+    """function that returns the message for a bibcode that could not be retrieved from ADS
+    (it must be called while the exception is handled)"""
+    #I catch the exception type name
+    exc_type, exc_obj, exc_tb = sys.exc_info()
+    try:
+        str_error_to_print = exc_type.__name__ + '\t' + str(error)
+    except:
+        try:
+            str_error_to_print = u'%s\t%s' % (unicode(exc_type.__name__), unicode(error))
+        except:
+            local_logger.error(' Cannot log error for bibcode %s ' % bibcode)
+            str_error_to_print = ''
+    return str_error_to_print
+
+def merge_and_write_records(all_records, group_name, bibcodes_ok, bibcodes_probl, bibcodes_cost, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger):
+    """function that merges the records one at a time and every NUMBER_OF_RECORDS_PER_BIBFILE merged records
+    writes them in a file that is immediately passed to the upload.
+    The bibcodes that cannot be merged are moved from bibcodes_ok to bibcodes_probl
+    and the time spent to convert and merge each record is added to its cost in bibcodes_cost"""
+    merged_records = []
+    file_number = 0
+    record_start_time = time()
+    for bibcode, merged_record in merger.merge_records_iter(all_records):
+        #the records are converted while they are merged, so the time between two records includes both
+        record_end_time = time()
+        bibcodes_cost[bibcode] = bibcodes_cost.get(bibcode, 0.0) + record_end_time - record_start_time
+        record_start_time = record_end_time
+        #If I had problems to merge the record I remove the bibcode from the list "bibcodes_ok" and I add it to "bibcodes_probl"
+        if isinstance(merged_record, MergingError):
+            move_bibcode_to_problematic(bibcode, str(merged_record), group_name, bibcodes_ok, bibcodes_probl, local_logger)
+            continue
+        merged_records.append(merged_record)
+        if len(merged_records) == settings.NUMBER_OF_RECORDS_PER_BIBFILE:
+            file_number += 1
+            write_bibrecord_file(merged_records, group_name, file_number, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger)
+            merged_records = []
+    #finally I write the remaining records
+    if merged_records:
+        file_number += 1
+        write_bibrecord_file(merged_records, group_name, file_number, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger)
+    
+    #logger.info('record created, merged but not uploaded')
+    #bibupload_merger(merged_records, local_logger, 'replace_or_insert')
+
+def write_bibrecord_file(merged_records, group_name, file_number, lock_createdfiles, q_uplfile, extraction_directory, extraction_name, local_logger):
+    """Function that writes a list of merged records in a file 
+    and puts the file in the queue of the files to upload"""
+    #########
+    #I write the object in a file
+    ##########
+    filepath = os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory, pipeline_settings.BASE_BIBRECORD_FILES_DIR, pipeline_settings.BIBREC_FILE_BASE_NAME+'_'+extraction_name+'_'+group_name+'_'+str(file_number).zfill(3))
+    #bibupload reads only pickled lists of records: in that case the files are always written pickled
+    if settings.BIBREC_FILE_FORMAT == 'indexed' and UPLOAD_MODE != 'bibupload':
+        pipeline_bibrecord_file.write_bibrecord_file(filepath, merged_records, settings.BIBREC_FILE_COMPRESSION)
+    else:
+        output = open(filepath, 'wb')
+        pickle.dump(merged_records, output)
+        output.close()
+    #then I write the filepath to a file for eventual future recovery
+    lock_createdfiles.acquire()
+    bibrec_file_obj = open(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory,settings.LIST_BIBREC_CREATED), 'a')
+    bibrec_file_obj.write(filepath + '\n')
+    bibrec_file_obj.close()
+    lock_createdfiles.release()
+    #and in the ledger of the extraction
+    set_bibrecord_file_state(filepath, extraction_directory, uploaded=False)
+    #finally I append the file to the queue
+    local_logger.info('Insert in queue for upload the file "%s" of the group "%s" ' % (filepath, group_name))
+    q_uplfile.put((group_name, filepath))
+
+def set_bibrecord_file_state(filepath, extraction_directory, uploaded):
+    """function that writes in the ledger of the extraction that a bibrecord file has been created 
+    or that it has been uploaded (with all its bibcodes)"""
+    ledger = pipeline_extraction_ledger.ExtractionLedger(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory))
+    try:
+        if uploaded:
+            ledger.set_file_uploaded(filepath, pipeline_bibrecord_file.read_bibcodes(filepath))
+        else:
+            ledger.add_file(filepath)
+    finally:
+        ledger.close()
 
 def done_extraction_process(q_done, num_active_workers, lock_stdout, q_life, extraction_directory):
     """Worker that takes care of the groups of bibcodes processed and writes the bibcodes to the related file
@@ -480,6 +908,8 @@ def done_extraction_process(q_done, num_active_workers, lock_stdout, q_life, ext
     #I print the same message for the local logger
     local_logger.warning(multiprocessing.current_process().name + ' Process started')
     
+    #counters of the cache of the ADS exports for the whole extraction
+    cache_stats = None
     while(True):
         group_done = q_done.get()
 
@@ -495,10 +925,20 @@ def done_extraction_process(q_done, num_active_workers, lock_stdout, q_life, ext
             if len(group_done[1]) > 0:
                 w2f = write_files.WriteFile(extraction_directory, local_logger)
                 w2f.write_done_bibcodes_to_file(group_done[1])
+                w2f.write_bibcodes_cost_to_file(group_done[2])
 
                 lock_stdout.acquire()
                 local_logger.warning(multiprocessing.current_process().name + (' wrote done bibcodes for group %s' % group_done[0]))
                 lock_stdout.release()
+            #I update the counters of the cache of the ADS exports
+            if group_done[3] is not None:
+                if cache_stats is None:
+                    cache_stats = dict(group_done[3])
+                else:
+                    for counter, value in group_done[3].items():
+                        cache_stats[counter] += value
+                w2f = write_files.WriteFile(extraction_directory, local_logger)
+                w2f.write_ads_export_cache_stats_to_file(pipeline_ads_export_cache.format_stats(cache_stats))
 
 
     #I tell the manager that I'm done and I'm exiting
@@ -581,11 +1021,9 @@ def upload_process(q_uplfile, lock_stdout, lock_donefiles, q_life, extraction_di
                 logger.error('Received the unexpected message "%s" from upload queue.' % file_to_upload[0])
                 break
             if upload_mode == 'concurrent':
-                file_obj = open(filepath, 'rb')
-                # I load the object in the file
+                # I read the records of the file one at a time while they are uploaded
                 local_logger.warning('Upload of the group "%s" started' % file_to_upload[0])
-                merged_records = pickle.load(file_obj)
-                file_obj.close()
+                merged_records = pipeline_bibrecord_file.iter_bibrecord_file(filepath)
                 #finally I upload
                 bibupload_merger(merged_records, local_logger, 'replace_or_insert')
                 #I log that I uploaded the file
@@ -593,12 +1031,18 @@ def upload_process(q_uplfile, lock_stdout, lock_donefiles, q_life, extraction_di
                 with open(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory,settings.LIST_BIBREC_UPLOADED), 'a') as bibrec_file_obj:
                     bibrec_file_obj.write(filepath + '\n')
                 lock_donefiles.release()
+                set_bibrecord_file_state(filepath, extraction_directory, uploaded=True)
                 local_logger.warning('Upload of the group "%s" ended' % file_to_upload[0])
                 del merged_records
             elif upload_mode == 'bibupload':
+                #bibupload reads only pickled lists of records: the indexed files (of an extraction
+                #started with another upload mode and recovered) are rewritten pickled, without keeping a copy
+                if pipeline_bibrecord_file.is_indexed_bibrecord_file(filepath):
+                    pipeline_bibrecord_file.rewrite_as_pickled_file(filepath)
                 task_low_level_submission('bibupload', 'admin', '-i', '-r', '--pickled-input-file', '--update-mode', filepath)
                 with open(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory,settings.LIST_BIBREC_UPLOADED), 'a') as bibrec_file_obj:
                     bibrec_file_obj.write(filepath + '\n')
+                set_bibrecord_file_state(filepath, extraction_directory, uploaded=True)
                 local_logger.warning('File "%s" submitted to bibupload.' % filepath)
             else:
                 local_logger.error('Upload mode "%s" not supported! File not uploaded' % upload_mode)
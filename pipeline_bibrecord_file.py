@@ -0,0 +1,208 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module that writes and reads the files of merged records passed to the upload.
+The format of the files is:
+  header:  MAGIC and one byte with the flags (FLAG_ZLIB if the records are compressed)
+  records: for each record its length (4 bytes) and the record pickled with the highest protocol
+           (and compressed with zlib if required)
+  index:   the list of (bibcode, offset of the record) with the same encoding of a record
+  trailer: the offset of the index (8 bytes) and MAGIC
+so that the records can be read one at a time from the beginning or looked up by bibcode with the index.
+The files written with pickle.dump by the previous versions of the pipeline can still be read.
+'''
+
+import os
+import zlib
+import struct
+import cPickle as pickle
+
+from merger.merger_settings import FIELD_TO_MARC, SYSTEM_NUMBER_SUBFIELD
+from merger.merger_errors import GenericError
+
+MAGIC = 'ADSBREC1'
+FLAG_ZLIB = 1
+HEADER = struct.Struct('>%dsB' % len(MAGIC))
+LENGTH = struct.Struct('>I')
+TRAILER = struct.Struct('>Q%ds' % len(MAGIC))
+
+def get_record_bibcode(record):
+    """function that returns the bibcode of a merged record (None if it has no system number)"""
+    for field in record.get(FIELD_TO_MARC['system number'], []):
+        for code, value in field[0]:
+            if code == SYSTEM_NUMBER_SUBFIELD:
+                return value
+    return None
+
+class BibrecordFileWriter(object):
+    """Class that writes the merged records in a file one at a time"""
+
+    def __init__(self, filepath, compress=True):
+        """Constructor"""
+        self.filepath = filepath
+        self.compress = compress
+        self.index = []
+        self.file_obj = open(filepath, 'wb')
+        self.file_obj.write(HEADER.pack(MAGIC, FLAG_ZLIB if compress else 0))
+
+    def _write_block(self, obj):
+        """Method that writes an object with its length and returns its offset"""
+        offset = self.file_obj.tell()
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if self.compress:
+            data = zlib.compress(data)
+        self.file_obj.write(LENGTH.pack(len(data)))
+        self.file_obj.write(data)
+        return offset
+
+    def write(self, record):
+        """Method that appends a record to the file"""
+        self.index.append((get_record_bibcode(record), self._write_block(record)))
+
+    def close(self):
+        """Method that writes the index and closes the file"""
+        if self.file_obj is None:
+            return
+        index_offset = self._write_block(self.index)
+        self.file_obj.write(TRAILER.pack(index_offset, MAGIC))
+        self.file_obj.close()
+        self.file_obj = None
+
+    def abort(self):
+        """Method that closes the file without the index and removes it: a file with the trailer is always complete"""
+        if self.file_obj is None:
+            return
+        self.file_obj.close()
+        self.file_obj = None
+        os.remove(self.filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        #if the writing failed the file is not completed
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+class BibrecordFileReader(object):
+    """Class that reads the merged records of a file:
+    iterating over it the records are read one at a time, get returns the record of a bibcode"""
+
+    def __init__(self, filepath):
+        """Constructor"""
+        self.filepath = filepath
+        self.file_obj = open(filepath, 'rb')
+        magic, flags = HEADER.unpack(self.file_obj.read(HEADER.size))
+        if magic != MAGIC:
+            self.file_obj.close()
+            raise GenericError('The file "%s" is not an indexed bibrecord file' % filepath)
+        self.compressed = bool(flags & FLAG_ZLIB)
+        #the trailer tells where the records end
+        self.file_obj.seek(-TRAILER.size, os.SEEK_END)
+        self.index_offset, magic = TRAILER.unpack(self.file_obj.read(TRAILER.size))
+        if magic != MAGIC:
+            self.file_obj.close()
+            raise GenericError('The bibrecord file "%s" is truncated' % filepath)
+        self.index = None
+        self.offsets = None
+
+    def _read_block(self, offset):
+        """Method that reads the object at an offset and returns it with the offset of the next one"""
+        self.file_obj.seek(offset)
+        length, = LENGTH.unpack(self.file_obj.read(LENGTH.size))
+        data = self.file_obj.read(length)
+        if self.compressed:
+            data = zlib.decompress(data)
+        return pickle.loads(data), offset + LENGTH.size + length
+
+    def get_index(self):
+        """Method that returns the list of (bibcode, offset) of the records"""
+        if self.index is None:
+            self.index = self._read_block(self.index_offset)[0]
+            self.offsets = dict(self.index)
+        return self.index
+
+    def bibcodes(self):
+        """Method that returns the bibcodes of the records in the order of the file"""
+        return [bibcode for bibcode, offset in self.get_index()]
+
+    def get(self, bibcode):
+        """Method that returns the record of a bibcode or None if it is not in the file"""
+        self.get_index()
+        if bibcode not in self.offsets:
+            return None
+        return self._read_block(self.offsets[bibcode])[0]
+
+    def __iter__(self):
+        offset = HEADER.size
+        while offset < self.index_offset:
+            record, offset = self._read_block(offset)
+            yield record
+
+    def __len__(self):
+        return len(self.get_index())
+
+    def close(self):
+        """Method that closes the file"""
+        self.file_obj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def write_bibrecord_file(filepath, merged_records, compress=True):
+    """function that writes a list of merged records in a file"""
+    with BibrecordFileWriter(filepath, compress) as writer:
+        for record in merged_records:
+            writer.write(record)
+
+def is_indexed_bibrecord_file(filepath):
+    """function that returns True if the file has the indexed format (False for the pickled lists)"""
+    with open(filepath, 'rb') as file_obj:
+        return file_obj.read(len(MAGIC)) == MAGIC
+
+def iter_bibrecord_file(filepath):
+    """generator of the merged records of a file, in the indexed format or pickled with pickle.dump"""
+    if is_indexed_bibrecord_file(filepath):
+        with BibrecordFileReader(filepath) as reader:
+            for record in reader:
+                yield record
+    else:
+        with open(filepath, 'rb') as file_obj:
+            for record in pickle.load(file_obj):
+                yield record
+
+def read_bibcodes(filepath):
+    """function that returns the bibcodes of the records of a file (from the index for the indexed files)"""
+    if is_indexed_bibrecord_file(filepath):
+        with BibrecordFileReader(filepath) as reader:
+            return reader.bibcodes()
+    return [get_record_bibcode(record) for record in iter_bibrecord_file(filepath)]
+
+def rewrite_as_pickled_file(filepath):
+    """function that rewrites the records of a file as a pickled list (the input of bibupload):
+    the new file replaces the old one only when it is complete"""
+    temporary_filepath = filepath + '.tmp'
+    with open(temporary_filepath, 'wb') as file_obj:
+        pickle.dump(list(iter_bibrecord_file(filepath)), file_obj, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporary_filepath, filepath)
@@ -0,0 +1,164 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module with the ledger of an extraction: a SQLite database in the extraction directory
+with the state of each bibcode to extract or to delete (pending, done, problem or uploaded),
+the time spent to extract each bibcode done (its cost, read by the next extractions)
+and the state of each bibrecord file (created or uploaded).
+If the ADS exports are cached, the ledger also has the ADS timestamps of the bibcodes to extract,
+read by each worker for its group only.
+The recovery of an extraction is a query on the ledger instead of reading the files
+of bibcodes and files in lists and sets.
+'''
+
+import os
+import sqlite3
+
+import pipeline_settings as settings
+
+#states of the bibcodes
+PENDING = 'pending'
+DONE = 'done'
+PROBLEM = 'problem'
+UPLOADED = 'uploaded'
+#states of the bibrecord files
+CREATED = 'created'
+
+#actions on the bibcodes
+EXTRACT = 'extract'
+DELETE = 'delete'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS bibcodes (bibcode TEXT PRIMARY KEY, action TEXT NOT NULL, state TEXT NOT NULL, reason TEXT)',
+    'CREATE INDEX IF NOT EXISTS bibcodes_state_action ON bibcodes (state, action)',
+    'CREATE TABLE IF NOT EXISTS files (filepath TEXT PRIMARY KEY, state TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS files_state ON files (state)',
+    'CREATE TABLE IF NOT EXISTS ledger_info (name TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS bibcodes_cost (bibcode TEXT PRIMARY KEY, cost REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS ads_timestamps (bibcode TEXT PRIMARY KEY, timestamp TEXT NOT NULL)',
+]
+
+#maximum number of bibcodes in a query (SQLite limits the number of variables of a statement)
+QUERY_CHUNK_SIZE = 500
+
+def get_ledger_path(extraction_dir):
+    """function that returns the path of the ledger of an extraction directory"""
+    return os.path.join(extraction_dir, settings.EXTRACTION_LEDGER)
+
+def has_extraction_ledger(extraction_dir):
+    """function that returns True if the extraction directory has a ledger with all its bibcodes
+    (the extractions of the previous versions of the pipeline have only the files of bibcodes)"""
+    if not os.path.exists(get_ledger_path(extraction_dir)):
+        return False
+    ledger = ExtractionLedger(extraction_dir)
+    try:
+        return ledger.bibcodes_loaded()
+    finally:
+        ledger.close()
+
+class ExtractionLedger(object):
+    """Class that reads and writes the ledger of an extraction.
+    Each method is a transaction, so the ledger can be written by all the processes of the extraction"""
+
+    def __init__(self, extraction_dir):
+        """Constructor"""
+        self.connection = sqlite3.connect(get_ledger_path(extraction_dir), timeout=settings.EXTRACTION_LEDGER_TIMEOUT)
+        #the bibcodes are byte strings
+        self.connection.text_factory = str
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        """Method that closes the connection to the ledger"""
+        self.connection.close()
+
+    def load_bibcodes(self, bibcodes_to_extract, bibcodes_to_delete):
+        """Method that inserts the bibcodes of the extraction as pending:
+        the ledger is valid only if all of them have been inserted"""
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO bibcodes (bibcode, action, state) VALUES (?, ?, ?)',
+                                        ((bibcode, EXTRACT, PENDING) for bibcode in bibcodes_to_extract))
+            self.connection.executemany('INSERT OR IGNORE INTO bibcodes (bibcode, action, state) VALUES (?, ?, ?)',
+                                        ((bibcode, DELETE, PENDING) for bibcode in bibcodes_to_delete))
+            self.connection.execute("INSERT OR REPLACE INTO ledger_info (name, value) VALUES ('bibcodes_loaded', '1')")
+
+    def bibcodes_loaded(self):
+        """Method that returns True if all the bibcodes of the extraction have been inserted"""
+        return self.connection.execute("SELECT value FROM ledger_info WHERE name = 'bibcodes_loaded'").fetchone() is not None
+
+    def set_bibcodes_state(self, bibcodes, state):
+        """Method that sets the state of a list of bibcodes
+        (the bibcodes already uploaded, written in a file before their group ended, stay uploaded)"""
+        with self.connection:
+            self.connection.executemany('UPDATE bibcodes SET state = ? WHERE bibcode = ? AND state != ?', ((state, bibcode, UPLOADED) for bibcode in bibcodes))
+
+    def set_problem_bibcodes(self, bibcodes_probl):
+        """Method that sets the state of a list of (bibcode, reason) to problem"""
+        with self.connection:
+            self.connection.executemany('UPDATE bibcodes SET state = ?, reason = ? WHERE bibcode = ? AND state != ?',
+                                        ((PROBLEM, reason, bibcode, UPLOADED) for bibcode, reason in bibcodes_probl))
+
+    def get_bibcodes(self, action, state=PENDING):
+        """Method that returns the sorted list of the bibcodes of an action in a state"""
+        return [row[0] for row in self.connection.execute('SELECT bibcode FROM bibcodes WHERE action = ? AND state = ? ORDER BY bibcode', (action, state))]
+
+    def count_bibcodes(self, state=PENDING):
+        """Method that returns the number of bibcodes in a state"""
+        return self.connection.execute('SELECT COUNT(*) FROM bibcodes WHERE state = ?', (state,)).fetchone()[0]
+
+    def add_bibcodes_cost(self, bibcodes_cost):
+        """Method that stores a list of (bibcode, seconds) spent to extract the bibcodes"""
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO bibcodes_cost (bibcode, cost) VALUES (?, ?)', bibcodes_cost)
+
+    def iter_bibcodes_cost(self):
+        """Method that yields the (bibcode, seconds) of the bibcodes with a cost, sorted by bibcode
+        (SQLite compares the strings byte by byte as Python)"""
+        for row in self.connection.execute('SELECT bibcode, cost FROM bibcodes_cost ORDER BY bibcode'):
+            yield row
+
+    def add_file(self, filepath):
+        """Method that inserts a bibrecord file just created"""
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO files (filepath, state) VALUES (?, ?)', (filepath, CREATED))
+
+    def set_file_uploaded(self, filepath, bibcodes):
+        """Method that sets a bibrecord file and its bibcodes as uploaded"""
+        with self.connection:
+            self.connection.execute('UPDATE files SET state = ? WHERE filepath = ?', (UPLOADED, filepath))
+            self.connection.executemany('UPDATE bibcodes SET state = ? WHERE bibcode = ?', ((UPLOADED, bibcode) for bibcode in bibcodes))
+
+    def get_files_to_upload(self):
+        """Method that returns the sorted list of the bibrecord files created and not uploaded"""
+        return [row[0] for row in self.connection.execute('SELECT filepath FROM files WHERE state = ? ORDER BY filepath', (CREATED,))]
+
+    def load_ads_timestamps(self, timestamps):
+        """Method that replaces the ADS timestamps with the ones of an iterable of (bibcode, timestamp):
+        if a bibcode is given more than once, the last timestamp is kept"""
+        with self.connection:
+            self.connection.execute('DELETE FROM ads_timestamps')
+            self.connection.executemany('INSERT OR REPLACE INTO ads_timestamps (bibcode, timestamp) VALUES (?, ?)', timestamps)
+
+    def get_ads_timestamps(self, bibcodes):
+        """Method that returns a dictionary with the ADS timestamps of a list of bibcodes
+        (the bibcodes without timestamp are not in the dictionary)"""
+        timestamps = {}
+        for i in range(0, len(bibcodes), QUERY_CHUNK_SIZE):
+            chunk = list(bibcodes[i:i + QUERY_CHUNK_SIZE])
+            query = 'SELECT bibcode, timestamp FROM ads_timestamps WHERE bibcode IN (%s)' % ', '.join('?' * len(chunk))
+            timestamps.update(self.connection.execute(query, chunk))
+        return timestamps
@@ -0,0 +1,229 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module that splits the bibcodes to extract in groups with the same estimated cost.
+The cost of a bibcode is the time spent to extract, convert and merge it 
+in the previous extractions (stored in the ledgers of the extractions);
+the bibcodes never extracted before get the median cost of the known ones.
+The costs are read from the ledgers sorted by bibcode and joined with the sorted bibcodes
+in a single pass, so that no cost is kept in memory for each bibcode.
+The groups keep the order of the bibcodes and their number is the same
+of the groups of NUMBER_OF_BIBCODES_PER_GROUP bibcodes.
+If the size of the groups is adaptive, the AdaptiveGrouper creates the groups
+one at a time during the extraction, according to the measures reported by the workers.
+'''
+
+import os
+import heapq
+import inspect
+import random
+
+import pipeline_settings as settings
+import pipeline_extraction_ledger
+from misclibs.bibcode_array import BibcodeArray
+
+#I get the global logger
+import logging
+logger = logging.getLogger(settings.LOGGING_GLOBAL_NAME)
+
+#cost of a bibcode when nothing is known
+DEFAULT_BIBCODE_COST = 1.0
+#maximum number of known costs from which their median is computed
+MEDIAN_SAMPLE_SIZE = 10000
+
+def get_previous_extraction_directories(extraction_directory):
+    """function that returns the names of the extraction directories that precede (or are) 
+    the current one, from the most recent"""
+    directories = [elem for elem in os.listdir(settings.BASE_OUTPUT_PATH)
+                   if os.path.isdir(os.path.join(settings.BASE_OUTPUT_PATH, elem)) and elem <= extraction_directory]
+    directories.sort(reverse=True)
+    return directories
+
+def read_bibcodes_cost(extraction_directories):
+    """generator of the (bibcode, cost) measured in the previous extractions, sorted by bibcode,
+    read from the ledgers of the extraction directories:
+    if a bibcode appears in multiple directories, the first directory wins"""
+    ledgers = []
+    streams = []
+    for priority, extraction_directory in enumerate(extraction_directories):
+        extraction_path = os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory)
+        if not os.path.isfile(pipeline_extraction_ledger.get_ledger_path(extraction_path)):
+            continue
+        ledger = pipeline_extraction_ledger.ExtractionLedger(extraction_path)
+        ledgers.append(ledger)
+        streams.append(_with_priority(ledger.iter_bibcodes_cost(), priority))
+    try:
+        previous_bibcode = None
+        for bibcode, priority, cost in heapq.merge(*streams):
+            if bibcode != previous_bibcode:
+                yield bibcode, cost
+                previous_bibcode = bibcode
+    finally:
+        for ledger in ledgers:
+            ledger.close()
+
+def _with_priority(bibcodes_cost, priority):
+    """generator of the (bibcode, priority, cost) of a stream of (bibcode, cost)"""
+    for bibcode, cost in bibcodes_cost:
+        yield bibcode, priority, cost
+
+def iter_bibcodes_cost(bibcodes, bibcodes_cost):
+    """generator of the cost of each bibcode (None if unknown), in the order of the bibcodes:
+    bibcodes is a BibcodeArray and bibcodes_cost a stream of (bibcode, cost) sorted by bibcode, both read once"""
+    costs_iter = iter(bibcodes_cost)
+    item = next(costs_iter, None)
+    for bibcode in bibcodes:
+        while item is not None and item[0] < bibcode:
+            item = next(costs_iter, None)
+        if item is not None and item[0] == bibcode:
+            yield item[1]
+        else:
+            yield None
+
+def estimate_default_cost(costs, sample_size=MEDIAN_SAMPLE_SIZE):
+    """function that returns the number of known costs (not None) of an iterable, their sum
+    and the cost of the bibcodes without a known cost: the median of a random sample of at most sample_size known costs"""
+    #the sample is the same at each run
+    generator = random.Random(0)
+    sample = []
+    number_of_costs = 0
+    total_cost = 0.0
+    for cost in costs:
+        if cost is None:
+            continue
+        number_of_costs += 1
+        total_cost += cost
+        if len(sample) < sample_size:
+            sample.append(cost)
+        else:
+            #reservoir sampling: each cost has the same probability to be in the sample
+            position = generator.randrange(number_of_costs)
+            if position < sample_size:
+                sample[position] = cost
+    if not sample:
+        return 0, 0.0, DEFAULT_BIBCODE_COST
+    sample.sort()
+    return number_of_costs, total_cost, sample[len(sample) / 2]
+
+def cost_balanced_grouper(n, bibcodes, costs, max_group_size=None, total_cost=None):
+    """function that splits the list of bibcodes in the same number of groups that 
+    the groups of n bibcodes would be, but with the same total cost.
+    costs is an iterable with the cost of each bibcode: if total_cost is given it is read only once.
+    The bibcodes keep their order and a group never contains more than max_group_size bibcodes
+    (in that case there can be more groups).
+    Returns the list of tuples (group, estimated cost of the group): the groups are slices of bibcodes
+    (so they are BibcodeArrays if bibcodes is a BibcodeArray)"""
+    if not len(bibcodes):
+        return []
+    number_of_groups = (len(bibcodes) + n - 1) / n
+    if total_cost is None:
+        costs = list(costs)
+        total_cost = sum(costs)
+    remaining_cost = float(total_cost)
+    groups = []
+    group_start = 0
+    group_cost = 0.0
+    for position, cost in enumerate(costs):
+        group_cost += cost
+        group_size = position + 1 - group_start
+        #each group takes its share of the cost still to distribute
+        target_cost = remaining_cost / max(number_of_groups - len(groups), 1)
+        if group_size == max_group_size or (group_cost >= target_cost and len(groups) < number_of_groups - 1):
+            groups.append((bibcodes[group_start:position + 1], group_cost))
+            remaining_cost -= group_cost
+            group_start = position + 1
+            group_cost = 0.0
+    if group_start < len(bibcodes):
+        groups.append((bibcodes[group_start:], group_cost))
+    return groups
+
+def partition_bibcodes(bibcodes, extraction_directory):
+    """function that splits the bibcodes to extract in groups according to GROUP_PARTITIONING.
+    Returns the list of tuples (group, estimated cost of the group in seconds or None if unknown):
+    the groups are slices of bibcodes, converted to lists only by the worker that extracts them"""
+    logger.info("In function %s" % (inspect.stack()[0][3],))
+    n = settings.NUMBER_OF_BIBCODES_PER_GROUP
+    if settings.GROUP_PARTITIONING != 'cost':
+        return [(bibcodes[i:i + n], None) for i in range(0, len(bibcodes), n)]
+    #the costs are joined with the bibcodes sorted
+    if not isinstance(bibcodes, BibcodeArray):
+        bibcodes = BibcodeArray(bibcodes)
+    directories = get_previous_extraction_directories(extraction_directory)[:settings.BIBCODES_COST_HISTORY]
+    #a first pass on the costs gives the cost of the unknown bibcodes and the total cost, a second one builds the groups
+    known, known_cost, default_cost = estimate_default_cost(iter_bibcodes_cost(bibcodes, read_bibcodes_cost(directories)))
+    total_cost = known_cost + (len(bibcodes) - known) * default_cost
+    costs = (cost if cost is not None else default_cost for cost in iter_bibcodes_cost(bibcodes, read_bibcodes_cost(directories)))
+    groups = cost_balanced_grouper(n, bibcodes, costs, n * settings.MAX_GROUP_SIZE_FACTOR, total_cost)
+    logger.warning('Bibcodes split in %d groups by cost: %d bibcodes of %d with a cost measured in the previous extractions, estimated total cost %.1f seconds' % 
+                   (len(groups), known, len(bibcodes), total_cost))
+    if not known:
+        #without any measure the costs are all the same and they are not times
+        return [(group, None) for group, group_cost in groups]
+    return groups
+
+class AdaptiveGrouper(object):
+    """Class that gives the groups of bibcodes to extract one at a time, with a size adapted
+    to the duration of the groups and to the peak resident memory of the workers reported during the extraction"""
+
+    def __init__(self, bibcodes, min_size=settings.ADAPTIVE_GROUP_MIN_SIZE, max_size=settings.ADAPTIVE_GROUP_MAX_SIZE,
+                 target_seconds=settings.ADAPTIVE_GROUP_TARGET_SECONDS, max_rss_mb=settings.WORKER_MAX_RSS_MB * settings.ADAPTIVE_GROUP_RSS_FRACTION):
+        """Constructor: the first groups have the minimum size, to have a fast feedback"""
+        self.bibcodes = bibcodes
+        self.position = 0
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_rss_mb = max_rss_mb
+        self.group_size = min_size
+        #estimated number of bibcodes processed per second by a worker
+        self.throughput = None
+
+    def has_bibcodes(self):
+        """Method that returns True if there are still bibcodes to put in a group"""
+        return self.position < len(self.bibcodes)
+
+    def next_group(self):
+        """Method that returns the next group of bibcodes with its predicted duration (None if unknown)"""
+        group = self.bibcodes[self.position:self.position + self.group_size]
+        self.position += len(group)
+        if self.throughput:
+            return group, len(group) / self.throughput
+        return group, None
+
+    def update(self, number_of_bibcodes, duration, peak_rss_mb):
+        """Method that updates the size of the next groups with the measures of a group just processed.
+        Returns the description of the decision"""
+        old_size = self.group_size
+        if number_of_bibcodes > 0 and duration > 0:
+            throughput = number_of_bibcodes / float(duration)
+            #the estimation gives more weight to the most recent groups
+            if self.throughput is None:
+                self.throughput = throughput
+            else:
+                self.throughput = 0.5 * self.throughput + 0.5 * throughput
+        if self.max_rss_mb and peak_rss_mb >= self.max_rss_mb:
+            #memory pressure: the groups are halved
+            self.group_size = max(self.min_size, self.group_size / 2)
+            reason = 'peak memory %.0f MB over %.0f MB' % (peak_rss_mb, self.max_rss_mb)
+        elif self.throughput:
+            #the groups grow at most of a factor 2 each time, towards the size that takes the target time
+            ideal_size = int(self.throughput * self.target_seconds)
+            self.group_size = max(self.min_size, min(self.max_size, ideal_size, self.group_size * 2))
+            reason = 'throughput %.1f bibcodes/s, target %d seconds per group' % (self.throughput, self.target_seconds)
+        else:
+            reason = 'no measure'
+        return 'group of %d bibcodes in %.1f seconds (peak memory %.0f MB): group size %d -> %d (%s)' % (
+            number_of_bibcodes, duration, peak_rss_mb, old_size, self.group_size, reason)
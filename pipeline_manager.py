@@ -23,7 +23,8 @@ if there has to be a new extraction, I create a new folder with the new four fil
 2- the bibcodes to parse (delete)
 3- the parsed bibcodes
 4- the bibcodes that gave problems during the extraction
-then I write the bibcodes to extract in the proper file
+then I write the bibcodes to extract in the proper file and in the ledger of the extraction
+(a SQLite database with the state of each bibcode and bibrecord file, used to recover the extraction)
 
 Finally I lunch the manager with the entire list of bibcodes to extract
 
@@ -42,6 +43,8 @@ import pipeline_settings as settings
 import pipeline_ads_record_extractor
 from merger.merger_errors import GenericError
 import pipeline_timestamp_manager
+import pipeline_extraction_ledger
+from misclibs.bibcode_array import BibcodeArray, BIBCODE_LENGTH
 import pipeline_settings
 
 #I get the global logger
@@ -54,7 +57,7 @@ DIRNAME = ''
 LATEST_EXTR_DIR = ''
 MODE = ''
 
-def manage(mode, upload_mode):
+def manage(mode, upload_mode, converter=settings.ADS_XML_CONVERTER):
     """public function"""
     logger.info("In function %s" % (inspect.stack()[0][3],))
     
@@ -71,7 +74,7 @@ def manage(mode, upload_mode):
         #retrieve the list of bibcode to extract and the list of bibcodes to delete
         (bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_list) = retrieve_bibcodes_to_extract()
         #call the extractor manager
-        pipeline_ads_record_extractor.extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_list, DIRNAME, upload_mode)
+        pipeline_ads_record_extractor.extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_list, DIRNAME, upload_mode, converter)
         return
 
 def retrieve_bibcodes_to_extract():
@@ -160,8 +163,8 @@ def check_last_extraction():
         #if I pass all this checks the content is basically fine
         #But then I have to check if the lists of bibcodes are consistent: bibcodes extracted + bibcodes with problems = sum(bibcodes to extract)
         logger.info("Checking if the list of bibcodes actually extracted is equal to the one I had to extract")
-        bibcodes_still_pending, files_to_upload = extr_diff_bibs_from_extraction(os.path.join(settings.BASE_OUTPUT_PATH, LATEST_EXTR_DIR))
-        if len(bibcodes_still_pending) == 0 and len(files_to_upload) == 0:
+        number_of_bibcodes_pending, number_of_files_to_upload = count_remaining_from_extraction(os.path.join(settings.BASE_OUTPUT_PATH, LATEST_EXTR_DIR))
+        if number_of_bibcodes_pending == 0 and number_of_files_to_upload == 0:
             logger.info("All the bibcodes and all files from the last extraction have been processed")
         else:
             logger.info("Checked last extraction: status returned LATEST NOT ENDED CORRECTLY")
@@ -178,12 +181,11 @@ def extract_full_list_of_bibcodes():
     logger.info("In function %s" % (inspect.stack()[0][3],))
     
     #I extract the list of published preprint
-    publ_prepr = read_bibcode_file(settings.ARXIV2PUB)
+    publ_prepr = BibcodeArray(iter_bibcode_file(settings.ARXIV2PUB))
     
-    #then I extract the complete list    
-    all_bibcodes = get_all_bibcodes()
-    bibcode_to_extract = list(set(all_bibcodes) - set(publ_prepr))
-    bibcode_to_extract.sort()
+    #then I extract the complete list (already sorted)
+    bibcode_to_extract = get_all_bibcodes().difference(publ_prepr)
+    del publ_prepr
 
     #I write these lists bibcodes to the file of bibcodes to extract
     bibcode_file = open(os.path.join(settings.BASE_OUTPUT_PATH, DIRNAME, settings.BASE_FILES['new']), 'a')
@@ -192,6 +194,8 @@ def extract_full_list_of_bibcodes():
         bibcode_file.write(bibcode + '\n')
     bibcode_file.close()
     del bibcode, bibcode_file
+    #and to the ledger of the extraction
+    load_extraction_ledger(bibcode_to_extract, [])
 
     logger.info("Full list of bibcodes and related file generated")
     #finally I return the full list of bibcodes and an empty list for the bibcodes to delete
@@ -204,14 +208,14 @@ def extract_update_list_of_bibcodes():
     #I estract the bibcodes
     records_added, records_modified, records_deleted = pipeline_timestamp_manager.get_records_status()
     #I merge the add and modif because I have to extract them in any case
-    new_mod_bibcodes_to_extract = list(records_added) + list(records_modified)
+    new_mod_bibcodes_to_extract = BibcodeArray(records_added).union(records_modified)
 
     #I extract the list of published preprint
-    publ_prepr = read_bibcode_file(settings.ARXIV2PUB)
+    publ_prepr = BibcodeArray(iter_bibcode_file(settings.ARXIV2PUB))
     
-    #I extract the not preprint first
-    bibcodes_to_extract = list(set(new_mod_bibcodes_to_extract) - set(publ_prepr))
-    bibcodes_to_extract.sort()
+    #I extract the not preprint first (already sorted)
+    bibcodes_to_extract = new_mod_bibcodes_to_extract.difference(publ_prepr)
+    del new_mod_bibcodes_to_extract, publ_prepr
     
     #then I write all these bibcodes to the proper files
     #first the one to extract
@@ -228,6 +232,8 @@ def extract_update_list_of_bibcodes():
     for bibcode in bibcodes_to_delete:
         bibcode_file.write(bibcode + '\n')
     bibcode_file.close()
+    #and both to the ledger of the extraction
+    load_extraction_ledger(bibcodes_to_extract, bibcodes_to_delete)
 
     #I return the list of bibcodes to extract and the list of bibcodes to delete
     return (bibcodes_to_extract, bibcodes_to_delete, [])
@@ -248,9 +254,38 @@ def extract_update_list_of_bibcodes():
 #    return published_from_preprint
 
 
+def load_extraction_ledger(bibcodes_to_extract, bibcodes_to_delete):
+    """method that writes the bibcodes of a new extraction in its ledger"""
+    logger.info("In function %s" % (inspect.stack()[0][3],))
+    ledger = pipeline_extraction_ledger.ExtractionLedger(os.path.join(settings.BASE_OUTPUT_PATH, DIRNAME))
+    try:
+        ledger.load_bibcodes(bibcodes_to_extract, bibcodes_to_delete)
+    finally:
+        ledger.close()
+
+def count_remaining_from_extraction(extraction_dir):
+    """method that returns the number of bibcodes and of files not processed in an extraction"""
+    logger.info("In function %s" % (inspect.stack()[0][3],))
+    if pipeline_extraction_ledger.has_extraction_ledger(extraction_dir):
+        ledger = pipeline_extraction_ledger.ExtractionLedger(extraction_dir)
+        try:
+            return ledger.count_bibcodes(pipeline_extraction_ledger.PENDING), len(ledger.get_files_to_upload())
+        finally:
+            ledger.close()
+    bibcodes_remaining, files_remaining = extr_diff_bibs_from_extraction(extraction_dir)
+    return len(bibcodes_remaining), len(files_remaining)
+
 def extr_diff_bibs_from_extraction(extraction_dir):
     """method that extracts the list of bibcodes not processed from a directory used for an extraction"""
     logger.info("In function %s" % (inspect.stack()[0][3],))
+    if pipeline_extraction_ledger.has_extraction_ledger(extraction_dir):
+        ledger = pipeline_extraction_ledger.ExtractionLedger(extraction_dir)
+        try:
+            bibcodes_remaining = ledger.get_bibcodes(pipeline_extraction_ledger.EXTRACT) + ledger.get_bibcodes(pipeline_extraction_ledger.DELETE)
+            return bibcodes_remaining, ledger.get_files_to_upload()
+        finally:
+            ledger.close()
+    #the extractions without ledger have only the files of bibcodes
     #first I extract the list of bibcodes that I had to extract
     bibcodes_to_extract = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['new']))
     #then the ones I had to delete
@@ -273,6 +308,13 @@ def extr_diff_bibs_from_extraction(extraction_dir):
 def rem_bibs_to_extr_del(extraction_dir):
     """method that finds the bibcodes to extract and to delete not processed in an extraction """
     logger.info("In function %s" % (inspect.stack()[0][3],))
+    if pipeline_extraction_ledger.has_extraction_ledger(extraction_dir):
+        ledger = pipeline_extraction_ledger.ExtractionLedger(extraction_dir)
+        try:
+            return (ledger.get_bibcodes(pipeline_extraction_ledger.EXTRACT), ledger.get_bibcodes(pipeline_extraction_ledger.DELETE), ledger.get_files_to_upload())
+        finally:
+            ledger.close()
+    #the extractions without ledger have only the files of bibcodes
     #first I extract the list of bibcodes that I had to extract
     bibcodes_to_extract = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['new']))
     #then the ones I had to delete
@@ -302,18 +344,23 @@ def get_all_bibcodes():
     # Timestamps ordered by increasing order of importance.
     timestamp_files_hierarchy = [settings.BIBCODES_GEN, settings.BIBCODES_PRE, settings.BIBCODES_PHY, settings.BIBCODES_AST ]
 
-    bibcodes = set([])
+    #I keep the bibcodes in a BibcodeArray: it is sorted and it takes much less memory than a set or a list
+    bibcodes = BibcodeArray()
     for filename in timestamp_files_hierarchy:
-        db_bibcodes = read_bibcode_file(filename)
-        bibcodes = bibcodes.union(set(db_bibcodes))
-    bibcodes_list = list(bibcodes)
-    bibcodes_list.sort()
-    return bibcodes_list
+        bibcodes = bibcodes.union(BibcodeArray(iter_bibcode_file(filename)))
+    return bibcodes
 
 def read_bibcode_file(bibcode_file_path):
     """ Function that read the list of bibcodes in one file:
         The bibcodes must be at the beginning of a row.
     """
+    return list(iter_bibcode_file(bibcode_file_path))
+
+def iter_bibcode_file(bibcode_file_path):
+    """ Generator of the bibcodes of one file, one at a time:
+        The bibcodes must be at the beginning of a row.
+        The bibcodes longer than BIBCODE_LENGTH are not valid and they are skipped.
+    """
     logger.info("In function %s" % (inspect.stack()[0][3],))
     logger.info("Reading %s" % bibcode_file_path)
     try:
@@ -323,19 +370,17 @@ def read_bibcode_file(bibcode_file_path):
         logger.critical(err_msg)
         raise GenericError(err_msg)
 
-    bibcodes_list = []
-
     for bibrow in bibfile:
         if bibrow[0] != " ":
             bibrow_elements =  bibrow.split('\t')
             bibcode = bibrow_elements[0].rstrip('\n')
-            if bibcode != '':
-                bibcodes_list.append(bibcode)
+            if len(bibcode) > BIBCODE_LENGTH:
+                logger.error('ERROR: Bibcode "%s" of %s longer than %d characters: skipped.' % (bibcode, bibcode_file_path, BIBCODE_LENGTH))
+            elif bibcode != '':
+                yield bibcode
 
     bibfile.close()
     del bibfile
-    #return the list of bibcodes
-    return bibcodes_list
 
 
 
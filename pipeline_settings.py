@@ -44,6 +44,11 @@ BASE_FILES = {'new':'bibcodes_to_extract_new_mod.dat', 'del':'bibcodes_to_extrac
 LIST_BIBREC_CREATED = 'bibrecs_created.list'
 LIST_BIBREC_UPLOADED = 'bibrecs_uploaded.list'
 
+#ledger of each extraction (SQLite database) with the state of the bibcodes and of the bibrecord files, used to recover an extraction
+EXTRACTION_LEDGER = 'extraction_ledger.sqlite'
+#seconds a process waits for the other processes writing the ledger
+EXTRACTION_LEDGER_TIMEOUT = 600
+
 #file where to store the extraction name log
 EXTRACTION_FILENAME_LOG = 'extraction_name_log.txt'
 EXTRACTION_BASE_NAME = 'extraction_'
@@ -62,9 +67,27 @@ BIBCODES_PRE = '/proj/ads/abstracts/pre/load/current/index.status'
 #The connection between published bibcodes and preprint
 ARXIV2PUB = '/proj/ads/abstracts/config/links/preprint/arxiv2pub.list'
 
+#how the ADS timestamps are compared with the Invenio ones: "merge-join" (the timestamp files and the Invenio records
+#are read sorted by bibcode and compared in a single pass, see pipeline_timestamp_diff) or "in-memory" (all the timestamps in dictionaries).
+#The merge join falls back to the in-memory comparison if one of the two sides is not sorted
+TIMESTAMP_DIFF = 'merge-join'
+#SQL expression of the ORDER BY of the Invenio bibcodes (aliased "bibcode"): it must sort them byte by byte as Python and the timestamp files
+INVENIO_BIBCODE_ORDER_BY = 'BINARY bibcode'
+#if True the timestamps are read from Invenio with an unbuffered (server side) cursor on a dedicated connection,
+#INVENIO_QUERY_CHUNK_SIZE rows at a time; otherwise with run_sql, that loads all the rows in memory
+INVENIO_STREAMED_QUERIES = True
+INVENIO_QUERY_CHUNK_SIZE = 10000
+
 #style sheet path
 STYLESHEET_PATH = BASEDIR + 'misc/AdsXML2MarcXML_v2.xsl'
 
+#default converter from the ADS XML to bibrecord: "xslt" (the stylesheet, reference implementation) or "native"
+ADS_XML_CONVERTER = 'xslt'
+
+#if True the memory allocated by libxml2 is tracked: the memory not freed after each group
+#and the documents never freed are reported in the logs (debug only: it slows down libxml2)
+LIBXML_MEMORY_DEBUG = False
+
 #base name for the file of bibcodes to delete
 BIBCODE_TO_DELETE_OUT_NAME = 'marcxml_to_delete.xml'
 #base name for the bibrecord files
@@ -75,6 +98,66 @@ BIBREC_EXTENSION = '.bib'
 #maximum number of bibcodes per group of extraction -> it means that this is also the maximum number of bibcodes per file of marcxml
 NUMBER_OF_BIBCODES_PER_GROUP = 5000
 
+#maximum number of merged records per bibrecord file: each file is passed to the upload as soon as it is written
+NUMBER_OF_RECORDS_PER_BIBFILE = 500
+#format of the bibrecord files: "indexed" (records pickled one at a time with the highest protocol and a final index of the bibcodes,
+#see pipeline_bibrecord_file) or "pickle" (the list of records pickled with pickle.dump).
+#The files submitted to bibupload are always pickled
+BIBREC_FILE_FORMAT = 'indexed'
+#if True the records of the indexed bibrecord files are compressed with zlib
+BIBREC_FILE_COMPRESSION = True
+
+#how the bibcodes are split in groups: "count" (groups with the same number of bibcodes)
+#or "cost" (groups with the same estimated extraction time, based on the times measured in the previous extractions)
+GROUP_PARTITIONING = 'cost'
+#file of each extraction directory where the extraction time of each bibcode is written (bibcode and seconds):
+#the times are also stored in the ledger of the extraction, where the next extractions read them
+BIBCODES_COST_FILE = 'bibcodes_cost.dat'
+#number of previous extractions from which the times of the bibcodes are read
+BIBCODES_COST_HISTORY = 3
+#maximum number of bibcodes in a group built by cost, as multiple of NUMBER_OF_BIBCODES_PER_GROUP
+MAX_GROUP_SIZE_FACTOR = 4
+
+#if True the size of the groups is adapted during the extraction between the two bounds:
+#it grows while the groups are faster than ADAPTIVE_GROUP_TARGET_SECONDS and shrinks when they are slower
+#or when the peak resident memory of a worker goes over ADAPTIVE_GROUP_RSS_FRACTION of WORKER_MAX_RSS_MB
+ADAPTIVE_GROUP_SIZE = False
+ADAPTIVE_GROUP_MIN_SIZE = 500
+ADAPTIVE_GROUP_MAX_SIZE = 20000
+ADAPTIVE_GROUP_TARGET_SECONDS = 600
+ADAPTIVE_GROUP_RSS_FRACTION = 0.75
+#seconds between two samples of the resident memory of a worker during a group (the peak of the samples is compared with the limit)
+ADAPTIVE_GROUP_RSS_SAMPLING_INTERVAL = 1.0
+#file in the logs of the extraction directory where the decisions about the size of the groups are written
+GROUP_SIZING_LOG = 'group_sizing.log'
+
+#how each worker processes a group: "serial" (retrieval from ADS, conversion, merging and writing one after the other)
+#or "staged" (the steps are stages connected by queues of at most STAGE_QUEUE_SIZE items that run at the same time)
+EXTRACTION_PIPELINE = 'serial'
+STAGE_QUEUE_SIZE = 16
+#number of bibcodes retrieved from ADS and converted together by the stages
+EXTRACT_BATCH_SIZE = 100
+#threads retrieving the bibcodes from ADS
+EXTRACT_STAGE_THREADS = 4
+#threads converting the ADS XML
+CONVERT_STAGE_THREADS = 1
+#processes merging the records (0 means that they are merged by a thread of the worker)
+MERGE_STAGE_PROCESSES = 0
+
+#threads of each worker that read ahead the records of ADS (0 means no prefetch)
+#and maximum number of bibcodes read ahead
+PREFETCH_THREADS = 0
+PREFETCH_READ_AHEAD = 64
+
+#if True the ADS XML export of each bibcode is kept in a cache on disk with the ADS timestamp of the bibcode:
+#the bibcodes extracted again with the same timestamp are read from the cache instead of ADS.
+#The least recently used entries are removed before and after each extraction when the cache is bigger than ADS_EXPORT_CACHE_MAX_MB
+ADS_EXPORT_CACHE = False
+ADS_EXPORT_CACHE_DIR = BASEDIR + 'ads_export_cache'
+ADS_EXPORT_CACHE_MAX_MB = 20480
+#file of each extraction directory with the hits, misses and bytes saved by the cache
+ADS_EXPORT_CACHE_STATS_FILE = 'ads_export_cache.stats'
+
 #maximum amount of bibcodes that can be skipped for each group
 MAX_SKIPPED_BIBCODES = NUMBER_OF_BIBCODES_PER_GROUP #/ 2
 
@@ -84,7 +167,13 @@ NUMBER_WORKERS = 16
 #number of upload workers
 NUMBER_UPLOAD_WORKER = 8
 
+#the extraction workers are kept alive across the groups and recycled (replaced by a new process)
+#as soon as one of these limits is reached (0 means no limit)
 #maximum number of groups of bibcodes that each worker can process before dying
-MAX_NUMBER_OF_GROUP_TO_PROCESS = 1
+MAX_NUMBER_OF_GROUP_TO_PROCESS = 20
+#maximum resident memory of a worker in MB
+WORKER_MAX_RSS_MB = 4096
+#maximum lifetime of a worker in seconds
+WORKER_MAX_LIFETIME = 6 * 3600
 
 
@@ -0,0 +1,220 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module that runs a chain of stages connected by bounded queues.
+Each stage has its own number of threads: a thread takes an item from the input queue
+and puts in the output queue all the items returned by the function of the stage.
+When the input queue is full the previous stage waits (backpressure).
+For each stage the time spent working, waiting for the input and waiting
+to put the output is measured, so that the bottleneck of the chain can be found.
+When the chain is stopped by an error, the items never processed are passed to the discard function
+of the chain (if any), so that their resources can be released.
+'''
+
+import sys
+import threading
+import Queue
+from time import time
+
+#timeout of the operations on the queues: it is the time needed to notice that the chain has been stopped by an error
+QUEUE_TIMEOUT = 0.1
+
+#item that marks the end of the items of a queue
+_END = ('END OF STAGE',)
+
+class StageAborted(Exception):
+    """Exception raised inside the threads of a stage when the chain has been stopped"""
+    pass
+
+class Stage(object):
+    """Class that defines a stage of the chain: function takes an item and returns an iterable of items,
+    finish (if defined) is called once at the end of the items and returns an iterable of the last items"""
+
+    def __init__(self, name, function, number_of_threads=1, finish=None):
+        """Constructor"""
+        self.name = name
+        self.function = function
+        self.number_of_threads = max(number_of_threads, 1)
+        self.finish = finish
+        self.stats = {'items_in': 0, 'items_out': 0, 'busy_time': 0.0, 'input_wait_time': 0.0, 'output_wait_time': 0.0}
+        self.lock = threading.Lock()
+        self.active_threads = self.number_of_threads
+
+    def add_stats(self, **values):
+        """Method that adds the values to the statistics of the stage"""
+        with self.lock:
+            for key, value in values.iteritems():
+                self.stats[key] += value
+
+class StagedPipeline(object):
+    """Class that runs a chain of stages connected by queues of at most queue_size items:
+    discard (if defined) is called with each item left in the chain when it is stopped by an error"""
+
+    def __init__(self, stages, queue_size, logger, discard=None):
+        """Constructor"""
+        self.stages = stages
+        self.queue_size = queue_size
+        self.logger = logger
+        self.discard = discard
+        self.stopped = threading.Event()
+        self.error = None
+        self.wall_time = 0.0
+
+    def _get(self, queue):
+        """Method that takes an item from a queue, unless the chain has been stopped"""
+        while True:
+            if self.stopped.is_set():
+                raise StageAborted()
+            try:
+                return queue.get(timeout=QUEUE_TIMEOUT)
+            except Queue.Empty:
+                pass
+
+    def _put(self, queue, item):
+        """Method that puts an item in a queue, waiting while it is full, unless the chain has been stopped"""
+        while True:
+            if self.stopped.is_set():
+                raise StageAborted()
+            try:
+                return queue.put(item, timeout=QUEUE_TIMEOUT)
+            except Queue.Full:
+                pass
+
+    def _discard(self, item):
+        """Method that releases an item that will never be processed"""
+        if self.discard is None or item is _END:
+            return
+        try:
+            self.discard(item)
+        except Exception, error:
+            self.logger.error(' Error discarding an item of the chain: %s' % error)
+
+    def _run_function(self, stage, function, args, output_queue):
+        """Method that runs a function of a stage and puts its outputs in the output queue (if there is one)"""
+        busy_time = 0.0
+        output_wait_time = 0.0
+        items_out = 0
+        start_time = time()
+        outputs = iter(function(*args) or ())
+        for output in outputs:
+            produced_time = time()
+            busy_time += produced_time - start_time
+            items_out += 1
+            if output_queue is not None:
+                try:
+                    self._put(output_queue, output)
+                except StageAborted:
+                    #the outputs not passed to the next stage are lost
+                    self._discard(output)
+                    for output in outputs:
+                        self._discard(output)
+                    raise
+            start_time = time()
+            output_wait_time += start_time - produced_time
+        busy_time += time() - start_time
+        stage.add_stats(items_out=items_out, busy_time=busy_time, output_wait_time=output_wait_time)
+
+    def _run_stage_thread(self, stage, input_queue, output_queue):
+        """Method executed by each thread of a stage"""
+        try:
+            while True:
+                start_time = time()
+                item = self._get(input_queue)
+                stage.add_stats(input_wait_time=time() - start_time)
+                if item is _END:
+                    #I put back the end for the other threads of the stage
+                    self._put(input_queue, _END)
+                    break
+                stage.add_stats(items_in=1)
+                self._run_function(stage, stage.function, (item,), output_queue)
+            #the last thread of the stage runs the final function and tells the next stage that the items are finished
+            with stage.lock:
+                stage.active_threads -= 1
+                last_thread = stage.active_threads == 0
+            if last_thread:
+                if stage.finish is not None:
+                    self._run_function(stage, stage.finish, (), output_queue)
+                if output_queue is not None:
+                    self._put(output_queue, _END)
+        except StageAborted:
+            pass
+        except Exception, error:
+            #the first error stops all the chain and it is raised again by run
+            if self.error is None:
+                self.error = sys.exc_info()
+                self.logger.error(' Error in the stage "%s": %s' % (stage.name, error))
+            self.stopped.set()
+
+    def run(self, items):
+        """Method that passes all the items to the first stage and waits for the end of the chain"""
+        start_time = time()
+        queues = [Queue.Queue(self.queue_size) for stage in self.stages]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            if i + 1 < len(self.stages):
+                output_queue = queues[i + 1]
+            else:
+                output_queue = None
+            for j in range(stage.number_of_threads):
+                thread = threading.Thread(target=self._run_stage_thread, args=(stage, queues[i], output_queue), 
+                                          name='%s-%d' % (stage.name, j))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        try:
+            for item in items:
+                self._put(queues[0], item)
+            self._put(queues[0], _END)
+        except StageAborted:
+            pass
+        for thread in threads:
+            thread.join()
+        #if the chain has been stopped, the items still in the queues will never be processed
+        if self.stopped.is_set():
+            for queue in queues:
+                while True:
+                    try:
+                        self._discard(queue.get_nowait())
+                    except Queue.Empty:
+                        break
+        self.wall_time = time() - start_time
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def get_stats(self):
+        """Method that returns for each stage the statistics and the utilisation of its threads"""
+        all_stats = []
+        for stage in self.stages:
+            stats = dict(stage.stats)
+            stats['name'] = stage.name
+            stats['threads'] = stage.number_of_threads
+            if self.wall_time > 0:
+                stats['utilisation'] = stats['busy_time'] / (stage.number_of_threads * self.wall_time)
+            else:
+                stats['utilisation'] = 0.0
+            all_stats.append(stats)
+        return all_stats
+
+    def log_stats(self, logger, title):
+        """Method that logs the statistics of the stages and the most used one (the bottleneck)"""
+        all_stats = self.get_stats()
+        for stats in all_stats:
+            logger.warning('%s: stage %s (%d threads): %d items in, %d items out, busy %.1f s, waiting input %.1f s, waiting output %.1f s, utilisation %.0f%%' % 
+                           (title, stats['name'], stats['threads'], stats['items_in'], stats['items_out'], stats['busy_time'], 
+                            stats['input_wait_time'], stats['output_wait_time'], stats['utilisation'] * 100))
+        if all_stats:
+            bottleneck = max(all_stats, key=lambda stats: stats['utilisation'])
+            logger.warning('%s: wall time %.1f s, bottleneck stage %s' % (title, self.wall_time, bottleneck['name']))
@@ -0,0 +1,161 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Module that compares the ADS timestamps with the Invenio ones with a merge join:
+both sides are streams of (bibcode, timestamp) sorted by bibcode (the ADS timestamp files
+and a query on Invenio with an ORDER BY) and they are read once, one bibcode at a time,
+so that the memory used does not depend on the number of records.
+Each stream checks that its bibcodes are in increasing order and raises UnsortedTimestampsError otherwise.
+The bibcodes longer than BIBCODE_LENGTH are not valid: they are logged and skipped.
+'''
+
+import heapq
+
+import pipeline_settings as settings
+from merger.merger_errors import UnsortedTimestampsError
+from misclibs.bibcode_array import BIBCODE_LENGTH
+
+#I get the global logger
+import logging
+logger = logging.getLogger(settings.LOGGING_GLOBAL_NAME)
+
+#status of the bibcodes
+ADDED = 'added'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+
+#the timestamps of the records not deleted (without DELETED in 980__c), with the bibcode (NULL if the record has none):
+#the join and the exclusion of the deleted records are done by the database
+TIMESTAMPS_QUERY = "SELECT bb9.id_bibrec, b7.value AS bibcode, b9.value FROM bibrec_bib99x AS bb9 " \
+                   "JOIN bib99x AS b9 ON (bb9.id_bibxxx=b9.id AND b9.tag='995__a') " \
+                   "LEFT JOIN (bibrec_bib97x AS bb7 JOIN bib97x AS b7 ON (bb7.id_bibxxx=b7.id AND b7.tag='970__a')) " \
+                   "ON (bb7.id_bibrec=bb9.id_bibrec) " \
+                   "WHERE NOT EXISTS (SELECT 1 FROM bibrec_bib98x AS bb8 JOIN bib98x AS b8 ON (bb8.id_bibxxx=b8.id) " \
+                   "WHERE bb8.id_bibrec=bb9.id_bibrec AND b8.tag='980__c' AND b8.value='DELETED')"
+
+def check_sorted(timestamps, name):
+    """generator of (bibcode, timestamp) that checks that the bibcodes are in increasing order:
+    of the consecutive timestamps of the same bibcode only the last one is kept"""
+    previous = None
+    for bibcode, timestamp in timestamps:
+        if previous is not None:
+            if bibcode < previous[0]:
+                raise UnsortedTimestampsError('The timestamps of %s are not sorted by bibcode: "%s" after "%s"' % (name, bibcode, previous[0]))
+            if bibcode != previous[0]:
+                yield previous
+        previous = (bibcode, timestamp)
+    if previous is not None:
+        yield previous
+
+def read_timestamp_file(filename):
+    """generator of the (bibcode, timestamp) of a timestamp file"""
+    fdesc = open(filename)
+    try:
+        for line in fdesc:
+            bibcode, timestamp = line[:-1].split('\t', 1)
+            if len(bibcode) > BIBCODE_LENGTH:
+                logger.error('ERROR: Bibcode "%s" of "%s" longer than %d characters: skipped.' % (bibcode, filename, BIBCODE_LENGTH))
+            else:
+                yield bibcode, timestamp
+    finally:
+        fdesc.close()
+
+def _with_priority(timestamps, priority):
+    """generator of the (bibcode, priority, timestamp) of a stream of (bibcode, timestamp)"""
+    for bibcode, timestamp in timestamps:
+        yield bibcode, priority, timestamp
+
+def merge_timestamp_files(filenames, excluded_bibcodes=()):
+    """generator of the (bibcode, timestamp) of the timestamp files sorted by bibcode:
+    the files are ordered by increasing importance, and the timestamp of a bibcode is the one of the most important file.
+    The excluded bibcodes (a BibcodeArray or a set) are skipped"""
+    streams = []
+    for priority, filename in enumerate(filenames):
+        logger.info("Reading \"%s\"" % filename)
+        streams.append(_with_priority(check_sorted(read_timestamp_file(filename), filename), priority))
+    #the files give at most one timestamp for each bibcode, so the last one of each bibcode is the most important
+    return check_sorted(((bibcode, timestamp) for bibcode, priority, timestamp in heapq.merge(*streams)
+                         if bibcode not in excluded_bibcodes), 'ADS')
+
+def select_bibcodes(timestamps, bibcodes):
+    """generator of the (bibcode, timestamp) of a stream sorted by bibcode whose bibcode is in bibcodes,
+    an iterable of bibcodes sorted in the same way (a BibcodeArray): the two are read once as in diff_timestamps"""
+    bibcodes_iter = iter(bibcodes)
+    wanted = next(bibcodes_iter, None)
+    for bibcode, timestamp in timestamps:
+        while wanted is not None and wanted < bibcode:
+            wanted = next(bibcodes_iter, None)
+        if wanted is None:
+            break
+        if wanted == bibcode:
+            yield bibcode, timestamp
+
+def fetch_in_chunks(cursor, query, chunk_size=settings.INVENIO_QUERY_CHUNK_SIZE):
+    """generator of the rows of a query fetched chunk_size rows at a time from a cursor
+    (with an unbuffered cursor only a chunk of rows is in memory at the same time)"""
+    cursor.execute(query)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+def iter_invenio_timestamps(run_query, order_by=None):
+    """generator of the (bibcode, timestamp) of the records in Invenio not deleted, in the order of the ORDER BY expression if any.
+    run_query is the function that runs a query and returns or yields its rows"""
+    logger.info("Running the query of the timestamps")
+    query = TIMESTAMPS_QUERY
+    if order_by:
+        query += ' ORDER BY %s' % order_by
+    for recid, bibcode, timestamp in run_query(query):
+        if bibcode is None:
+            logger.error('ERROR: Record %d has no bibcode.' % recid)
+        elif len(bibcode) > BIBCODE_LENGTH:
+            logger.error('ERROR: Record %d has the bibcode "%s" longer than %d characters: skipped.' % (recid, bibcode, BIBCODE_LENGTH))
+        else:
+            yield bibcode, timestamp
+
+def read_invenio_timestamps(run_query, order_by=settings.INVENIO_BIBCODE_ORDER_BY):
+    """generator of the (bibcode, timestamp) of the records in Invenio not deleted, sorted by bibcode"""
+    return check_sorted(iter_invenio_timestamps(run_query, order_by), 'Invenio')
+
+def diff_timestamps(ads_timestamps, invenio_timestamps):
+    """generator of the (status, bibcode) of the bibcodes added, modified or deleted in ADS,
+    in the order of the bibcodes. Both arguments are iterables of (bibcode, timestamp) sorted by bibcode
+    without duplicates (see check_sorted)"""
+    ads_iter = iter(ads_timestamps)
+    invenio_iter = iter(invenio_timestamps)
+    ads_item = next(ads_iter, None)
+    invenio_item = next(invenio_iter, None)
+    while ads_item is not None and invenio_item is not None:
+        if ads_item[0] < invenio_item[0]:
+            yield ADDED, ads_item[0]
+            ads_item = next(ads_iter, None)
+        elif ads_item[0] > invenio_item[0]:
+            yield DELETED, invenio_item[0]
+            invenio_item = next(invenio_iter, None)
+        else:
+            if ads_item[1] != invenio_item[1]:
+                yield MODIFIED, ads_item[0]
+            ads_item = next(ads_iter, None)
+            invenio_item = next(invenio_iter, None)
+    while ads_item is not None:
+        yield ADDED, ads_item[0]
+        ads_item = next(ads_iter, None)
+    while invenio_item is not None:
+        yield DELETED, invenio_item[0]
+        invenio_item = next(invenio_iter, None)
@@ -26,9 +26,17 @@ bibcodes:
 import inspect
 import ads
 
+import MySQLdb
+import MySQLdb.cursors
+
 from invenio.dbquery import run_sql
+from invenio.config import CFG_DATABASE_HOST, CFG_DATABASE_PORT, CFG_DATABASE_NAME, CFG_DATABASE_USER, CFG_DATABASE_PASS
 
-from pipeline_settings import BIBCODES_AST, BIBCODES_PHY, BIBCODES_GEN, BIBCODES_PRE, LOGGING_GLOBAL_NAME
+from misclibs.bibcode_array import BibcodeArray, BibcodeArrayBuilder, BIBCODE_LENGTH
+from merger.merger_errors import UnsortedTimestampsError
+import pipeline_timestamp_diff
+from pipeline_settings import BIBCODES_AST, BIBCODES_PHY, BIBCODES_GEN, BIBCODES_PRE, LOGGING_GLOBAL_NAME, TIMESTAMP_DIFF, \
+    INVENIO_STREAMED_QUERIES, INVENIO_QUERY_CHUNK_SIZE
 #I get the global logger
 import logging
 logger = logging.getLogger(LOGGING_GLOBAL_NAME)
@@ -50,6 +58,43 @@ def get_records_status():
     * bibcodes deleted are bibcodes that are in Invenio but not in ADS.
     """
     logger.info("In function %s" % (inspect.stack()[0][3],))
+    if TIMESTAMP_DIFF == 'merge-join':
+        try:
+            return _get_records_status_merge_join()
+        except UnsortedTimestampsError, error:
+            logger.warning('%s: comparing the timestamps in memory.' % error.field_desc)
+    return _get_records_status_in_memory()
+
+def _get_records_status_merge_join():
+    """
+    Same as get_records_status, reading the ADS and Invenio timestamps sorted by bibcode
+    in a single pass: the bibcodes are returned in BibcodeArrays.
+    """
+    logger.info("In function %s" % (inspect.stack()[0][3],))
+    logger.info('Getting the published eprints.')
+    published_eprints = _get_published_eprints()
+    ads_timestamps = pipeline_timestamp_diff.merge_timestamp_files(TIMESTAMP_FILES_HIERARCHY, published_eprints)
+    invenio_timestamps = pipeline_timestamp_diff.read_invenio_timestamps(_get_query_runner())
+
+    logger.info('Comparing the ADS and Invenio timestamps.')
+    records = {pipeline_timestamp_diff.ADDED: BibcodeArrayBuilder(),
+               pipeline_timestamp_diff.MODIFIED: BibcodeArrayBuilder(),
+               pipeline_timestamp_diff.DELETED: BibcodeArrayBuilder()}
+    for status, bibcode in pipeline_timestamp_diff.diff_timestamps(ads_timestamps, invenio_timestamps):
+        records[status].append(bibcode)
+    logger.info('    %d records to add.' % len(records[pipeline_timestamp_diff.ADDED]))
+    logger.info('    %d records to delete.' % len(records[pipeline_timestamp_diff.DELETED]))
+    logger.info('    %d records to modify.' % len(records[pipeline_timestamp_diff.MODIFIED]))
+    logger.info('Done with timestamps.')
+
+    return records[pipeline_timestamp_diff.ADDED].build(), records[pipeline_timestamp_diff.MODIFIED].build(), \
+        records[pipeline_timestamp_diff.DELETED].build()
+
+def _get_records_status_in_memory():
+    """
+    Same as get_records_status, with all the timestamps in dictionaries.
+    """
+    logger.info("In function %s" % (inspect.stack()[0][3],))
     records_added = []
     records_modified = []
     records_deleted = []
@@ -57,20 +102,20 @@ def get_records_status():
     logger.info('Getting ADS timestamps.')
     ads_timestamps = _get_ads_timestamps()
     logger.info('Getting ADS bibcodes.')
-    ads_bibcodes = set(ads_timestamps.keys())
+    ads_bibcodes = BibcodeArray(ads_timestamps.iterkeys())
     logger.info('Getting Invenio timestamps.')
     invenio_timestamps = _get_invenio_timestamps()
     logger.info('Getting Invenio bibcodes.')
-    invenio_bibcodes = set(invenio_timestamps.keys())
+    invenio_bibcodes = BibcodeArray(invenio_timestamps.iterkeys())
 
     logger.info('Deducting the added records.')
-    records_added = ads_bibcodes - invenio_bibcodes
+    records_added = ads_bibcodes.difference(invenio_bibcodes)
     logger.info('    %d records to add.' % len(records_added))
     logger.info('Deducting the deleted records.')
-    records_deleted = invenio_bibcodes - ads_bibcodes
+    records_deleted = invenio_bibcodes.difference(ads_bibcodes)
     logger.info('    %d records to delete.' % len(records_deleted))
 
-    records_to_check = invenio_bibcodes - records_deleted
+    records_to_check = invenio_bibcodes.intersection(ads_bibcodes)
     logger.info('Checking timestamps for %d records.' % len(records_to_check))
 
     for bibcode in records_to_check:
@@ -87,35 +132,59 @@ def get_records_status():
 
     return records_added, records_modified, records_deleted
 
+def iter_ads_timestamps(bibcodes):
+    """
+    Yields the (bibcode, ADS timestamp) of the given bibcodes, read from the
+    timestamp files one line at a time (the bibcodes without timestamp are skipped):
+    if a bibcode is yielded more than once, its last timestamp is the right one.
+    """
+    logger.info("In function %s" % (inspect.stack()[0][3],))
+    bibcodes = BibcodeArray(bibcodes)
+    published_eprints = _get_published_eprints()
+    try:
+        ads_timestamps = pipeline_timestamp_diff.merge_timestamp_files(TIMESTAMP_FILES_HIERARCHY, published_eprints)
+        for bibcode, timestamp in pipeline_timestamp_diff.select_bibcodes(ads_timestamps, bibcodes):
+            yield bibcode, timestamp
+    except UnsortedTimestampsError, error:
+        # The files are read again one after the other, in increasing order
+        # of importance.
+        logger.warning('%s: reading the timestamp files one after the other.' % error.field_desc)
+        for filename in TIMESTAMP_FILES_HIERARCHY:
+            logger.info("Reading \"%s\"" % filename)
+            for bibcode, timestamp in pipeline_timestamp_diff.read_timestamp_file(filename):
+                if bibcode in bibcodes and bibcode not in published_eprints:
+                    yield bibcode, timestamp
+
 def _get_invenio_timestamps():
     """
-    Returns a set of timestamps found in Invenio.
+    Returns a dictionary with the bibcodes of the records in Invenio (not deleted) as keys
+    and their timestamps as values.
     """
     logger.info("In function %s" % (inspect.stack()[0][3],))
-    # First get the list of deleted records, i.e. records which have DELETED in 980__c.
-    query = "SELECT bb.id_bibrec FROM bib98x AS b, bibrec_bib98x AS bb " \
-            "WHERE b.tag='980__c' AND b.value='DELETED' AND b.id=bb.id_bibxxx"
-    logger.info("Running query 1")
-    deleted_recids = set(line[0] for line in run_sql(query))
-
-    # Get the correspondence between recid and bibcode.
-    query = "SELECT bb.id_bibrec, b.value FROM bibrec_bib97x AS bb JOIN bib97x AS b ON (bb.id_bibxxx=b.id AND b.tag='970__a')"
-    logger.info("Running query 2")
-    recid_bibcode = dict(run_sql(query))
-
-    # Now get the timestamps.
-    query = "SELECT bb.id_bibrec, b.value FROM bibrec_bib99x AS bb JOIN bib99x AS b ON (bb.id_bibxxx=b.id AND b.tag='995__a')"
-    logger.info("Running query 3")
-    timestamps = {}
-    for recid, timestamp in run_sql(query):
-        if recid not in deleted_recids:
-            bibcode = recid_bibcode.get(recid)
-            if bibcode is None:
-                logger.error( 'ERROR: Record %d has no bibcode.' % recid)
-            else:
-                timestamps[bibcode] = timestamp
+    return dict(pipeline_timestamp_diff.iter_invenio_timestamps(_get_query_runner()))
 
-    return timestamps
+def _get_query_runner():
+    """
+    Returns the function used to run the queries of the timestamps.
+    """
+    if INVENIO_STREAMED_QUERIES:
+        return _run_sql_streamed
+    return run_sql
+
+def _run_sql_streamed(query):
+    """
+    Runs a query with an unbuffered cursor on a dedicated connection and yields its rows:
+    the rows are fetched INVENIO_QUERY_CHUNK_SIZE at a time instead of being all loaded in memory.
+    """
+    connection = MySQLdb.connect(host=CFG_DATABASE_HOST, port=int(CFG_DATABASE_PORT), db=CFG_DATABASE_NAME,
+                                 user=CFG_DATABASE_USER, passwd=CFG_DATABASE_PASS, use_unicode=False, charset='utf8')
+    try:
+        cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+        for row in pipeline_timestamp_diff.fetch_in_chunks(cursor, query, INVENIO_QUERY_CHUNK_SIZE):
+            yield row
+        cursor.close()
+    finally:
+        connection.close()
 
 def _get_ads_timestamps():
     """
@@ -133,9 +202,7 @@ def _get_ads_timestamps():
 
     # Now let's remove the timestamps of published eprints as they don't appear
     # as such in Invenio.
-    published_eprints = [line.strip().split('\t', 1)[1]
-                         for line in open(ads.pub2arx)]
-    for bibcode in published_eprints:
+    for bibcode in _get_published_eprints():
         try:
             del timestamps[bibcode]
         except:
@@ -143,17 +210,30 @@ def _get_ads_timestamps():
 
     return timestamps
 
+def _get_published_eprints():
+    """
+    Returns the BibcodeArray of the bibcodes of the published eprints.
+    """
+    return BibcodeArray(_iter_published_eprints())
+
+def _iter_published_eprints():
+    """
+    Yields the bibcodes of the published eprints, skipping the ones longer
+    than BIBCODE_LENGTH.
+    """
+    fdesc = open(ads.pub2arx)
+    for line in fdesc:
+        bibcode = line.strip().split('\t', 1)[1]
+        if len(bibcode) > BIBCODE_LENGTH:
+            logger.error('ERROR: Published eprint "%s" longer than %d characters: skipped.' % (bibcode, BIBCODE_LENGTH))
+        else:
+            yield bibcode
+    fdesc.close()
+
 def _read_timestamp_file(filename):
     """
     Reads a timestamp file and returns a dictionary with the bibcodes as keys
     and the timestamps as values.
     """
     logger.info("In function %s" % (inspect.stack()[0][3],))
-    fdesc = open(filename)
-    timestamps = {}
-    for line in fdesc:
-        bibcode, timestamp = line[:-1].split('\t', 1)
-        timestamps[bibcode] = timestamp
-    fdesc.close()
-
-    return timestamps
+    return dict(pipeline_timestamp_diff.read_timestamp_file(filename))
@@ -25,6 +25,7 @@ import inspect
 import pipeline_settings as settings
 from pipeline_log_functions import msg as printmsg
 from merger.merger_errors import GenericError
+import pipeline_extraction_ledger
 
 class WriteFile(object):
     """Class that writes the output files of the pipeline"""
@@ -50,6 +51,12 @@ class WriteFile(object):
             err_msg = 'Impossible to write in the "bibcode done file" %s \n' % filepath
             self.logger.critical(err_msg)
             raise GenericError(err_msg)
+        #and I update the ledger of the extraction
+        ledger = self.get_ledger()
+        try:
+            ledger.set_bibcodes_state(bibcodes_list, pipeline_extraction_ledger.DONE)
+        finally:
+            ledger.close()
         return True
 
     def write_problem_bibcodes_to_file(self, bibcodes_list):
@@ -78,5 +85,56 @@ class WriteFile(object):
                     self.logger.critical(err_msg)
                     raise GenericError()
         file_obj.close()
+        #and I update the ledger of the extraction
+        ledger = self.get_ledger()
+        try:
+            ledger.set_problem_bibcodes(bibcodes_list)
+        finally:
+            ledger.close()
         return True
 
+    def get_ledger(self):
+        """Method that returns the ledger of the extraction (to be closed by the caller)"""
+        return pipeline_extraction_ledger.ExtractionLedger(os.path.join(settings.BASE_OUTPUT_PATH, self.dirname))
+
+
+    def write_bibcodes_cost_to_file(self, bibcodes_cost):
+        """Method that writes a list of tuples (bibcode, seconds) in the file of the costs of the bibcodes
+        and in the ledger of the extraction, from where the next extractions read them"""
+        self.logger.info("In function %s.%s" % (self.__class__.__name__, inspect.stack()[0][3]))
+
+        filepath = os.path.join(settings.BASE_OUTPUT_PATH, self.dirname, settings.BIBCODES_COST_FILE)
+
+        try:
+            file_obj = open(filepath, 'a')
+            for bibcode, cost in bibcodes_cost:
+                file_obj.write('%s\t%.6f\n' % (bibcode, cost))
+            file_obj.close()
+        except:
+            err_msg = 'Impossible to write in the "bibcode cost file" %s \n' % filepath
+            self.logger.critical(err_msg)
+            raise GenericError(err_msg)
+        #and I update the ledger of the extraction
+        ledger = self.get_ledger()
+        try:
+            ledger.add_bibcodes_cost(bibcodes_cost)
+        finally:
+            ledger.close()
+        return True
+
+    def write_ads_export_cache_stats_to_file(self, stats_lines):
+        """Method that writes the counters of the cache of the ADS exports (replacing the previous ones)"""
+        self.logger.info("In function %s.%s" % (self.__class__.__name__, inspect.stack()[0][3]))
+
+        filepath = os.path.join(settings.BASE_OUTPUT_PATH, self.dirname, settings.ADS_EXPORT_CACHE_STATS_FILE)
+
+        try:
+            file_obj = open(filepath, 'w')
+            for line in stats_lines:
+                file_obj.write(line + '\n')
+            file_obj.close()
+        except:
+            err_msg = 'Impossible to write in the "ADS export cache stats file" %s \n' % filepath
+            self.logger.critical(err_msg)
+            raise GenericError(err_msg)
+        return True
@@ -19,7 +19,6 @@
 File containing an example of the steps that should be taken (and better coded) before using the merger
 '''
 
-import libxslt
 import libxml2
 import logging
 
@@ -32,7 +31,9 @@ from ads.ADSExports import ADSRecords
 from invenio.bibformat import record_get_xml
 from invenio.dbquery import run_sql
 
-from merger.merger import merge_records_xml
+from merger.merger import merge_records_xml, merge_records
+from misclibs.xml_transformer import get_stylesheet, iter_records_from_marcxml_file, LibxmlDocument
+from misclibs.ads_xml_converter import iter_records_from_ads_xml
 import pipeline_settings
 from pipeline_invenio_uploader import bibupload_merger
 
@@ -43,33 +44,41 @@ logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME) #I use this na
 logger.setLevel(logging.INFO)
 logger.warning('Test for merger')
 
-def merge_bibcodes(bibcodes, print_adsxml=False, print_marcxml=False, write_xml_to_disk=False):
+def merge_bibcodes(bibcodes, print_adsxml=False, print_marcxml=False, write_xml_to_disk=False, converter=pipeline_settings.ADS_XML_CONVERTER):
     """
     Returns a merged version of the record identified by bibcode.
+    The converter from ADS XML to bibrecord can be "xslt" or "native".
     """
     # Extract the record from ADS.
     records = ADSRecords('full', 'XML')
     for bibcode in bibcodes:
         records.addCompleteRecord(bibcode)
-    ads_xml_obj = records.export()
+    #the documents are freed as soon as the records are merged
+    with LibxmlDocument(records.export(), logger) as ads_xml_obj:
+        del records
+        
+        if print_adsxml:
+            print ads_xml_obj.serialize('UTF-8')
+        if write_xml_to_disk:
+            with open('/tmp/adsxml.xml', 'w') as f:
+                f.write(ads_xml_obj.serialize('UTF-8'))
+        
+        if converter == 'native':
+            merged_records, bibcodes_with_problems = merge_records(iter_records_from_ads_xml(ads_xml_obj, logger))
+            return merged_records
+        
+        # Convert to MarcXML (the stylesheet is compiled only at the first call).
+        stylesheet = get_stylesheet(XSLT, logger)
+        marcxml_doc = LibxmlDocument(stylesheet.applyStylesheet(ads_xml_obj, None), logger)
     
-    if print_adsxml:
-        print ads_xml_obj.serialize('UTF-8')
-    if write_xml_to_disk:
-        with open('/tmp/adsxml.xml', 'w') as f:
-            f.write(ads_xml_obj.serialize('UTF-8'))
-    
-    # Convert to MarcXML.
-    stylesheet = libxslt.parseStylesheetDoc(libxml2.parseFile(XSLT))
-    xml_object = stylesheet.applyStylesheet(ads_xml_obj, None)
-    
-    if print_marcxml:
-        print xml_object.serialize('UTF-8')
-    if write_xml_to_disk:
-        with open('/tmp/marcxml.xml', 'w') as f:
-            f.write(xml_object.serialize('UTF-8'))
-    
-    merged_records, bibcodes_with_problems = merge_records_xml(xml_object)
+    with marcxml_doc as xml_object:
+        if print_marcxml:
+            print xml_object.serialize('UTF-8')
+        if write_xml_to_disk:
+            with open('/tmp/marcxml.xml', 'w') as f:
+                f.write(xml_object.serialize('UTF-8'))
+        
+        merged_records, bibcodes_with_problems = merge_records_xml(xml_object, free_subtrees=True)
     return merged_records
 
 def merge_bibcodes_and_upload(bibcodes):
@@ -99,7 +108,8 @@ def static_file_merging():
     #static_file = "misc/1999PASP..111..438F.xml"
     #static_file = "misc/1984A&A...130...97L.xml"
     logger.warn(static_file)
-    return merge_records_xml(libxml2.parseDoc(open(static_file, "r").read()))
+    #the file is read in streaming, one record at a time
+    return merge_records(iter_records_from_marcxml_file(static_file, logger))
 
 
 if __name__ == '__main__':
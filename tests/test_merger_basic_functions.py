@@ -5,6 +5,7 @@ sys.path.append('../')
 import unittest
 
 import merger.basic_functions as b
+from merger.merger_errors import OriginValueNotFound
 
 class TestBasicFunctions(unittest.TestCase):
 
@@ -34,5 +35,19 @@ class TestBasicFunctions(unittest.TestCase):
     def test_get_origin_value(self):
         pass
 
+    def test_get_origin_importance(self):
+        b.clear_origin_importance_cache()
+        self.assertEqual(b.get_origin_importance('245', 'ARXIV'), 0.2)
+        self.assertEqual(b.get_origin_importance('245', ' arxiv; PUBLISHER'), 0.49)
+        self.assertRaises(OriginValueNotFound, b.get_origin_importance, '245', 'ARXIV; NOT AN ORIGIN')
+
+    def test_get_origin_importance_cache(self):
+        b.clear_origin_importance_cache()
+        b.get_origin_importance('100', 'ARXIV')
+        b.get_origin_importance('100', 'ARXIV')
+        b.get_origin_importance('700', 'ARXIV')
+        info = b.get_origin_importance_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 2, 2))
+
 if __name__ == '__main__':
     unittest.main()
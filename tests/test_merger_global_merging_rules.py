@@ -0,0 +1,49 @@
+# -*- encoding: utf-8 -*-
+
+import sys
+sys.path.append('../')
+import unittest
+from copy import deepcopy
+
+import merger.global_merging_rules as g
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+def get_record():
+    return {'970': [([('a', '2012ApJ...1..1A'), ('7', 'ADS metadata')], ' ', ' ', '', 1)],
+            '245': [([('a', 'A title'), ('7', 'ADS metadata'), ('99', 'True')], ' ', ' ', '', 2)],
+            '980': [([('a', 'ASTRONOMY'), ('7', 'ADS metadata')], ' ', ' ', '', 3)],
+            '961': [([('c', '2012-03-01'), ('x', '2012-02-01'), ('7', 'ADS metadata'), ('97', '2012-02-01'), ('98', '2012-03-01')], ' ', ' ', '', 4),
+                    ([('c', '2011-03-01'), ('x', '2011-02-01'), ('7', 'AAS')], ' ', ' ', '', 5)]}
+
+class TestGlobalMergingRules(unittest.TestCase):
+    def assert_record_unchanged(self, record, original_record, field_lists):
+        #the dictionary, the lists of fields and the subfields of the input record are the same
+        self.assertEqual(record, original_record)
+        for tag, fields in field_lists.items():
+            self.assertTrue(record[tag] is fields)
+    def test_merge_creation_modification_dates(self):
+        record = get_record()
+        original_record = deepcopy(record)
+        field_lists = dict(record)
+        merged_record = g.merge_creation_modification_dates(record)
+        self.assertEqual(merged_record['961'], [([('c', '2012-03-01'), ('x', '2012-02-01'), ('7', 'ADS metadata')], ' ', ' ', '', 4)])
+        self.assert_record_unchanged(record, original_record, field_lists)
+        #the fields not changed are shared
+        self.assertTrue(merged_record['245'] is record['245'])
+    def test_merge_remove_temp_subfields(self):
+        record = get_record()
+        original_record = deepcopy(record)
+        field_lists = dict(record)
+        merged_record = g.merge_remove_temp_subfields(record)
+        self.assertEqual(merged_record['245'], [([('a', 'A title'), ('7', 'ADS metadata')], ' ', ' ', '', 2)])
+        self.assertEqual(merged_record['961'][0], ([('c', '2012-03-01'), ('x', '2012-02-01'), ('7', 'ADS metadata')], ' ', ' ', '', 4))
+        self.assert_record_unchanged(record, original_record, field_lists)
+        self.assertTrue(merged_record['970'] is record['970'])
+
+if __name__ == '__main__':
+    unittest.main()
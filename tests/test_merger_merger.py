@@ -0,0 +1,67 @@
+# -*- encoding: utf-8 -*-
+
+import sys
+sys.path.append('../')
+import unittest
+from copy import deepcopy
+
+import merger.merger as m
+import pipeline_settings
+from merger.merger_errors import MergingError
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.CRITICAL)
+
+def get_record(bibcode, collection=True):
+    record = {'970': [([('a', bibcode), ('7', 'ADS metadata')], ' ', ' ', '', 1)],
+              '245': [([('a', 'A title'), ('7', 'ADS metadata')], ' ', ' ', '', 2)]}
+    if collection:
+        record['980'] = [([('a', 'ASTRONOMY'), ('7', 'ADS metadata')], ' ', ' ', '', 3)]
+    return record
+
+class TestMerger(unittest.TestCase):
+    def test_merge_records_iter(self):
+        #the second record has no collection so it cannot be merged
+        all_records = iter([[get_record('2012ApJ...1..1A')], [get_record('2012ApJ...2..2A', False)], [get_record('2012ApJ...3..3A')]])
+        results = list(m.merge_records_iter(all_records))
+        self.assertEqual([bibcode for bibcode, _ in results], ['2012ApJ...1..1A', '2012ApJ...2..2A', '2012ApJ...3..3A'])
+        self.assertEqual(results[0][1]['970'][0][0][0], ('a', '2012ApJ...1..1A'))
+        self.assertTrue(isinstance(results[1][1], MergingError))
+        self.assertEqual(results[2][1]['970'][0][0][0], ('a', '2012ApJ...3..3A'))
+    def test_merge_records(self):
+        all_records = iter([[get_record('2012ApJ...1..1A')], [get_record('2012ApJ...2..2A', False)]])
+        merged_records, records_with_merging_probl = m.merge_records(all_records)
+        self.assertEqual(len(merged_records), 1)
+        self.assertEqual([bibcode for bibcode, _ in records_with_merging_probl], ['2012ApJ...2..2A'])
+    def test_merge_single_version(self):
+        #a record with only one version, with the fields not in the order of the tags
+        record = get_record('2012ApJ...1..1A')
+        record['245'] = [([('a', 'A title'), ('7', 'ADS metadata'), ('99', 'True')], ' ', ' ', '', 5)]
+        record['260'] = [([('c', '2012-01-00'), ('t', 'date-published'), ('7', 'ADS metadata'), ('99', 'True')], ' ', ' ', '', 4)]
+        record['961'] = [([('c', '2012-03-01'), ('x', '2012-02-01'), ('7', 'ADS metadata'), ('97', '2012-02-01'), ('98', '2012-03-01')], ' ', ' ', '', 6),
+                         ([('c', '2011-03-01'), ('x', '2011-02-01'), ('7', 'AAS'), ('97', '2011-02-01'), ('98', '2011-03-01')], ' ', ' ', '', 7)]
+        merged_record = m.merge_multiple_records([record])
+        #the main publication date is created
+        self.assertEqual(merged_record['260'], [([('c', '2012-01-00'), ('t', 'date-published'), ('7', 'ADS metadata')], ' ', ' ', '', 2),
+                                                ([('c', '2012-01-00'), ('t', 'main-date'), ('7', 'ADS metadata')], ' ', ' ', '', 3)])
+        #the creation and modification dates are merged with only the origins of the other fields
+        self.assertEqual(merged_record['961'], [([('c', '2012-03-01'), ('x', '2012-02-01'), ('7', 'ADS metadata')], ' ', ' ', '', 4)])
+        #the temporary subfields are removed and the positions follow the tags
+        self.assertEqual(merged_record['245'], [([('a', 'A title'), ('7', 'ADS metadata')], ' ', ' ', '', 1)])
+        self.assertEqual(merged_record['970'], [([('a', '2012ApJ...1..1A'), ('7', 'ADS metadata')], ' ', ' ', '', 5)])
+        self.assertEqual(merged_record['980'], [([('a', 'ASTRONOMY'), ('7', 'ADS metadata')], ' ', ' ', '', 6)])
+        self.assertEqual(sorted(merged_record.keys()), ['245', '260', '961', '970', '980'])
+    def test_record_reorder(self):
+        #the lists of fields can be shared with the original records: they are replaced and not modified
+        original_record = get_record('2012ApJ...1..1A')
+        record = dict(original_record)
+        copied_record = deepcopy(original_record)
+        m.record_reorder(record)
+        self.assertEqual([field[4] for tag in ('245', '970', '980') for field in record[tag]], [1, 2, 3])
+        self.assertEqual(original_record, copied_record)
+        self.assertTrue(all(record[tag] is not original_record[tag] for tag in record))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- encoding: utf-8 -*-
+import sys
+sys.path.append('../')
+
+import unittest
+
+import merger.merging_plan as p
+import merger.merging_rules as merging_rules
+import merger.merging_checks as merging_checks
+from merger.merger_errors import GenericError
+
+class TestMergingPlan(unittest.TestCase):
+
+    def test_resolve_function(self):
+        self.assertEqual(p.resolve_function('merging_rules.take_all'), merging_rules.take_all)
+        self.assertEqual(p.resolve_function('merging_checks.check_one_date_per_type'), merging_checks.check_one_date_per_type)
+
+    def test_resolve_function_unknown(self):
+        self.assertRaises(GenericError, p.resolve_function, 'merging_rules.not_existing_merger')
+        self.assertRaises(GenericError, p.resolve_function, 'not_existing_module.take_all')
+        self.assertRaises(GenericError, p.resolve_function, 'take_all')
+        self.assertRaises(GenericError, p.resolve_function, 'merger_settings.ORIGIN_SUBFIELD')
+
+    def test_compile_merging_rules(self):
+        plan = p.compile_merging_rules({'abstract': 'merging_rules.abstract_merger', 'objects': 'merging_rules.take_all'})
+        self.assertEqual(plan, {'520': ('merging_rules.abstract_merger', merging_rules.abstract_merger),
+                                '694': ('merging_rules.take_all', merging_rules.take_all)})
+        self.assertRaises(GenericError, p.compile_merging_rules, {'not a field': 'merging_rules.take_all'})
+
+    def test_compile_merging_checks(self):
+        plan = p.compile_merging_checks({'journal': {'warnings': {'merging_checks.check_longer_string_not_selected': ['p', 'z']}}})
+        self.assertEqual(plan, {'773': [('warnings', merging_checks.check_longer_string_not_selected, ['p', 'z'])]})
+
+    def test_compile_global_merging_checks(self):
+        plan = p.compile_global_merging_checks({'errors': ['global_merging_checks.check_collections_existence']})
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0][0], 'errors')
+        self.assertEqual(plan[0][1].__name__, 'check_collections_existence')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,16 +3,56 @@
 import sys
 sys.path.append('../')
 import unittest
+import random
 
 import merger.merging_rules as m
 import pipeline_settings
 from merger.merger_errors import EqualOrigins, EqualFields
+from merger.merger_settings import ORIGIN_SUBFIELD, TEMP_SUBFIELDS_LIST
+from merger.basic_functions import compare_fields_exclude_subfiels
+import invenio.bibrecord as bibrecord
 
 import logging
 logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
 logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
 logger.setLevel(logging.ERROR)
 
+def take_all_reference(fields1, fields2, tag):
+    """previous implementation of the take_all comparing each field with all the fields already taken"""
+    all_fields = []
+    for field1 in fields1 + fields2:
+        for field2 in all_fields:
+            if compare_fields_exclude_subfiels(field1, field2, strict=False, exclude_subfields=[ORIGIN_SUBFIELD]+TEMP_SUBFIELDS_LIST):
+                if bibrecord._compare_fields(field1, field2, strict=False):
+                    break
+                try:
+                    trusted, untrusted = m.get_trusted_and_untrusted_fields([field1], [field2], tag)
+                except EqualOrigins:
+                    try:
+                        trusted, untrusted = m._get_best_fields([field1], [field2], tag)
+                    except EqualFields:
+                        break
+                if trusted[0] == field2:
+                    break
+                del(all_fields[all_fields.index(field2)])
+                all_fields.append(field1)
+                break
+        else:
+            all_fields.append(field1)
+    return all_fields
+
+def random_fields(rand, size):
+    """function that returns a list of fields with few values, origins and primary subfields
+    so that many of them have the same signature"""
+    fields = []
+    for position in range(size):
+        subfields = [('a', rand.choice(['galaxies', 'stars', 'comets'])), (ORIGIN_SUBFIELD, rand.choice(['ARXIV', 'NED', 'A&A', 'AUTHOR', 'BAAA']))]
+        if rand.random() < 0.5:
+            subfields.append(('99', rand.choice(['True', 'False'])))
+        rand.shuffle(subfields)
+        fields.append((subfields, ' ', rand.choice([' ', '1']), '', position))
+    return fields
+
 class TestMergingRules(unittest.TestCase):
     ####################
     #test of get_trusted_and_untrusted_fields
@@ -162,6 +202,42 @@ class TestMergingRules(unittest.TestCase):
                ([('y', '2011arXiv1103.2570C'), ('2', 'eprint bibcode'), ('7', 'ADS metadata')], ' ', ' ', '', 3), 
                ([('a', 'arXiv:1103.2570'), ('2', 'arXiv'), ('7', 'ADS metadata')], ' ', ' ', '', 4)]
         self.assertEqual(m.take_all(fields1, fields2, '035'), out)
+
+    ####################
+    #test of the take_all against its previous implementation
+    def test_field_signature(self):
+        #the origin, the temporary subfields and the order of the subfields are not considered
+        field1 = ([('a', 'galaxies'), ('b', 'stars'), ('7', 'ARXIV'), ('99', 'True')], ' ', ' ', '', 1)
+        field2 = ([('b', 'stars'), ('7', 'NED'), ('a', 'galaxies')], ' ', ' ', '', 2)
+        self.assertEqual(m._field_signature(field1), m._field_signature(field2))
+        #the indicators are
+        field3 = ([('a', 'galaxies'), ('b', 'stars')], '1', ' ', '', 1)
+        self.assertNotEqual(m._field_signature(field1), m._field_signature(field3))
+    def test_take_all_replaced_earlier_field(self):
+        #the replaced field is the first one: the trusted one goes at the end
+        fields1 = [([('a', 'galaxies'), ('7', 'ARXIV')], ' ', ' ', '', 1), ([('a', 'stars'), ('7', 'ARXIV')], ' ', ' ', '', 2)]
+        fields2 = [([('a', 'comets'), ('7', 'A&A')], ' ', ' ', '', 1), ([('a', 'galaxies'), ('7', 'A&A')], ' ', ' ', '', 2)]
+        out = [([('a', 'stars'), ('7', 'ARXIV')], ' ', ' ', '', 2),
+               ([('a', 'comets'), ('7', 'A&A')], ' ', ' ', '', 1),
+               ([('a', 'galaxies'), ('7', 'A&A')], ' ', ' ', '', 2)]
+        self.assertEqual(m.take_all(fields1, fields2, '694'), out)
+        self.assertEqual(take_all_reference(fields1, fields2, '694'), out)
+    def test_take_all_equal_origins(self):
+        #same signature and same origin: the primary field replaces the other one
+        fields1 = [([('a', 'galaxies'), ('7', 'NED'), ('99', 'False')], ' ', ' ', '', 1), ([('a', 'stars'), ('7', 'NED')], ' ', ' ', '', 2)]
+        fields2 = [([('a', 'galaxies'), ('7', 'NED'), ('99', 'True')], ' ', ' ', '', 1), ([('a', 'galaxies'), ('7', 'NED'), ('99', 'False')], ' ', ' ', '', 2)]
+        out = [([('a', 'stars'), ('7', 'NED')], ' ', ' ', '', 2),
+               ([('a', 'galaxies'), ('7', 'NED'), ('99', 'True')], ' ', ' ', '', 1)]
+        self.assertEqual(m.take_all(fields1, fields2, '694'), out)
+        self.assertEqual(take_all_reference(fields1, fields2, '694'), out)
+    def test_take_all_random(self):
+        #the results are the same of the previous implementation, merging two sets or more sets one after the other
+        rand = random.Random(0)
+        for i in range(500):
+            fields_sets = [random_fields(rand, rand.randint(0, 8)) for j in range(rand.randint(2, 4))]
+            self.assertEqual(m.take_all(fields_sets[0], fields_sets[1], '694'), take_all_reference(fields_sets[0], fields_sets[1], '694'))
+            expected = reduce(lambda fields1, fields2: take_all_reference(fields1, fields2, '694'), fields_sets)
+            self.assertEqual(m.take_all_multi(fields_sets, '694'), expected)
     
     def test_reference_merger_1(self):
         #simple merge between two reference list tht have to be merged
@@ -279,5 +355,48 @@ class TestMergingRules(unittest.TestCase):
                ([('c', '2009-06-00'), ('t', 'main-date'), ('7', 'ADS metadata'), ('99', 'True')], ' ', ' ', '', 6)]
         self.assertEqual(sorted(m.pub_date_merger(fields1, fields2, '260')), sorted(out))
 
+    ####################
+    #test of author_merger
+    def test_author_merger_enrich(self):
+        fields1 = [([('a', 'Smith, John'), ('b', 'Smith, J'), ('7', 'PUBLISHER')], ' ', ' ', '', 1),
+                   ([('a', 'Doe, Alan'), ('b', 'Doe, A'), ('7', 'PUBLISHER')], ' ', ' ', '', 2)]
+        fields2 = [([('a', 'Smith, J.'), ('b', 'Smith, J'), ('u', 'CfA'), ('7', 'ARXIV')], ' ', ' ', '', 1)]
+        out = [([('a', 'Smith, John'), ('b', 'Smith, J'), ('7', 'PUBLISHER'), ('u', 'CfA')], ' ', ' ', '', 1),
+               ([('a', 'Doe, Alan'), ('b', 'Doe, A'), ('7', 'PUBLISHER')], ' ', ' ', '', 2)]
+        self.assertEqual(m.author_merger(fields1, fields2, '700'), out)
+        #the input fields are not modified
+        self.assertEqual(fields1[0][0], [('a', 'Smith, John'), ('b', 'Smith, J'), ('7', 'PUBLISHER')])
+    def test_author_merger_duplicated_names(self):
+        fields1 = [([('a', 'Smith, John'), ('b', 'Smith, J'), ('7', 'PUBLISHER')], ' ', ' ', '', 1),
+                   ([('a', 'Smith, Jane'), ('b', 'Smith, J'), ('7', 'PUBLISHER')], ' ', ' ', '', 2)]
+        fields2 = [([('a', 'Smith, J.'), ('b', 'Smith, J'), ('u', 'CfA'), ('7', 'ARXIV')], ' ', ' ', '', 1)]
+        self.assertEqual(m.author_merger(fields1, fields2, '700'), fields1)
+
+    ####################
+    #test of the versions of the merging rules taking all the sets of fields at once
+    def test_priority_based_multi_merger_1(self):
+        #three sets with different origins: the most trusted is picked
+        fields1 = [([('a', '10'), ('7', 'NED')], ' ', ' ', '', 1)]
+        fields2 = [([('a', '15'), ('7', 'A&A')], ' ', ' ', '', 1)]
+        fields3 = [([('a', '12'), ('7', 'ARXIV')], ' ', ' ', '', 1)]
+        out = [([('a', '15'), ('7', 'A&A')], ' ', ' ', '', 1)]
+        self.assertEqual(m.priority_based_multi_merger([fields1, fields2, fields3], '300'), out)
+        self.assertEqual(m.priority_based_merger(m.priority_based_merger(fields1, fields2, '300'), fields3, '300'), out)
+    def test_priority_based_multi_merger_2(self):
+        #same origin: the choice is the same of the merging two by two
+        fields1 = [([('a', '10'), ('7', 'NED')], ' ', ' ', '', 1)]
+        fields2 = [([('a', '15'), ('7', 'NED')], ' ', ' ', '', 1), ([('a', '16'), ('7', 'NED')], ' ', ' ', '', 2)]
+        fields3 = [([('a', '12'), ('7', 'ARXIV')], ' ', ' ', '', 1)]
+        self.assertEqual(m.priority_based_multi_merger([fields1, fields2, fields3], '300'), fields2)
+    def test_take_all_multi(self):
+        fields1 = [([('a', 'galaxies'), ('7', 'ARXIV')], ' ', ' ', '', 1)]
+        fields2 = [([('a', 'stars'), ('7', 'NED')], ' ', ' ', '', 1)]
+        fields3 = [([('a', 'galaxies'), ('7', 'A&A')], ' ', ' ', '', 1), ([('a', 'comets'), ('7', 'A&A')], ' ', ' ', '', 2)]
+        out = [([('a', 'stars'), ('7', 'NED')], ' ', ' ', '', 1),
+               ([('a', 'galaxies'), ('7', 'A&A')], ' ', ' ', '', 1),
+               ([('a', 'comets'), ('7', 'A&A')], ' ', ' ', '', 2)]
+        self.assertEqual(m.take_all_multi([fields1, fields2, fields3], '694'), out)
+        self.assertEqual(m.take_all(m.take_all(fields1, fields2, '694'), fields3, '694'), out)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+# coding=UTF-8
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the native converter from ADS XML to bibrecord:
+the result must be the same of the XSLT transformation
+'''
+
+import sys
+sys.path.append('../')
+import unittest
+import glob
+import libxml2
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+import misclibs.xml_transformer as x
+import misclibs.ads_xml_converter as c
+
+def get_results(xmlstring):
+    """returns the records obtained with the stylesheet and the ones obtained with the native converter"""
+    stylesheet = x.get_stylesheet('../misc/AdsXML2MarcXML_v2.xsl', logger)
+    result_xslt = x.create_record_from_libxml_obj(stylesheet.applyStylesheet(libxml2.parseDoc(xmlstring), None), logger)
+    result_native = c.create_record_from_ads_xml(libxml2.parseDoc(xmlstring), logger)
+    return (result_xslt, result_native)
+
+class TestAdsXmlConverter(unittest.TestCase):
+    """ All tests"""
+    def test_xml_files(self):
+        for xml_file in glob.glob('xmlfiles/*.xml'):
+            result_xslt, result_native = get_results(open(xml_file, 'r').read())
+            self.assertEqual(result_native, result_xslt)
+
+    def test_titles_and_authors(self):
+        xmlstring = '<?xml version="1.0" encoding="UTF-8"?><records><record bibcode="2012ApJ...1..1A"><metadata type="general" origin="PUBLISHER" primary="True">\
+            <creation_time>2012-04-27T13:34:58</creation_time><modification_time>2012-04-27T13:34:58</modification_time>\
+            <title lang="en">An English title</title><title lang="fr">Un titre fran\xc3\xa7ais</title><title>Another title</title>\
+            <author nr="1"><name><western>Smith, J.</western><normalized>Smith, J</normalized></name><affiliations><affiliation>CfA</affiliation></affiliations></author>\
+            <author nr="2"><name><western>Doe, A.</western></name><type>editor</type></author>\
+            <journal>ApJ, 1, 1</journal><canonical_journal>ApJ</canonical_journal><volume>1</volume><page>1</page><lastpage>10</lastpage>\
+            <databases><database>AST</database><database>PRE</database></databases><refereed>1</refereed><pubtype>article</pubtype>\
+            <reference bibcode="2000ApJ...1..1A" arxid="0001.0001">A reference</reference><abstract>Not Available</abstract>\
+            </metadata><metadata type="general" origin="ARXIV" alternate_journal="True"><journal>arXiv</journal><title>An English title</title></metadata></record></records>'
+        result_xslt, result_native = get_results(xmlstring)
+        self.assertEqual(result_native, result_xslt)
+
+    def test_iter_records_from_ads_xml(self):
+        for xml_file in glob.glob('xmlfiles/*.xml'):
+            xmlstring = open(xml_file, 'r').read()
+            self.assertEqual(list(c.iter_records_from_ads_xml(libxml2.parseDoc(xmlstring), logger, free_subtrees=True)),
+                             c.create_record_from_ads_xml(libxml2.parseDoc(xmlstring), logger))
+
+    def test_no_records(self):
+        self.assertEqual(c.create_record_from_ads_xml(libxml2.parseDoc('<records></records>'), logger), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
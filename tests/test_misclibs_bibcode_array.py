@@ -0,0 +1,91 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the compact arrays of bibcodes
+'''
+
+import sys
+sys.path.append('../')
+import pickle
+import random
+import unittest
+
+from merger.merger_errors import GenericError
+import misclibs.bibcode_array as bibcode_array
+from misclibs.bibcode_array import BibcodeArray
+
+BIBCODES = ['2011ApJ...731..%03dA' % i for i in range(0, 300, 3)] + ['1999PhDT', '2011arXiv1101.0001']
+
+class TestBibcodeArray(unittest.TestCase):
+    """ All tests"""
+    def setUp(self):
+        self.bibcodes = list(BIBCODES)
+        random.shuffle(self.bibcodes)
+        self.array = BibcodeArray(self.bibcodes + self.bibcodes[:10])
+
+    def test_sorted_list(self):
+        self.assertEqual(list(self.array), sorted(BIBCODES))
+        self.assertEqual(len(self.array), len(BIBCODES))
+        self.assertEqual(self.array[0], '1999PhDT')
+        self.assertEqual(self.array[-1], '2011arXiv1101.0001')
+        self.assertRaises(IndexError, self.array.__getitem__, len(BIBCODES))
+        self.assertEqual(len(self.array.data), len(BIBCODES) * bibcode_array.BIBCODE_LENGTH)
+
+    def test_slices(self):
+        expected = sorted(BIBCODES)
+        for start, stop in ((0, 10), (95, 200), (5, 2), (-3, None)):
+            group = self.array[start:stop]
+            self.assertTrue(isinstance(group, BibcodeArray))
+            self.assertEqual(list(group), expected[start:stop])
+        self.assertEqual(list(self.array[::7]), expected[::7])
+
+    def test_lookups(self):
+        for bibcode in BIBCODES:
+            self.assertTrue(bibcode in self.array)
+        for bibcode in ('1999PhD', '1999PhDT.', '2011ApJ...731..001A', '', 'x' * 30):
+            self.assertFalse(bibcode in self.array)
+        self.assertEqual(self.array.bisect('0000'), 0)
+        self.assertEqual(self.array.bisect('9999'), len(BIBCODES))
+
+    def test_set_operations(self):
+        other = ['2011ApJ...731..%03dA' % i for i in range(0, 300, 5)] + ['2012A&A...535A..1A']
+        self.assertEqual(list(self.array.union(other)), sorted(set(BIBCODES) | set(other)))
+        self.assertEqual(list(self.array - BibcodeArray(other)), sorted(set(BIBCODES) - set(other)))
+        self.assertEqual(list(self.array & BibcodeArray(other)), sorted(set(BIBCODES) & set(other)))
+        self.assertEqual(list(self.array - BibcodeArray()), sorted(BIBCODES))
+        self.assertEqual(list(BibcodeArray() | self.array), sorted(BIBCODES))
+        self.assertEqual(len(self.array & []), 0)
+
+    def test_build_in_chunks(self):
+        chunk_size = bibcode_array.BUILD_CHUNK_SIZE
+        bibcode_array.BUILD_CHUNK_SIZE = 7
+        try:
+            array = BibcodeArray(self.bibcodes + self.bibcodes)
+        finally:
+            bibcode_array.BUILD_CHUNK_SIZE = chunk_size
+        self.assertEqual(array, self.array)
+
+    def test_pickle(self):
+        for array in (self.array, BibcodeArray()):
+            self.assertEqual(pickle.loads(pickle.dumps(array, pickle.HIGHEST_PROTOCOL)), array)
+            self.assertEqual(pickle.loads(pickle.dumps(array)), array)
+
+    def test_bibcode_too_long(self):
+        self.assertRaises(GenericError, BibcodeArray, ['2011ApJ...731..001AB'])
+
+
+if __name__ == '__main__':
+    unittest.main()
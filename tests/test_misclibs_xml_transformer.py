@@ -23,6 +23,12 @@ sys.path.append('../')
 import unittest
 import libxml2, libxslt
 import re
+import os
+import glob
+import shutil
+import tempfile
+import threading
+from time import time
 
 import pipeline_settings
 
@@ -73,6 +79,66 @@ class TestXMLTransformer(unittest.TestCase):
         result_xml_transformer, result_invenio = get_result_invenio_xmltransformer(xmlstring)
         self.assertEqual(result_xml_transformer, result_invenio)
 
+    def test_tree_walk_parser_same_as_xpath(self):
+        #the records parsed walking the tree are the same of the ones parsed with XPath
+        #(the files in xmlfiles are ADS XML, the ones in misc are already MarcXML)
+        stylesheet = x.get_stylesheet('../misc/AdsXML2MarcXML_v2.xsl', logger)
+        marcxml_docs = [stylesheet.applyStylesheet(libxml2.parseFile(xml_file), None) for xml_file in glob.glob('xmlfiles/*.xml')]
+        marcxml_docs += [libxml2.parseFile(xml_file) for xml_file in glob.glob('../misc/*.xml')]
+        for marcxml in marcxml_docs:
+            self.assertEqual(x.create_record_from_libxml_obj(marcxml, logger), 
+                             x.create_record_from_libxml_obj_xpath(marcxml, logger))
+
+    def test_streaming_readers(self):
+        #the records read in streaming are the same of the ones parsed from the whole document
+        for xml_file in glob.glob('../misc/*.xml'):
+            expected = x.create_record_from_libxml_obj(libxml2.parseFile(xml_file), logger)
+            self.assertEqual(list(x.iter_records_from_marcxml_file(xml_file, logger)), expected)
+            self.assertEqual(list(x.iter_records_from_libxml_obj(libxml2.parseFile(xml_file), logger, free_subtrees=True)), expected)
+
+    def test_stylesheet_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            xslt = os.path.join(tmpdir, 'stylesheet.xsl')
+            shutil.copy('../misc/AdsXML2MarcXML_v2.xsl', xslt)
+            stylesheet = x.get_stylesheet(xslt, logger)
+            #the compiled stylesheet is reused
+            self.assertTrue(x.get_stylesheet(xslt, logger) is stylesheet)
+            #and reloaded if the file is modified
+            os.utime(xslt, (time() + 10, time() + 10))
+            self.assertFalse(x.get_stylesheet(xslt, logger) is stylesheet)
+            #the old stylesheet is not freed: another thread can still be using it
+            result = stylesheet.applyStylesheet(libxml2.parseFile('xmlfiles/test_2_create_record_from_libxml_obj.xml'), None)
+            self.assertTrue(result is not None)
+            #the threads that see the modification at the same time load the stylesheet only once
+            os.utime(xslt, (time() + 20, time() + 20))
+            loads = x.TRANSFORM_STATS['stylesheet_loads']
+            stylesheets = []
+            threads = [threading.Thread(target=lambda: stylesheets.append(x.get_stylesheet(xslt, logger))) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(x.TRANSFORM_STATS['stylesheet_loads'], loads + 1)
+            self.assertEqual(len(set(id(stylesheet) for stylesheet in stylesheets)), 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_libxml_document(self):
+        open_documents = x.OPEN_DOCUMENTS['count']
+        with x.LibxmlDocument(libxml2.parseFile('../misc/2011ApJ...741...91C.xml'), logger) as marcxml:
+            self.assertEqual(x.OPEN_DOCUMENTS['count'], open_documents + 1)
+            self.assertTrue(len(x.create_record_from_libxml_obj(marcxml, logger)) > 0)
+        self.assertEqual(x.OPEN_DOCUMENTS['count'], open_documents)
+        #the document is freed only once and the failed transformations are accepted
+        guard = x.LibxmlDocument(libxml2.parseDoc('<collections/>'), logger)
+        guard.free()
+        guard.free()
+        self.assertEqual(x.OPEN_DOCUMENTS['count'], open_documents)
+        with x.LibxmlDocument(False, logger) as marcxml:
+            self.assertTrue(marcxml is None)
+        self.assertEqual(x.check_open_documents(logger), open_documents)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
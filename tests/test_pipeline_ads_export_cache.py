@@ -0,0 +1,82 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the cache of the ADS XML exports
+'''
+
+import sys
+sys.path.append('../')
+import os
+import shutil
+import tempfile
+import unittest
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+from pipeline_ads_export_cache import ADSExportCache, evict_least_recently_used, format_stats
+
+class TestADSExportCache(unittest.TestCase):
+    """ All tests"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_and_put(self):
+        cache = ADSExportCache(self.directory, logger)
+        record_xml = '<record bibcode="2011ApJ...1A">%s</record>' % ('x' * 1000)
+        self.assertEqual(cache.get('2011ApJ...1A', '2011\t1'), None)
+        cache.put('2011ApJ...1A', '2011\t1', record_xml)
+        self.assertEqual(cache.get('2011ApJ...1A', '2011\t1'), record_xml)
+        #a different timestamp means that the record changed in ADS
+        self.assertEqual(cache.get('2011ApJ...1A', '2011\t2'), None)
+        #without timestamp nothing is cached
+        cache.put('2011ApJ...2A', None, record_xml)
+        self.assertEqual(cache.get('2011ApJ...2A', None), None)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 3, 'bytes_saved': len(record_xml), 'bytes_stored': len(record_xml)})
+        self.assertEqual(format_stats(cache.get_stats())[2], 'hit_rate\t0.2500')
+
+    def test_split_bibcodes(self):
+        cache = ADSExportCache(self.directory, logger)
+        cache.put('bib1', 't1', '<record bibcode="bib1"/>')
+        cache.put('bib2', 't2', '<record bibcode="bib2"/>')
+        bibcodes_to_retrieve, cached_records = cache.split_bibcodes(['bib1', 'bib2', 'bib3'], {'bib1': 't1', 'bib2': 'new', 'bib3': 't3'})
+        self.assertEqual(bibcodes_to_retrieve, ['bib2', 'bib3'])
+        self.assertEqual(cached_records, [('bib1', '<record bibcode="bib1"/>')])
+
+    def test_evict_least_recently_used(self):
+        cache = ADSExportCache(self.directory, logger)
+        for i in range(10):
+            cache.put('bib%d' % i, 't', str(i) * 100)
+            os.utime(cache._get_entry_path('bib%d' % i), (1000 + i, 1000 + i))
+        #the entry used now becomes the most recent one
+        cache.get('bib0', 't')
+        entry_size = os.path.getsize(cache._get_entry_path('bib1'))
+        removed_entries, removed_bytes = evict_least_recently_used(self.directory, entry_size * 4, logger)
+        self.assertEqual(removed_entries, 6)
+        self.assertEqual(removed_bytes, entry_size * 6)
+        cached = [i for i in range(10) if os.path.exists(cache._get_entry_path('bib%d' % i))]
+        self.assertEqual(cached, [0, 7, 8, 9])
+
+
+if __name__ == '__main__':
+    unittest.main()
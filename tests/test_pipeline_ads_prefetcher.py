@@ -0,0 +1,79 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the prefetch of the ADS records
+'''
+
+import sys
+sys.path.append('../')
+import threading
+import unittest
+from time import sleep
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+from pipeline_ads_prefetcher import ADSRecordsPrefetcher
+
+class CountingRecords(object):
+    """stand-in of ADSRecords that records the bibcodes retrieved"""
+    retrieved = []
+    lock = threading.Lock()
+
+    def __init__(self, format_type, export_format):
+        pass
+
+    def addCompleteRecord(self, bibcode):
+        sleep(0.001)
+        if bibcode.startswith('bad'):
+            raise IOError(bibcode)
+        with self.lock:
+            self.retrieved.append(bibcode)
+
+class TestADSRecordsPrefetcher(unittest.TestCase):
+    """ All tests"""
+    def test_prefetch(self):
+        CountingRecords.retrieved = []
+        bibcodes = ['bib%d' % i for i in range(50)] + ['bad1']
+        prefetcher = ADSRecordsPrefetcher(bibcodes, CountingRecords, 4, 5, logger)
+        prefetcher.start()
+        for i, bibcode in enumerate(bibcodes):
+            prefetcher.wait(bibcode)
+            #the threads never go further than the read ahead
+            self.assertTrue(prefetcher.next_position <= i + 1 + 5)
+        prefetcher.stop()
+        self.assertEqual(sorted(CountingRecords.retrieved), sorted(bibcodes[:-1]))
+        self.assertEqual(prefetcher.stats['warmed'], len(bibcodes))
+        self.assertEqual(prefetcher.stats['errors'], 1)
+
+    def test_stop_before_the_end(self):
+        CountingRecords.retrieved = []
+        bibcodes = ['bib%d' % i for i in range(50)]
+        prefetcher = ADSRecordsPrefetcher(bibcodes, CountingRecords, 4, 5, logger)
+        prefetcher.start()
+        prefetcher.wait(bibcodes[0])
+        prefetcher.stop()
+        self.assertTrue(len(CountingRecords.retrieved) <= 6)
+        #an unknown bibcode is not waited
+        prefetcher.wait('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
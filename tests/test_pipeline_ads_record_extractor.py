@@ -0,0 +1,168 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the extraction workers
+'''
+
+import sys
+sys.path.append('../')
+import unittest
+from time import sleep, time
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.CRITICAL)
+
+import pipeline_ads_record_extractor as e
+from pipeline_bibrecord_file import get_record_bibcode
+
+def make_record(bibcode):
+    """function that returns a merged record with the given bibcode"""
+    return {'970': [([('a', bibcode)], ' ', ' ', '', 1)]}
+
+class FakeDocument(object):
+    """ADS XML document with the bibcodes retrieved"""
+    def __init__(self, bibcodes):
+        self.bibcodes = bibcodes
+
+    def freeDoc(self):
+        pass
+
+class FakeADSRecords(object):
+    """ADS export where the bibcodes starting with BAD cannot be retrieved (slowly)"""
+    def __init__(self, *args):
+        self.bibcodes = []
+
+    def addCompleteRecord(self, bibcode):
+        if bibcode.startswith('BAD'):
+            sleep(0.05)
+            raise IOError('bibcode %s not found' % bibcode)
+        self.bibcodes.append(bibcode)
+
+    def export(self):
+        return FakeDocument(self.bibcodes)
+
+class FakeConverter(object):
+    """converter that gives a record for each bibcode of the document"""
+    @staticmethod
+    def iter_records_from_ads_xml(xmlobj, local_logger, free_subtrees=False):
+        return ([bibcode] for bibcode in xmlobj.bibcodes)
+
+class FakeMerger(object):
+    """merger that returns the record of the bibcode"""
+    @staticmethod
+    def merge_record(records):
+        return records[0], make_record(records[0])
+
+class TestExtractionWorker(unittest.TestCase):
+    """ All tests"""
+    SETTINGS = {'EXTRACT_STAGE_THREADS': 1, 'CONVERT_STAGE_THREADS': 1, 'MERGE_STAGE_PROCESSES': 0, 'PREFETCH_THREADS': 0,
+                'EXTRACT_BATCH_SIZE': 5, 'NUMBER_OF_RECORDS_PER_BIBFILE': 5, 'STAGE_QUEUE_SIZE': 16,
+                'NUMBER_OF_BIBCODES_PER_GROUP': 10, 'MAX_SKIPPED_BIBCODES': 3}
+
+    def setUp(self):
+        self.saved_settings = dict((name, getattr(e.settings, name)) for name in self.SETTINGS)
+        for name, value in self.SETTINGS.items():
+            setattr(e.settings, name, value)
+        self.saved_functions = (e.ADSRecords, e.ads_xml_converter, e.merger, e.write_bibrecord_file)
+        e.ADSRecords = FakeADSRecords
+        e.ads_xml_converter = FakeConverter
+        e.merger = FakeMerger
+        self.written = []
+        def write_bibrecord_file(merged_records, group_name, file_number, *args):
+            self.written.extend(get_record_bibcode(record) for record in merged_records)
+        e.write_bibrecord_file = write_bibrecord_file
+        #the good bibcodes come first: the ones of the first 4 files are written before the skipped ones stop the group,
+        #the last 3 are extracted and merged but not written
+        self.bibcodes = ['2011ApJ...%03dA' % i for i in range(23)] + ['BAD%02d' % i for i in range(7)]
+
+    def tearDown(self):
+        for name, value in self.saved_settings.items():
+            setattr(e.settings, name, value)
+        e.ADSRecords, e.ads_xml_converter, e.merger, e.write_bibrecord_file = self.saved_functions
+
+    def process_group(self, function, *args):
+        bibcodes_ok, bibcodes_probl, bibcodes_cost = [], [], {}
+        completed = function(['0000001', self.bibcodes, None, None], 'native', *(args + (None, bibcodes_ok, bibcodes_probl, bibcodes_cost,
+                             None, None, 'extraction', 'name', logger)))
+        return completed, bibcodes_ok
+
+    def test_staged_too_many_skipped(self):
+        completed, bibcodes_ok = self.process_group(e.process_group_staged, None)
+        self.assertFalse(completed)
+        #the bibcodes of the files already written are the done ones
+        self.assertEqual(len(self.written), 20)
+        self.assertEqual(sorted(bibcodes_ok), sorted(self.written))
+
+    def test_serial_too_many_skipped(self):
+        completed, bibcodes_ok = self.process_group(e.process_group_serial)
+        self.assertFalse(completed)
+        self.assertEqual(self.written, [])
+        self.assertEqual(bibcodes_ok, [])
+
+
+class TestWorkerRecycling(unittest.TestCase):
+    """ All tests"""
+    SETTINGS = {'MAX_NUMBER_OF_GROUP_TO_PROCESS': 5, 'WORKER_MAX_RSS_MB': 1000, 'WORKER_MAX_LIFETIME': 3600}
+
+    def setUp(self):
+        self.saved_settings = dict((name, getattr(e.settings, name)) for name in self.SETTINGS)
+        for name, value in self.SETTINGS.items():
+            setattr(e.settings, name, value)
+        self.saved_get_process_rss = e.get_process_rss
+        #the resident memory is the last of the values given, in MB
+        self.rss = [100.0]
+        e.get_process_rss = lambda: self.rss[0] if len(self.rss) == 1 else self.rss.pop(0)
+
+    def tearDown(self):
+        for name, value in self.saved_settings.items():
+            setattr(e.settings, name, value)
+        e.get_process_rss = self.saved_get_process_rss
+
+    def test_recycle_reasons(self):
+        now = time()
+        self.assertEqual(e.get_worker_recycle_reason(4, now), None)
+        self.assertEqual(e.get_worker_recycle_reason(5, now), 'Maximum amount of groups of bibcodes reached')
+        self.rss = [1500.0]
+        self.assertEqual(e.get_worker_recycle_reason(1, now), 'Maximum resident memory reached (1500 MB)')
+        self.rss = [100.0]
+        self.assertEqual(e.get_worker_recycle_reason(1, now - 4000), 'Maximum lifetime reached (4000 seconds)')
+
+    def test_no_limits(self):
+        #0 means no limit
+        for name in self.SETTINGS:
+            setattr(e.settings, name, 0)
+        self.rss = [100000.0]
+        self.assertEqual(e.get_worker_recycle_reason(1000, time() - 100000), None)
+
+    def test_group_rss_sampler(self):
+        #the peak is the one of the samples taken during the group, also if the memory went down before the end
+        self.rss = [200.0, 300.0, 900.0, 400.0]
+        sampler = e.GroupRssSampler(interval=0.01)
+        sampler.start()
+        sleep(0.2)
+        self.assertEqual(sampler.stop(), 900.0)
+        #a new group does not see the peaks of the previous ones
+        sampler = e.GroupRssSampler(interval=0.01)
+        sampler.start()
+        self.assertEqual(sampler.stop(), 400.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
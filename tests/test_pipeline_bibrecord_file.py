@@ -0,0 +1,95 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the indexed bibrecord files
+'''
+
+import sys
+sys.path.append('../')
+import os
+import pickle
+import tempfile
+import unittest
+
+from merger.merger_errors import GenericError
+from pipeline_bibrecord_file import BibrecordFileReader, write_bibrecord_file, \
+    is_indexed_bibrecord_file, iter_bibrecord_file, rewrite_as_pickled_file, get_record_bibcode
+
+def make_record(bibcode):
+    """function that returns a merged record with the given bibcode"""
+    return {'970': [([('a', bibcode)], ' ', ' ', '', 1)],
+            '245': [([('a', u'Title of %s \xe9' % bibcode), ('8', 'ADS metadata')], ' ', ' ', '', 2)]}
+
+class TestBibrecordFile(unittest.TestCase):
+    """ All tests"""
+    def setUp(self):
+        file_descriptor, self.filepath = tempfile.mkstemp()
+        os.close(file_descriptor)
+        self.records = [make_record('2011ApJ...%03dA' % i) for i in range(20)]
+
+    def tearDown(self):
+        for filepath in (self.filepath, self.filepath + '.tmp'):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def test_get_record_bibcode(self):
+        self.assertEqual(get_record_bibcode(self.records[3]), '2011ApJ...003A')
+        self.assertEqual(get_record_bibcode({}), None)
+
+    def test_stream_and_random_access(self):
+        for compress in (True, False):
+            write_bibrecord_file(self.filepath, self.records, compress)
+            self.assertTrue(is_indexed_bibrecord_file(self.filepath))
+            with BibrecordFileReader(self.filepath) as reader:
+                self.assertEqual(reader.compressed, compress)
+                self.assertEqual(list(reader), self.records)
+                self.assertEqual(len(reader), 20)
+                self.assertEqual(reader.bibcodes(), [get_record_bibcode(record) for record in self.records])
+                self.assertEqual(reader.get('2011ApJ...017A'), self.records[17])
+                self.assertEqual(reader.get('2011ApJ...005A'), self.records[5])
+                self.assertEqual(reader.get('unknown'), None)
+
+    def test_pickled_files(self):
+        #the files written by the previous versions of the pipeline
+        with open(self.filepath, 'wb') as file_obj:
+            pickle.dump(self.records, file_obj)
+        self.assertFalse(is_indexed_bibrecord_file(self.filepath))
+        self.assertEqual(list(iter_bibrecord_file(self.filepath)), self.records)
+        self.assertRaises(GenericError, BibrecordFileReader, self.filepath)
+        #and the indexed files rewritten for bibupload, without other files left
+        write_bibrecord_file(self.filepath, self.records)
+        rewrite_as_pickled_file(self.filepath)
+        with open(self.filepath, 'rb') as file_obj:
+            self.assertEqual(pickle.load(file_obj), self.records)
+        self.assertFalse(os.path.exists(self.filepath + '.tmp'))
+
+    def test_truncated_file(self):
+        write_bibrecord_file(self.filepath, self.records)
+        with open(self.filepath, 'rb') as file_obj:
+            data = file_obj.read()
+        with open(self.filepath, 'wb') as file_obj:
+            file_obj.write(data[:len(data) / 2])
+        self.assertRaises(GenericError, BibrecordFileReader, self.filepath)
+
+    def test_failed_write(self):
+        #a record that cannot be pickled stops the writing: no file that looks complete is left
+        records = self.records[:5] + [{'970': [([('a', lambda: None)], ' ', ' ', '', 1)]}] + self.records[5:]
+        self.assertRaises(Exception, write_bibrecord_file, self.filepath, records)
+        self.assertFalse(os.path.exists(self.filepath))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the ledger of the extractions
+'''
+
+import sys
+sys.path.append('../')
+import shutil
+import tempfile
+import unittest
+
+from pipeline_extraction_ledger import ExtractionLedger, has_extraction_ledger, \
+    EXTRACT, DELETE, PENDING, DONE, PROBLEM, UPLOADED
+
+class TestExtractionLedger(unittest.TestCase):
+    """ All tests"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_bibcodes_states(self):
+        self.assertFalse(has_extraction_ledger(self.directory))
+        ledger = ExtractionLedger(self.directory)
+        #a ledger without bibcodes is not valid
+        self.assertFalse(has_extraction_ledger(self.directory))
+        ledger.load_bibcodes(['bib%d' % i for i in range(10, 0, -1)], ['del1', 'del2'])
+        self.assertTrue(has_extraction_ledger(self.directory))
+        self.assertEqual(ledger.count_bibcodes(PENDING), 12)
+        ledger.set_bibcodes_state(['bib1', 'bib2', 'del1'], DONE)
+        ledger.set_problem_bibcodes([('bib3', 'IOError\tnot found')])
+        self.assertEqual(ledger.get_bibcodes(EXTRACT), ['bib10', 'bib4', 'bib5', 'bib6', 'bib7', 'bib8', 'bib9'])
+        self.assertEqual(ledger.get_bibcodes(DELETE), ['del2'])
+        self.assertEqual(ledger.get_bibcodes(EXTRACT, PROBLEM), ['bib3'])
+        ledger.close()
+        #the state is shared by all the connections
+        ledger = ExtractionLedger(self.directory)
+        self.assertEqual(ledger.count_bibcodes(DONE), 3)
+        ledger.close()
+
+    def test_files_states(self):
+        ledger = ExtractionLedger(self.directory)
+        ledger.load_bibcodes(['bib1', 'bib2', 'bib3'], [])
+        ledger.add_file('/extr/bibfiles/file_002')
+        ledger.add_file('/extr/bibfiles/file_001')
+        self.assertEqual(ledger.get_files_to_upload(), ['/extr/bibfiles/file_001', '/extr/bibfiles/file_002'])
+        #the file can be uploaded before the end of its group
+        ledger.set_file_uploaded('/extr/bibfiles/file_001', ['bib1', 'bib2'])
+        ledger.set_bibcodes_state(['bib1', 'bib2', 'bib3'], DONE)
+        self.assertEqual(ledger.get_files_to_upload(), ['/extr/bibfiles/file_002'])
+        self.assertEqual(ledger.get_bibcodes(EXTRACT, UPLOADED), ['bib1', 'bib2'])
+        self.assertEqual(ledger.get_bibcodes(EXTRACT, DONE), ['bib3'])
+        self.assertEqual(ledger.count_bibcodes(PENDING), 0)
+        ledger.close()
+
+    def test_ads_timestamps(self):
+        ledger = ExtractionLedger(self.directory)
+        #the timestamps are read from a generator, the last timestamp of a bibcode wins
+        ledger.load_ads_timestamps(('bib%04d' % i, '2011\t%d' % i) for i in range(1200))
+        ledger.load_ads_timestamps((('bib%04d' % i, '2012\t%d' % i) for i in range(0, 1200, 2)))
+        #the bibcodes are queried in more than one chunk
+        bibcodes = ['bib%04d' % i for i in range(1100)] + ['missing']
+        timestamps = ledger.get_ads_timestamps(bibcodes)
+        self.assertEqual(len(timestamps), 550)
+        self.assertEqual(timestamps['bib1098'], '2012\t1098')
+        self.assertFalse('bib0001' in timestamps)
+        self.assertEqual(ledger.get_ads_timestamps([]), {})
+        ledger.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
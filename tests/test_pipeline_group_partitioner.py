@@ -0,0 +1,151 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the partitioning of the bibcodes in groups
+'''
+
+import sys
+sys.path.append('../')
+import os
+import shutil
+import tempfile
+import unittest
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.ERROR)
+
+import pipeline_group_partitioner as p
+from misclibs.bibcode_array import BibcodeArray
+from pipeline_extraction_ledger import ExtractionLedger
+
+class TestGroupPartitioner(unittest.TestCase):
+    """ All tests"""
+    def test_same_costs(self):
+        #with the same cost for all the bibcodes the groups are the ones of the same size
+        bibcodes = ['bib%d' % i for i in range(10)]
+        groups = p.cost_balanced_grouper(3, bibcodes, [1.0] * 10)
+        self.assertEqual([group for group, cost in groups], [bibcodes[0:3], bibcodes[3:6], bibcodes[6:8], bibcodes[8:10]])
+        self.assertEqual(sum(cost for group, cost in groups), 10.0)
+
+    def test_balanced_costs(self):
+        bibcodes = ['bib%d' % i for i in range(8)]
+        costs = [10.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, ]
+        groups = p.cost_balanced_grouper(4, bibcodes, costs)
+        #the same number of groups, the order is kept and the expensive bibcode is alone
+        self.assertEqual([group for group, cost in groups], [bibcodes[0:1], bibcodes[1:8]])
+        self.assertEqual([cost for group, cost in groups], [10.0, 7.0])
+        #the maximum size of the groups is respected
+        groups = p.cost_balanced_grouper(4, bibcodes, costs, max_group_size=5)
+        self.assertEqual([group for group, cost in groups], [bibcodes[0:1], bibcodes[1:6], bibcodes[6:8]])
+        self.assertEqual(p.cost_balanced_grouper(4, [], []), [])
+
+    def test_groups_of_bibcode_array(self):
+        #the groups of a BibcodeArray are slices of the array, not lists of strings
+        bibcodes = BibcodeArray(['bib%02d' % i for i in range(10)])
+        groups = p.cost_balanced_grouper(3, bibcodes, [1.0] * 10)
+        self.assertTrue(all(isinstance(group, BibcodeArray) for group, cost in groups))
+        self.assertEqual([list(group) for group, cost in groups], [list(bibcodes[0:3]), list(bibcodes[3:6]), list(bibcodes[6:8]), list(bibcodes[8:10])])
+        grouper = p.AdaptiveGrouper(bibcodes, min_size=4, max_size=100, target_seconds=10, max_rss_mb=1000)
+        group, predicted_duration = grouper.next_group()
+        self.assertEqual(group, bibcodes[0:4])
+
+    def test_estimate_default_cost(self):
+        self.assertEqual(p.estimate_default_cost([None, None]), (0, 0.0, p.DEFAULT_BIBCODE_COST))
+        self.assertEqual(p.estimate_default_cost([1.0, None, 5.0, 2.0]), (3, 8.0, 2.0))
+        #the median is computed on a sample of the costs
+        number_of_costs, total_cost, default_cost = p.estimate_default_cost([float(i) for i in range(10000)], sample_size=1001)
+        self.assertEqual((number_of_costs, total_cost), (10000, sum(range(10000))))
+        self.assertTrue(4000 < default_cost < 6000)
+
+    def test_iter_bibcodes_cost(self):
+        bibcodes = BibcodeArray(['a', 'b', 'd', 'e'])
+        self.assertEqual(list(p.iter_bibcodes_cost(bibcodes, [('a', 1.0), ('b', 5.0), ('c', 2.0), ('e', 3.0)])), [1.0, 5.0, None, 3.0])
+        self.assertEqual(list(p.iter_bibcodes_cost(bibcodes, [])), [None] * 4)
+
+    def test_read_bibcodes_cost(self):
+        base_output_path = pipeline_settings.BASE_OUTPUT_PATH
+        pipeline_settings.BASE_OUTPUT_PATH = tempfile.mkdtemp()
+        try:
+            for directory, bibcodes_cost in (('2012_01_01-00_00_00', [('a', 1.0), ('b', 2.0)]), ('2012_02_01-00_00_00', [('d', 5.0), ('b', 3.0)]), ('2012_03_01-00_00_00', [('c', 4.0)])):
+                os.mkdir(os.path.join(pipeline_settings.BASE_OUTPUT_PATH, directory))
+                ledger = ExtractionLedger(os.path.join(pipeline_settings.BASE_OUTPUT_PATH, directory))
+                ledger.add_bibcodes_cost(bibcodes_cost)
+                ledger.close()
+            #an extraction without ledger
+            os.mkdir(os.path.join(pipeline_settings.BASE_OUTPUT_PATH, '2011_12_01-00_00_00'))
+            directories = p.get_previous_extraction_directories('2012_02_01-00_00_00')
+            self.assertEqual(directories, ['2012_02_01-00_00_00', '2012_01_01-00_00_00', '2011_12_01-00_00_00'])
+            #the costs are sorted by bibcode and the most recent cost wins
+            self.assertEqual(list(p.read_bibcodes_cost(directories)), [('a', 1.0), ('b', 3.0), ('d', 5.0)])
+            self.assertFalse(os.path.exists(os.path.join(pipeline_settings.BASE_OUTPUT_PATH, '2011_12_01-00_00_00', pipeline_settings.EXTRACTION_LEDGER)))
+            #the groups are built with the costs of the ledgers
+            number_of_bibcodes_per_group = pipeline_settings.NUMBER_OF_BIBCODES_PER_GROUP
+            pipeline_settings.NUMBER_OF_BIBCODES_PER_GROUP = 2
+            try:
+                groups = p.partition_bibcodes(BibcodeArray(['a', 'b', 'd', 'e']), '2012_02_01-00_00_00')
+            finally:
+                pipeline_settings.NUMBER_OF_BIBCODES_PER_GROUP = number_of_bibcodes_per_group
+            #the unknown bibcode "e" gets the median of the known costs (3.0)
+            self.assertEqual([(list(group), cost) for group, cost in groups], [(['a', 'b', 'd'], 9.0), (['e'], 3.0)])
+        finally:
+            shutil.rmtree(pipeline_settings.BASE_OUTPUT_PATH)
+            pipeline_settings.BASE_OUTPUT_PATH = base_output_path
+
+    def test_adaptive_grouper(self):
+        bibcodes = ['bib%d' % i for i in range(1000)]
+        grouper = p.AdaptiveGrouper(bibcodes, min_size=10, max_size=100, target_seconds=10, max_rss_mb=1000)
+        #the first group has the minimum size and no prediction
+        self.assertEqual(grouper.next_group(), (bibcodes[0:10], None))
+        #fast groups: the size grows at most of a factor 2
+        grouper.update(10, 1.0, 100)
+        self.assertEqual(grouper.group_size, 20)
+        group, predicted_duration = grouper.next_group()
+        self.assertEqual(group, bibcodes[10:30])
+        self.assertEqual(predicted_duration, 2.0)
+        #slow groups: the size shrinks towards the one that takes the target time
+        grouper.update(20, 40.0, 100)
+        grouper.update(20, 40.0, 100)
+        self.assertEqual(grouper.group_size, 28)
+        grouper.update(20, 40.0, 100)
+        self.assertEqual(grouper.group_size, 16)
+        #memory pressure: the size is halved, but not below the minimum
+        grouper.group_size = 80
+        grouper.update(80, 1.0, 1000)
+        self.assertEqual(grouper.group_size, 40)
+        grouper.update(40, 1.0, 2000)
+        grouper.update(40, 1.0, 2000)
+        self.assertEqual(grouper.group_size, 10)
+        #after one spike of memory the groups grow again (the peaks are the ones of each group)
+        grouper.group_size = 80
+        grouper.update(80, 1.0, 1500)
+        self.assertEqual(grouper.group_size, 40)
+        grouper.update(40, 1.0, 300)
+        grouper.update(80, 1.0, 300)
+        self.assertEqual(grouper.group_size, 100)
+        grouper.group_size = 10
+        #all the bibcodes are given once and in order
+        groups = [bibcodes[0:30]]
+        while grouper.has_bibcodes():
+            groups.append(grouper.next_group()[0])
+        self.assertEqual(sum(groups, []), bibcodes)
+
+
+if __name__ == '__main__':
+    unittest.main()
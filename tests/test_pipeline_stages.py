@@ -0,0 +1,103 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the chain of stages
+'''
+
+import sys
+sys.path.append('../')
+import threading
+import unittest
+from time import sleep
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.CRITICAL)
+
+import pipeline_stages as s
+
+class TestStagedPipeline(unittest.TestCase):
+    """ All tests"""
+    def test_all_items_processed(self):
+        results = []
+        lock = threading.Lock()
+        def write(item):
+            with lock:
+                results.append(item)
+            return []
+        stages = [s.Stage('split', lambda batch: batch, 3),
+                  s.Stage('square', lambda item: [item * item], 2),
+                  s.Stage('write', write, 1, finish=lambda: write('end'))]
+        pipeline = s.StagedPipeline(stages, 2, logger)
+        pipeline.run([range(i, i + 10) for i in range(0, 100, 10)])
+        #the final function is called once after all the items
+        self.assertEqual(results[-1], 'end')
+        self.assertEqual(sorted(results[:-1]), [i * i for i in range(100)])
+        stats = pipeline.get_stats()
+        self.assertEqual([(stage['items_in'], stage['items_out']) for stage in stats], [(10, 100), (100, 100), (100, 0)])
+
+    def test_bottleneck(self):
+        def slow(item):
+            sleep(0.01)
+            return [item]
+        stages = [s.Stage('fast', lambda item: [item], 1),
+                  s.Stage('slow', slow, 1)]
+        pipeline = s.StagedPipeline(stages, 1, logger)
+        pipeline.run(range(20))
+        stats = pipeline.get_stats()
+        self.assertTrue(stats[1]['utilisation'] > stats[0]['utilisation'])
+        #with a queue of one item the fast stage waits for the slow one
+        self.assertTrue(stats[0]['output_wait_time'] > stats[0]['busy_time'])
+
+    def test_error_stops_the_chain(self):
+        def fail(item):
+            if item == 5:
+                raise ValueError('item %d' % item)
+            return [item]
+        stages = [s.Stage('fail', fail, 2),
+                  s.Stage('write', lambda item: [], 1)]
+        pipeline = s.StagedPipeline(stages, 1, logger)
+        self.assertRaises(ValueError, pipeline.run, range(1000))
+
+    def test_items_discarded_when_stopped(self):
+        #each item of the second stage is a resource that has to be released by the last stage or by discard
+        opened = set()
+        lock = threading.Lock()
+        def open_resource(item):
+            with lock:
+                opened.add(item)
+            return [item]
+        def release(item):
+            with lock:
+                opened.discard(item)
+        def consume(item):
+            release(item)
+            if item == 20:
+                raise ValueError('item %d' % item)
+            sleep(0.001)
+            return []
+        stages = [s.Stage('open', open_resource, 2),
+                  s.Stage('consume', consume, 1)]
+        pipeline = s.StagedPipeline(stages, 5, logger, discard=release)
+        self.assertRaises(ValueError, pipeline.run, range(1000))
+        self.assertEqual(opened, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+@author: Giovanni Di Milia and Benoit Thiell
+File containing tests for the merge join of the ADS and Invenio timestamps
+'''
+
+import sys
+sys.path.append('../')
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import pipeline_settings
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.CRITICAL)
+
+from merger.merger_errors import UnsortedTimestampsError
+from misclibs.bibcode_array import BibcodeArray
+from pipeline_timestamp_diff import ADDED, MODIFIED, DELETED, check_sorted, merge_timestamp_files, \
+    select_bibcodes, fetch_in_chunks, iter_invenio_timestamps, read_invenio_timestamps, diff_timestamps
+
+#SQLite sorts the strings byte by byte without the MySQL BINARY operator
+SQLITE_ORDER_BY = 'bibcode'
+
+class InvenioStandIn(object):
+    """In-memory SQLite database with the Invenio tables used to read the timestamps"""
+    def __init__(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.text_factory = str
+        for table in ('97x', '98x', '99x'):
+            self.connection.execute('CREATE TABLE bib%s (id INTEGER PRIMARY KEY, tag TEXT, value TEXT)' % table)
+            self.connection.execute('CREATE TABLE bibrec_bib%s (id_bibrec INTEGER, id_bibxxx INTEGER)' % table)
+
+    def add_field(self, recid, tag, value):
+        table = tag[:2] + 'x'
+        cursor = self.connection.execute('INSERT INTO bib%s (tag, value) VALUES (?, ?)' % table, (tag, value))
+        self.connection.execute('INSERT INTO bibrec_bib%s (id_bibrec, id_bibxxx) VALUES (?, ?)' % table, (recid, cursor.lastrowid))
+
+    def add_record(self, recid, bibcode, timestamp, deleted=False):
+        if bibcode is not None:
+            self.add_field(recid, '970__a', bibcode)
+        self.add_field(recid, '971__a', 'other field')
+        self.add_field(recid, '995__a', timestamp)
+        if deleted:
+            self.add_field(recid, '980__c', 'DELETED')
+
+    def run_query(self, query):
+        return self.connection.execute(query).fetchall()
+
+    def run_query_in_chunks(self, query):
+        return fetch_in_chunks(self.connection.cursor(), query, 2)
+
+class TestTimestampDiff(unittest.TestCase):
+    """ All tests"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_timestamp_file(self, name, timestamps):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as fdesc:
+            for bibcode, timestamp in timestamps:
+                fdesc.write('%s\t%s\n' % (bibcode, timestamp))
+        return filename
+
+    def test_check_sorted(self):
+        self.assertEqual(list(check_sorted([('A', 1), ('B', 2), ('B', 3), ('C', 4)], 'test')), [('A', 1), ('B', 3), ('C', 4)])
+        self.assertRaises(UnsortedTimestampsError, list, check_sorted([('B', 1), ('A', 2)], 'test'))
+
+    def test_merge_timestamp_files(self):
+        gen = self.write_timestamp_file('gen', [('2000A&A...1..1G', 'gen1'), ('2000ApJ...1..1A', 'gen2')])
+        ast = self.write_timestamp_file('ast', [('2000ApJ...1..1A', 'ast2'), ('2000MNRAS.1..1M', 'ast3')])
+        pre = self.write_timestamp_file('pre', [('2000ApJ...1..1A', 'pre2'), ('2000arXiv0001.0001', 'pre4')])
+        #the most important file is the last one
+        self.assertEqual(list(merge_timestamp_files([gen, pre, ast])),
+                         [('2000A&A...1..1G', 'gen1'), ('2000ApJ...1..1A', 'ast2'), ('2000MNRAS.1..1M', 'ast3'), ('2000arXiv0001.0001', 'pre4')])
+        self.assertEqual([bibcode for bibcode, timestamp in merge_timestamp_files([gen, pre, ast], set(['2000arXiv0001.0001']))],
+                         ['2000A&A...1..1G', '2000ApJ...1..1A', '2000MNRAS.1..1M'])
+        unsorted = self.write_timestamp_file('unsorted', [('2000ApJ...1..1A', 'x'), ('2000A&A...1..1G', 'y')])
+        self.assertRaises(UnsortedTimestampsError, list, merge_timestamp_files([gen, unsorted]))
+        #the bibcodes too long for the BibcodeArrays are skipped
+        too_long = self.write_timestamp_file('too_long', [('2000A&A...1..1G', 'x'), ('2000ApJ...001..001AB', 'y'), ('2000MNRAS.1..1M', 'z')])
+        self.assertEqual(list(merge_timestamp_files([too_long])), [('2000A&A...1..1G', 'x'), ('2000MNRAS.1..1M', 'z')])
+
+    def test_select_bibcodes(self):
+        timestamps = [('2000A&A...1..1G', 'a'), ('2000ApJ...1..1A', 'b'), ('2000ApJ...10..1A', 'c'), ('2000MNRAS.1..1M', 'd')]
+        bibcodes = BibcodeArray(['2000ApJ...1..1', '2000ApJ...1..1A', '2000MNRAS.1..1M', '2001ApJ...1..1A'])
+        self.assertEqual(list(select_bibcodes(timestamps, bibcodes)), [('2000ApJ...1..1A', 'b'), ('2000MNRAS.1..1M', 'd')])
+        self.assertEqual(list(select_bibcodes(timestamps, BibcodeArray())), [])
+
+    def test_read_invenio_timestamps(self):
+        invenio = InvenioStandIn()
+        invenio.add_record(1, '2000MNRAS.1..1M', 't1')
+        invenio.add_record(2, '2000A&A...1..1G', 't2')
+        invenio.add_record(3, '2000ApJ...1..1A', 't3', deleted=True)
+        invenio.add_record(4, None, 't4')
+        invenio.add_record(5, '2000ApJ...1..1B', 't5')
+        invenio.add_record(6, '2000ApJ...001..001AB', 't6')
+        self.assertEqual(list(read_invenio_timestamps(invenio.run_query, SQLITE_ORDER_BY)),
+                         [('2000A&A...1..1G', 't2'), ('2000ApJ...1..1B', 't5'), ('2000MNRAS.1..1M', 't1')])
+        self.assertRaises(UnsortedTimestampsError, list, read_invenio_timestamps(invenio.run_query, SQLITE_ORDER_BY + ' DESC'))
+        #the same rows fetched a chunk at a time
+        self.assertEqual(list(read_invenio_timestamps(invenio.run_query_in_chunks, SQLITE_ORDER_BY)),
+                         list(read_invenio_timestamps(invenio.run_query, SQLITE_ORDER_BY)))
+        self.assertEqual(sorted(iter_invenio_timestamps(invenio.run_query_in_chunks)),
+                         [('2000A&A...1..1G', 't2'), ('2000ApJ...1..1B', 't5'), ('2000MNRAS.1..1M', 't1')])
+
+    def test_diff_timestamps(self):
+        ads = [('A', 1), ('B', 2), ('C', 3), ('E', 5), ('F', 6)]
+        invenio = [('B', 2), ('C', 0), ('D', 4), ('F', 6), ('G', 7)]
+        self.assertEqual(list(diff_timestamps(ads, invenio)),
+                         [(ADDED, 'A'), (MODIFIED, 'C'), (DELETED, 'D'), (ADDED, 'E'), (DELETED, 'G')])
+        self.assertEqual(list(diff_timestamps([], invenio)), [(DELETED, bibcode) for bibcode, timestamp in invenio])
+        self.assertEqual(list(diff_timestamps(ads, [])), [(ADDED, bibcode) for bibcode, timestamp in ads])
+
+    def test_same_result_as_in_memory(self):
+        #the comparison of the previous versions, with all the timestamps in dictionaries
+        ads_files = [self.write_timestamp_file('gen', [('2001AJ.....1..%03dA' % i, 'g%d' % (i % 3)) for i in range(0, 200, 2)]),
+                     self.write_timestamp_file('ast', [('2001AJ.....1..%03dA' % i, 'a%d' % (i % 4)) for i in range(0, 200, 3)])]
+        invenio = InvenioStandIn()
+        for i in range(1, 200, 5):
+            invenio.add_record(i, '2001AJ.....1..%03dA' % i, 'a%d' % (i % 2), deleted=(i % 7 == 0))
+        ads_timestamps = {}
+        for filename in ads_files:
+            for line in open(filename):
+                bibcode, timestamp = line[:-1].split('\t', 1)
+                ads_timestamps[bibcode] = timestamp
+        invenio_timestamps = dict(read_invenio_timestamps(invenio.run_query, SQLITE_ORDER_BY))
+        expected = sorted([(ADDED, bibcode) for bibcode in set(ads_timestamps) - set(invenio_timestamps)] +
+                          [(DELETED, bibcode) for bibcode in set(invenio_timestamps) - set(ads_timestamps)] +
+                          [(MODIFIED, bibcode) for bibcode in set(invenio_timestamps) & set(ads_timestamps)
+                           if ads_timestamps[bibcode] != invenio_timestamps[bibcode]], key=lambda item: item[1])
+        result = list(diff_timestamps(merge_timestamp_files(ads_files), read_invenio_timestamps(invenio.run_query, SQLITE_ORDER_BY)))
+        self.assertEqual(result, expected)
+        self.assertTrue(len([status for status, bibcode in result if status == MODIFIED]) > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()